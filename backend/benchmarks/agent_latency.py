@@ -0,0 +1,309 @@
+"""
+Offline end-to-end latency benchmark for the agents.
+
+Runs ShogunAgent / SamuraiAgent against local stand-ins for the LLM endpoints, SearxNG and
+the web pages (see `benchmarks/fakes.py`), and reports time to web results, time to the
+first answer token, total time and a per-stage breakdown.
+
+Only Redis is needed, e.g. `docker compose up redis`. Pass `--fake-redis` to use an
+in-memory fakeredis instead (`pip install fakeredis`).
+
+Usage, from the backend directory:
+
+    python -m benchmarks.agent_latency --agent samurai --iterations 10 --concurrency 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import socket
+import statistics
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.fakes import FakeServices, FakeSettings
+
+# Agent methods that are timed as stages, when the agent has them
+STAGES = [
+    "load_chat_history",
+    "get_thread_metadata",
+    "process_user_query",
+    "front_run_search",
+    "fetch_web_pages",
+    "fetch_web_pages_by_deadline",
+    "gen_answer",
+    "gen_answer_with_search_context",
+    "process_medium",
+    "gen_related_questions",
+    "upsert_thread_metadata",
+    "save_chat_history",
+]
+
+
+class RunRecorder:
+    """
+    Records the emitted events and the stage timings of a single agent run.
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.events: List[Tuple[float, str]] = []
+        self.stages: List[Tuple[str, float, float]] = []
+        self.finished_at: Optional[float] = None
+
+    def now(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def first_event(self, event: str) -> Optional[float]:
+        return next((t for t, e in self.events if e == event), None)
+
+    def max_answer_gap(self) -> float:
+        times = [t for t, e in self.events if e == "answer"]
+        return max((b - a for a, b in zip(times, times[1:])), default=0.0)
+
+    def metrics(self) -> Dict[str, Optional[float]]:
+        return {
+            "web_results": self.first_event("web_results"),
+            "first_answer_token": self.first_event("answer"),
+            "related_questions": self.first_event("related_questions"),
+            "total": self.finished_at,
+            "max_answer_gap": self.max_answer_gap(),
+        }
+
+
+current_run: contextvars.ContextVar[RunRecorder] = contextvars.ContextVar("current_run")
+
+
+class RecordingEmitter:
+    """
+    An EventEmitter that records when each event was emitted instead of sending it.
+    """
+
+    def __init__(self, recorder: RunRecorder) -> None:
+        self.recorder = recorder
+
+    async def emit(self, event: str, data: Dict) -> None:
+        self.recorder.events.append((self.recorder.now(), event))
+
+
+def timed(name: str, fn: Callable[..., Awaitable[Any]]) -> Callable[..., Any]:
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        recorder = current_run.get(None)
+        if recorder is None:
+            return await fn(*args, **kwargs)
+        started_at = recorder.now()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            recorder.stages.append((name, started_at, recorder.now()))
+
+    return wrapper
+
+
+async def monitor_loop_lag(lags: List[float], interval: float = 0.01) -> None:
+    """
+    Measure how late the event loop wakes up from short sleeps. Any blocking call in an
+    agent shows up here, as it stalls every other session served by the same loop.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started_at = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - started_at - interval)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def configure_env(base_url: str, redis_host: str) -> None:
+    # Must happen before sensei_search is imported, its config is read at import time
+    os.environ.update(
+        {
+            "ENV": "development",
+            "LOGURU_LEVEL": os.getenv("LOGURU_LEVEL", "WARNING"),
+            "SEARXNG_URL": base_url,
+            "SEARCH_PROVIDERS": "searxng",
+            "REDIS_HOST": redis_host,
+            "BING_API_KEY": "",
+            "SM_MODEL_URL": f"{base_url}/v1/",
+            "SM_MODEL": "fake-small",
+            "SM_MODEL_API_KEY": "fake",
+            "MD_MODEL_URL": f"{base_url}/v1/",
+            "MD_MODEL": "fake-medium",
+            "MD_MODEL_API_KEY": "fake",
+        }
+    )
+
+
+async def run_once(agent_cls: Any, question: str) -> RunRecorder:
+    recorder = RunRecorder()
+    current_run.set(recorder)
+
+    agent = agent_cls(
+        emitter=RecordingEmitter(recorder),
+        thread_id=str(uuid.uuid4()),
+        user_id=str(uuid.uuid4()),
+    )
+    for stage in STAGES:
+        if hasattr(agent, stage):
+            setattr(agent, stage, timed(stage, getattr(agent, stage)))
+
+    await agent.run(question)
+    recorder.finished_at = recorder.now()
+    return recorder
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(recorders: List[RunRecorder]) -> Dict[str, Any]:
+    metrics: Dict[str, Dict[str, float]] = {}
+    for name in recorders[0].metrics():
+        values = [v for r in recorders if (v := r.metrics()[name]) is not None]
+        if values:
+            metrics[name] = {
+                "p50": statistics.median(values),
+                "p95": percentile(values, 95),
+                "max": max(values),
+            }
+
+    stages: Dict[str, Dict[str, float]] = {}
+    for name in STAGES + ["search"]:
+        spans = [(s, e) for r in recorders for n, s, e in r.stages if n == name]
+        if spans:
+            stages[name] = {
+                "start": statistics.mean(s for s, _ in spans),
+                "duration": statistics.mean(e - s for s, e in spans),
+            }
+
+    return {"runs": len(recorders), "metrics": metrics, "stages": stages}
+
+
+def print_report(summary: Dict[str, Any], requests: Dict[str, int]) -> None:
+    print(f"\n{summary['runs']} runs\n")
+    print(f"{'metric':<22}{'p50':>10}{'p95':>10}{'max':>10}")
+    for name, values in summary["metrics"].items():
+        print(
+            f"{name:<22}{values['p50']:>10.3f}{values['p95']:>10.3f}{values['max']:>10.3f}"
+        )
+
+    print(f"\n{'stage (mean)':<32}{'start':>10}{'duration':>10}")
+    for name, values in sorted(
+        summary["stages"].items(), key=lambda item: item[1]["start"]
+    ):
+        print(f"{name:<32}{values['start']:>10.3f}{values['duration']:>10.3f}")
+
+    print(f"\nmax event loop lag: {summary['max_loop_lag']:.3f}")
+    print(f"upstream requests: {requests}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    settings = FakeSettings(
+        small_llm_latency=args.small_llm_latency,
+        llm_ttft=args.llm_ttft,
+        llm_tokens_per_second=args.llm_tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        search_latency=args.search_latency,
+        page_latency=args.page_latency,
+    )
+    fakes = FakeServices(settings)
+    port = free_port()
+    configure_env(f"http://127.0.0.1:{port}", args.redis_host)
+    fakes.start_in_thread("127.0.0.1", port)
+
+    from sensei_search.agents import SamuraiAgent
+    from sensei_search.agents.shogun import ShogunAgent
+    from sensei_search.answer_framing import get_framing_stats
+    from sensei_search.chat_store import ChatStore
+    from sensei_search.extractor import Extractor
+    from sensei_search.http_client import HttpClient
+    from sensei_search.llm_clients import LLMClients
+    from sensei_search.tools.search import CachedSearchTool
+
+    if args.fake_redis:
+        import fakeredis
+
+        ChatStore().redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    CachedSearchTool.search = timed("search", CachedSearchTool.search)  # type: ignore[method-assign]
+
+    await HttpClient().start()
+    Extractor().start()
+
+    agent_cls = {"shogun": ShogunAgent, "samurai": SamuraiAgent}[args.agent]
+
+    recorders: List[RunRecorder] = []
+    lags: List[float] = []
+    monitor = asyncio.ensure_future(monitor_loop_lag(lags))
+    try:
+        for i in range(args.iterations):
+            questions = [
+                f"How far is Mars? bench-{i}x{j}{uuid.uuid4().hex[:6]}"
+                for j in range(args.concurrency)
+            ]
+            recorders += await asyncio.gather(
+                *[run_once(agent_cls, question) for question in questions]
+            )
+        llm_clients = LLMClients().stats()
+        answer_framing = get_framing_stats()
+    finally:
+        monitor.cancel()
+        await HttpClient().close()
+        await LLMClients().close()
+        Extractor().close()
+        fakes.stop_thread()
+
+    summary = summarize(recorders)
+    summary["max_loop_lag"] = max(lags, default=0.0)
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    **summary,
+                    "requests": fakes.requests,
+                    "llm_clients": llm_clients,
+                    "answer_framing": answer_framing,
+                },
+                indent=2,
+            )
+        )
+    else:
+        print_report(summary, fakes.requests)
+        print(f"LLM clients: {llm_clients}")
+        print(f"Answer framing: {answer_framing}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--agent", choices=["shogun", "samurai"], default="shogun")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="Agent runs started at once"
+    )
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--fake-redis", action="store_true")
+    parser.add_argument("--small-llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-ttft", type=float, default=0.5)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--page-latency", type=float, default=0.2)
+    parser.add_argument("--json", action="store_true", help="Print a JSON report")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,223 @@
+"""
+Local stand-ins for the services the agents talk to: an OpenAI-compatible chat
+completions endpoint, a SearxNG JSON endpoint, web pages and image thumbnails.
+
+All of them are served by a single aiohttp app so that the benchmark only needs one port.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List
+from urllib.parse import urlencode
+
+from aiohttp import web
+
+QUERY_TAG_RE = re.compile(r"bench-\w+")
+
+LOREM = (
+    "Mars is the fourth planet from the Sun. It is a dusty, cold, desert world with a "
+    "very thin atmosphere. Olympus Mons, the largest volcano in the solar system, rises "
+    "about 22 kilometers above the surrounding plains."
+)
+
+
+@dataclass
+class FakeSettings:
+    # Latency of a non-streaming (small model) completion
+    small_llm_latency: float = 0.3
+    # Time to the first token of a streaming (medium model) completion
+    llm_ttft: float = 0.5
+    llm_tokens_per_second: float = 50.0
+    answer_tokens: int = 300
+    search_latency: float = 0.3
+    page_latency: float = 0.2
+    pages: int = 8
+
+
+class FakeServices:
+    def __init__(self, settings: FakeSettings) -> None:
+        self.settings = settings
+        self.base_url = ""
+        self.requests: Dict[str, int] = {"llm": 0, "search": 0, "page": 0, "image": 0}
+        self._runner: web.AppRunner
+        self._loop: asyncio.AbstractEventLoop
+        self._thread: threading.Thread
+
+    async def start(self, host: str, port: int) -> None:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/search", self.search)
+        app.router.add_get("/pages/{page}", self.page)
+        app.router.add_get("/images/{image}", self.image)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self.base_url = f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        await self._runner.cleanup()
+
+    def start_in_thread(self, host: str, port: int) -> None:
+        """
+        Serve from a separate thread with its own event loop, so that the fakes keep
+        responding even when the agent blocks its event loop (e.g. with a sync client).
+        """
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def serve() -> None:
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start(host, port))
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop_thread(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests["llm"] += 1
+        body = await request.json()
+        prompt = "\n".join(str(m.get("content", "")) for m in body["messages"])
+
+        if body.get("stream"):
+            return await self._stream_answer(request, body["model"])
+
+        await asyncio.sleep(self.settings.small_llm_latency)
+        return web.json_response(_completion(body["model"], _small_model_reply(prompt)))
+
+    async def _stream_answer(
+        self, request: web.Request, model: str
+    ) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        await asyncio.sleep(self.settings.llm_ttft)
+        interval = 1.0 / self.settings.llm_tokens_per_second
+        words = LOREM.split()
+        for i in range(self.settings.answer_tokens):
+            token = words[i % len(words)] + " "
+            if i % 25 == 0:
+                token += f"[{i % 3 + 1}] "
+            chunk = _chunk(model, token)
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(interval)
+
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def search(self, request: web.Request) -> web.Response:
+        self.requests["search"] += 1
+        await asyncio.sleep(self.settings.search_latency)
+        query = request.query.get("q", "")
+
+        results: List[Dict[str, Any]] = []
+        for i in range(self.settings.pages):
+            results.append(
+                {
+                    "url": f"{self.base_url}/pages/{i}?{urlencode({'q': query})}",
+                    "title": f"Result {i} for {query}",
+                    "content": LOREM,
+                    "engines": ["fake"],
+                    "score": 10.0 - i,
+                    "category": "general",
+                }
+            )
+        for i in range(4):
+            results.append(
+                {
+                    "url": f"{self.base_url}/pages/{i}",
+                    "title": f"Image {i}",
+                    "content": "",
+                    "img_src": f"{self.base_url}/images/{i}.png",
+                    "engines": ["fake"],
+                    "score": 5.0,
+                    "category": "images",
+                }
+            )
+            results.append(
+                {
+                    "url": f"{self.base_url}/videos/{i}",
+                    "title": f"Video {i}",
+                    "content": "",
+                    "engines": ["fake"],
+                    "score": 5.0,
+                    "category": "videos",
+                }
+            )
+        return web.json_response({"results": results})
+
+    async def page(self, request: web.Request) -> web.Response:
+        self.requests["page"] += 1
+        page = int(request.match_info["page"])
+        # Later pages are slower, like the long tail of real websites
+        await asyncio.sleep(self.settings.page_latency * (1 + page / 2))
+        paragraphs = "".join(f"<p>{LOREM} ({page}.{i})</p>" for i in range(30))
+        html = (
+            f"<html><head><title>Page {page}</title></head><body><nav>Home</nav>"
+            f"<article><h1>Page {page}</h1>{paragraphs}</article></body></html>"
+        )
+        return web.Response(text=html, content_type="text/html")
+
+    async def image(self, request: web.Request) -> web.Response:
+        self.requests["image"] += 1
+        return web.Response(body=b"\x89PNG", content_type="image/png")
+
+
+def _small_model_reply(prompt: str) -> str:
+    if "follow-up" in prompt:
+        return "1. How big is Mars?\n2. Does Mars have water?\n3. How long is a day on Mars?"
+    # Benchmark queries carry a unique tag, echo it so that every question gets its
+    # own search query and caches don't hide the latency
+    tag = QUERY_TAG_RE.search(prompt)
+    search_query = f"how far is mars {tag.group(0) if tag else ''}".strip()
+    return json.dumps(
+        {
+            "search_query": search_query,
+            "needs_search": True,
+            "needs_image": True,
+            "needs_video": True,
+            "content_violation": False,
+            "has_math": False,
+        }
+    )
+
+
+def _completion(model: str, content: str) -> Dict[str, Any]:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _chunk(model: str, content: str) -> Dict[str, Any]:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+    }
@@ -3,30 +3,38 @@ import re
 from datetime import datetime
 from typing import Any, List, Optional
 
-from openai import AsyncOpenAI, OpenAI
-
 from sensei_search.agents.samurai.prompts import (
     answer_prompt,
-    classification_prompt,
+    query_understanding_prompt,
     related_questions_prompt,
-    search_prompt,
 )
-from sensei_search.base_agent import BaseAgent, EnrichedQuery, NoAccessError, QueryTags
-from sensei_search.chat_store import ThreadMetadata
+from sensei_search.base_agent import BaseAgent, EnrichedQuery, QueryTags
 from sensei_search.config import (
     MD_MODEL,
     MD_MODEL_API_KEY,
+    MD_MODEL_CONTEXT_TOKENS,
     MD_MODEL_URL,
+    MEDIUM_SEARCH_TIMEOUT,
+    QUERY_UNDERSTANDING_TIMEOUT,
+    RELATED_QUESTIONS_TIMEOUT,
+    RERANK_ENABLED,
     SM_MODEL,
     SM_MODEL_API_KEY,
+    SM_MODEL_CONTEXT_TOKENS,
     SM_MODEL_URL,
+    WEB_PAGES_TIMEOUT,
 )
+from sensei_search.context_packing import pack_documents
+from sensei_search.llm_clients import LLMClients
+from sensei_search.llm_memo import memoized_completion
 from sensei_search.logger import logger
 from sensei_search.models import MetaData
+from sensei_search.pipeline import Pipeline
+from sensei_search.reranker import rerank_pages
 from sensei_search.tools.search import Category
 from sensei_search.tools.search import Input as SearchInput
 from sensei_search.tools.search import TopResults, get_search_tool
-from sensei_search.utils import create_slug
+from sensei_search.web_pages import DeadlineFetchResult
 
 FETCH_WEBPAGE_TIMEOUT = 3
 
@@ -69,88 +77,37 @@ class SamuraiAgent(BaseAgent):
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
 
+    def web_pages_to_string(self, web_pages: List[str], budget: int) -> str:
+        # Pages are packed into the token budget of the model the context is meant for
+        web_pages = pack_documents(web_pages, budget)["documents"]
+        # Pages that couldn't be fetched in time are skipped, but the document numbers
+        # are kept so that citations still match the web results shown to the user.
+        return "\n\n".join(
+            [f"Document: {i + 1}\n{page}" for i, page in enumerate(web_pages) if page]
+        )
+
     async def process_user_query(self) -> EnrichedQuery:
         """
         Generate a search query based on the chat history and the user's current query,
-        and classify the query to determine its nature and required handling.
+        and classify the query to determine its nature and required handling. Both come
+        from a single small model call.
         """
-        client = AsyncOpenAI(base_url=SM_MODEL_URL, api_key=SM_MODEL_API_KEY)
-
         # We only load user's queries from the chat history to save LLM tokens
         chat_history = self.chat_history_to_string(["user"])
         user_current_query = self.chat_messages[-1]["content"]
 
-        materialized_search_prompt = search_prompt.format(
+        prompt = query_understanding_prompt.format(
             chat_history=chat_history,
             user_current_query=user_current_query,
-            current_date=datetime.now().isoformat(),
-        )
-
-        materialized_classify_prompt = classification_prompt.format(
-            chat_history=chat_history,
-            user_current_query=user_current_query,
-        )
-
-        search_response, classification_response = await asyncio.gather(
-            client.chat.completions.create(
-                model=SM_MODEL,
-                messages=[{"role": "user", "content": materialized_search_prompt}],
-                temperature=0.0,
-                max_tokens=500,
-            ),
-            client.chat.completions.create(
-                model=SM_MODEL,
-                messages=[{"role": "user", "content": materialized_classify_prompt}],
-                temperature=0.0,
-                max_tokens=500,
-            ),
-        )
-
-        classify_response = classification_response.choices[0].message.content
-
-        if not classify_response:
-            raise ValueError("Classification response is empty.")
-
-        classify_response = classify_response.strip('"').strip("'")
-
-        logger.info(classify_response)
-
-        # need_search, need_image, need_video, violation, has_math
-        tags_dict = {}
-        for tag in classify_response.split(","):
-            try:
-                key, value = tag.strip().split(":")
-                tags_dict[key] = value
-            except ValueError:
-                logger.warning(f"Skipping ill-formatted tag: {tag}")
-
-        query_tags = QueryTags(
-            needs_search=tags_dict.get("SEARCH_NEEDED", "YES").strip() == "YES",
-            needs_image=tags_dict.get("SEARCH_IMAGE", "NO").strip() == "YES",
-            needs_video=tags_dict.get("SEARCH_VIDEO", "NO").strip() == "YES",
-            content_violation=tags_dict.get("CONTENT_VIOLATION", "NO").strip() == "YES",
-            has_math=tags_dict.get("MATH", "NO").strip() == "YES",
+            # Only the date, so that the prompt (and its memoized output) is stable all day
+            current_date=datetime.now().date().isoformat(),
         )
 
-        query = search_response.choices[0].message.content
-
-        if not query:
-            raise ValueError("Search query response is empty.")
-
-        query = query.strip('"').strip("'")
-
-        enriched_query = EnrichedQuery(search_query=query, tags=query_tags)
-
-        logger.info(enriched_query)
-
-        return enriched_query
+        return await self.understand_query(prompt)
 
     async def gen_related_questions(self, web_pages: List[str]) -> List[str]:
-        search_results = "\n\n".join(
-            [f"Document: {i + 1}\n{page}" for i, page in enumerate(web_pages)]
-        )
-        # We are capping the search results at 5000 words, so that we can use the small model
-        search_results = search_results[:5000]
+        # The context is kept small, so that we can use the small model
+        search_results = self.web_pages_to_string(web_pages, SM_MODEL_CONTEXT_TOKENS)
 
         user_current_query = self.chat_messages[-1]["content"]
         prompt = related_questions_prompt.format(
@@ -159,24 +116,17 @@ class SamuraiAgent(BaseAgent):
 
         try:
 
-            client = OpenAI(
-                base_url=SM_MODEL_URL,
-                api_key=SM_MODEL_API_KEY,
-            )
-            response = (
-                client.chat.completions.create(
-                    model=SM_MODEL,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.0,
-                    max_tokens=500,
-                    stream=False,
-                ),
+            client = LLMClients().get(SM_MODEL_URL, SM_MODEL_API_KEY)
+            content = await memoized_completion(
+                client,
+                model=SM_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+                max_tokens=500,
+                stream=False,
             )
 
-            return [
-                re.sub(r"^\s*\d+\.\s*", "", item)
-                for item in (response[0].choices[0].message.content or "").split("\n")
-            ]
+            return [re.sub(r"^\s*\d+\.\s*", "", item) for item in content.split("\n")]
         except Exception as e:
             logger.exception(f"Error generating related questions: {e}")
             return []
@@ -190,9 +140,7 @@ class SamuraiAgent(BaseAgent):
         # We only load user's queries from the chat history to save LLM tokens
         chat_history = self.chat_history_to_string(["user"])
 
-        search_results = "\n\n".join(
-            [f"Document: {i + 1}\n{page}" for i, page in enumerate(web_pages)]
-        )
+        search_results = self.web_pages_to_string(web_pages, MD_MODEL_CONTEXT_TOKENS)
 
         system_prompt = answer_prompt.format(
             chat_history=chat_history,
@@ -200,9 +148,9 @@ class SamuraiAgent(BaseAgent):
             current_date=datetime.now().isoformat(),
         )
 
-        client = OpenAI(base_url=MD_MODEL_URL, api_key=MD_MODEL_API_KEY)
+        client = LLMClients().get(MD_MODEL_URL, MD_MODEL_API_KEY)
 
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=MD_MODEL,
             messages=[
                 {
@@ -231,11 +179,14 @@ class SamuraiAgent(BaseAgent):
             stream=True,
         )
 
-        for chunk in response:
-            if chunk.choices[0].delta.content:
-                final_answer_parts.append(chunk.choices[0].delta.content)
-                # Send the answer to the user ASAP
-                await self.emit_answer(chunk.choices[0].delta.content)
+        # Closing the stream aborts the request if the client went away
+        async with response:
+            async for chunk in response:
+                if chunk.choices[0].delta.content:
+                    final_answer_parts.append(chunk.choices[0].delta.content)
+                    # Send the answer to the user ASAP
+                    await self.emit_answer(chunk.choices[0].delta.content)
+        await self.flush_answer()
 
         return "".join(final_answer_parts)
 
@@ -257,93 +208,131 @@ class SamuraiAgent(BaseAgent):
         await self.emit_medium_results(medium_results)
         return medium_results
 
-    async def run(self, user_message: str) -> None:
-        """
-        Entry point for the agent.
-        """
-        logger.info("samurai_agent runs")
-        # To save LLM tokens, we only load user's queries from the chat history
-        # This can already give us a good context for generating search queries and answers
-        _, thread_metadata = await asyncio.gather(
-            self.load_chat_history(self.thread_id, ["user"]), self.get_thread_metadata()
-        )
-
-        logger.info(f"Thread metadata: {thread_metadata}")
-
-        # Check if the user has access to the thread
-        # We assume there is no easy way to guess the uuid of a user
-        if thread_metadata and thread_metadata["user_id"] != self.user_id:
-            logger.warning(
-                f"User {self.user_id} does not have access to thread {self.thread_id}"
-            )
-            raise NoAccessError()
-
-        logger.info(f"User original query: {user_message}")
-
-        # Append user message to chat history
-        self.append_message(role="user", content=user_message)
-
-        enriched_query = await self.process_user_query()
-        query = enriched_query["search_query"]
-
-        logger.info(f"Search Query: {query}")
+    async def search_web(self, enriched_query: EnrichedQuery) -> TopResults:
+        logger.info(f"Search Query: {enriched_query['search_query']}")
 
         # We should check if the tags contain 'needs_search'. But for now, we always perform a search
         tags = enriched_query["tags"]
-        if tags is None or tags["needs_search"]:
-            search_input = SearchInput(query=query, categories=[Category.general])
-            metadata = MetaData(has_math=True if tags and tags["has_math"] else False)
+        if tags is not None and not tags["needs_search"]:
+            return TopResults(general=[], images=[], videos=[])
 
-            search_results, _ = await asyncio.gather(
-                get_search_tool().search(search_input),
-                self.emit_metadata(metadata=metadata),
-            )
-        else:
-            search_results = TopResults(general=[], images=[], videos=[])
-
-        general_results = search_results["general"]
-
-        _, web_pages = await asyncio.gather(
-            # Sending search results to the client ASAP
-            self.emit_web_results(general_results),
-            # Fetch web page contents for llm to use as context
-            self.fetch_web_pages(general_results[:5]),
+        search_input = SearchInput(
+            query=enriched_query["search_query"], categories=[Category.general]
         )
+        metadata = MetaData(has_math=True if tags and tags["has_math"] else False)
 
-        answer, medium_results, related_questions = await asyncio.gather(
-            self.gen_answer(web_pages),
-            self.process_medium(query, tags),
-            self.gen_related_questions(web_pages),
+        search_results, _ = await asyncio.gather(
+            get_search_tool().search(search_input),
+            self.emit_metadata(metadata=metadata),
         )
+        return search_results
 
-        logger.info("Answer generated successfully.")
-
-        logger.debug(f"Answer for query {query} is {answer}")
-        logger.debug(f"Related questions: {related_questions}")
-
-        await self.emit_related_questions(related_questions)
+    async def get_web_pages(
+        self, enriched_query: EnrichedQuery, search_results: TopResults
+    ) -> DeadlineFetchResult:
+        """
+        Fetch the web page contents for llm to use as context, along with the URLs of
+        the pages that missed the deadline.
+        """
+        web_pages = await self.fetch_web_pages_by_deadline(
+            search_results["general"][:5]
+        )
 
-        if not thread_metadata:
-            # Create a new thread metadata
-            thread_metadata = ThreadMetadata(
-                name=user_message[:50],
-                user_id=self.user_id,
-                created_at=datetime.now().isoformat(),
-                slug=create_slug(user_message),
-                related_questions=related_questions,
-            )
-            # We send the thread metadata to the client for it save it in the local storage
-            await asyncio.gather(
-                self.emit_thread_metadata(thread_metadata),
-                self.upsert_thread_metadata(thread_metadata),
+        if RERANK_ENABLED:
+            # Only the passages relevant to the query are worth the answer model's
+            # tokens
+            web_pages["pages"] = await rerank_pages(
+                enriched_query["search_query"], web_pages["pages"]
             )
+        return web_pages
 
-        # Save the chat history
-        metadata = MetaData(has_math=False)
+    def no_web_pages(self) -> DeadlineFetchResult:
+        """
+        No context for the answer, for when the web pages can't be fetched in time.
+        """
+        return DeadlineFetchResult(pages=[], dropped=[])
 
-        if tags is not None and tags["has_math"]:
-            metadata["has_math"] = True
+    async def run(self, user_message: str) -> None:
+        """
+        Entry point for the agent.
+        """
+        logger.info("samurai_agent runs")
+        self.pipeline = pipeline = Pipeline("samurai")
 
-        await self.save_chat_history(
-            user_message, answer, medium_results, general_results, metadata
+        # To save LLM tokens, we only load user's queries from the chat history
+        # This can already give us a good context for generating search queries and answers
+        self.add_turn_stages(pipeline, user_message, ["user"])
+
+        pipeline.stage(
+            "query",
+            lambda turn: self.process_user_query(),
+            depends_on=["turn"],
+            timeout=QUERY_UNDERSTANDING_TIMEOUT,
+            fallback=self.raw_query,
+        )
+        pipeline.stage(
+            "search", lambda query: self.search_web(query), depends_on=["query"]
+        )
+        # Sending search results to the client ASAP
+        pipeline.stage(
+            "web_results",
+            lambda search: self.emit_web_results(search["general"]),
+            depends_on=["search"],
         )
+        pipeline.stage(
+            "web_pages",
+            lambda query, search: self.get_web_pages(query, search),
+            depends_on=["query", "search"],
+            timeout=WEB_PAGES_TIMEOUT,
+            fallback=self.no_web_pages,
+        )
+        pipeline.stage(
+            "answer",
+            lambda web_pages: self.gen_answer(web_pages["pages"]),
+            depends_on=["web_pages"],
+        )
+        # Images and videos don't need the web pages, only to come after the web results
+        pipeline.stage(
+            "medium",
+            lambda query, web_results: self.process_medium(
+                query["search_query"], query["tags"]
+            ),
+            depends_on=["query", "web_results"],
+            timeout=MEDIUM_SEARCH_TIMEOUT,
+            fallback=self.no_medium_results,
+        )
+        pipeline.stage(
+            "related",
+            lambda web_pages: self.gen_related_questions(web_pages["pages"]),
+            depends_on=["web_pages"],
+            timeout=RELATED_QUESTIONS_TIMEOUT,
+            fallback=list,
+        )
+        pipeline.stage(
+            "persist",
+            lambda turn, thread_metadata, query, search, answer, medium, related: (
+                self.finish_turn(
+                    user_message,
+                    turn,
+                    thread_metadata,
+                    answer,
+                    medium,
+                    search["general"],
+                    related,
+                    MetaData(
+                        has_math=bool(query["tags"] and query["tags"]["has_math"])
+                    ),
+                )
+            ),
+            depends_on=[
+                "turn",
+                "thread_metadata",
+                "query",
+                "search",
+                "answer",
+                "medium",
+                "related",
+            ],
+        )
+
+        await pipeline.run()
@@ -86,8 +86,8 @@ If the search results are empty or unhelpful, answer the query as well as you ca
 Current date: {current_date}
 """
 
-search_prompt = """
-You are Sensei, a helpful search assistant.
+query_understanding_prompt = """
+You are Sensei, a helpful search assistant. Your task is to write a search query for the user's latest query and to classify it, so that the search results, including images and videos, are relevant and tailored to the needs of the query.
 
 # Chat History
 {chat_history}
@@ -97,40 +97,30 @@ You are Sensei, a helpful search assistant.
 
 Current Date: {current_date}
 
-# General Instructions
-Your task is to create a concise and effective DuckDuckGo search query to help find the best results for the user's latest query from a chat history.
+# Search Query
+Create a concise and effective DuckDuckGo search query to help find the best results for the user's latest query from the chat history.
 - Write the query using the same language the user used.
 - Do not add a time if user's query does not contain a time. For example, if the user asks "Best summer movies", you should not produce a query like "2020 summer movies".
 
-Provide the single best query directly, without any introductory or qualifying phrases.
-"""
-
-classification_prompt = """
-Your name is Sensei, a helpful agent. Your role is to classify user queries into specific categories to optimize search results, including images, and videos but no texts. This classification helps ensure that the provided search results are relevant and tailored to the needs of the queries, enhancing the user experience.
-
-
-# Chat History
-{chat_history}
+# Classification
+Classify the user's latest query into the following categories. Default to `true` for images and videos unless they are clearly unnecessary:
+- **needs_search**: `true` if the query requires a search to find the best results. `false` if the query can be answered without searching. Questions that require factual answers, definitions, or simple calculations usually do not need a search. Question that are related to "you", the agent, do not need a search. For example, for queries such as "What can you do?", "What's your name?", "How can you help me?", and similar basic informational questions, the answer should be `false`.
+- **needs_image**: You MUST select `true` even if images add a tiny bit value. This is especially true when the query and answer relate to individuals, places, or objects where visual representation provides extra value.
+- **needs_video**: You MUST select `true` even if videos add a tiny bit value. This is especially true when the query and answer relate to learning, academic research, science and math, dynamic actions, events, demonstrations, coding and tutorials where video might be useful to provide additional value.
+- **content_violation**: `true` if the query contains harmful, immoral, or controversial content. `false` otherwise.
+- **has_math**: `true` if the query involves mathematical concepts or requires the use of formulas. `false` otherwise.
 
-# Instructions
-Classify the user's most recent query into the following categories. Default to "YES" for images and videos unless they are clearly unnecessary:
-- **SEARCH_NEEDED**: `YES` if the query requires a search to find the best results. `NO` if the query can be answered without searching. Questions that require factual answers, definitions, or simple calculations usually do not need a search. Question that are related to "you", the agent, do not need a search. For example, for queries such as "What can you do?", "What's your name?", "How can you help me?", and similar basic informational questions, the answer should be `NO`.
-- **SEARCH_IMAGE**: You MUST select `YES` even if images add a tiny bit value. This is especially true when the query and answer relate to individuals, places, or objects where visual representation provides extra value.
-- **SEARCH_VIDEO**: You MUST select `YES` even if videos add a tiny bit value. This is especially true when the query and answer relate to learning, academic research, science and math, dynamic actions, events, demonstrations, coding and tutorials where video might be useful to provide additional value.
-- **CONTENT_VIOLATION**: `YES` if the query contains harmful, immoral, or controversial content. `NO` otherwise.
-- **MATH**: `YES` if the query involves mathematical concepts or requires the use of formulas. `NO` otherwise.
-
-Provide your classification in the following format: CATEGORY:YES/NO, CATEGORY:YES/NO..., as shown in these examples:
+# Answer Format
+Answer with a single JSON object and nothing else, as shown in this example:
 
 Query: Who is Yo-Yo Ma?
 Answer:
-SEARCH_NEEDED: YES, SEARCH_IMAGE:YES, SEARCH_VIDEO:NO, CONTENT_VIOLATION:NO, MATH:NO
+{{"search_query": "Yo-Yo Ma", "needs_search": true, "needs_image": true, "needs_video": false, "content_violation": false, "has_math": false}}
 
-Strictly follow the answer format. DO NOT include your reasons. Repeat the instructions in your mind before answering. Now classify the user's query.
+Strictly follow the answer format. DO NOT include your reasons.
 
 Query: {user_current_query}
 Answer:
-
 """
 
 related_questions_prompt = """
@@ -4,7 +4,6 @@ import re
 from datetime import datetime
 from typing import Any, List, Optional
 
-from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionMessageToolCall
 from openai.types.chat.chat_completion_chunk import ChoiceDeltaToolCall
 from openai.types.chat.chat_completion_message_tool_call import Function
@@ -24,6 +23,7 @@ from sensei_search.config import (
     SM_MODEL_API_KEY,
     SM_MODEL_URL,
 )
+from sensei_search.llm_clients import LLMClients
 from sensei_search.logger import logger
 from sensei_search.models import MetaData
 from sensei_search.tools.search import Input as SearchInput
@@ -66,10 +66,7 @@ class ShogunAgent(BaseAgent):
         prompt = related_questions_prompt.format(chat_history=chat_history)
 
         try:
-            client = AsyncOpenAI(
-                base_url=SM_MODEL_URL,
-                api_key=SM_MODEL_API_KEY,
-            )
+            client = LLMClients().get(SM_MODEL_URL, SM_MODEL_API_KEY)
             response = await client.chat.completions.create(
                 model=SM_MODEL,
                 messages=[{"role": "user", "content": prompt}],
@@ -92,7 +89,7 @@ class ShogunAgent(BaseAgent):
     ) -> str:
         final_answer_parts = []
 
-        client = AsyncOpenAI(base_url=MD_MODEL_URL, api_key=MD_MODEL_API_KEY)
+        client = LLMClients().get(MD_MODEL_URL, MD_MODEL_API_KEY)
 
         system_prompt = answer_prompt.format(current_date=datetime.now().isoformat())
 
@@ -193,7 +190,7 @@ class ShogunAgent(BaseAgent):
         # Append user message to chat history
         self.append_message(role="user", content=user_message)
 
-        client = AsyncOpenAI(base_url=MD_MODEL_URL, api_key=MD_MODEL_API_KEY)
+        client = LLMClients().get(MD_MODEL_URL, MD_MODEL_API_KEY)
 
         system_prompt = general_prompt.format(current_date=datetime.now().isoformat())
 
@@ -4,33 +4,39 @@ import re
 from datetime import datetime
 from typing import Any, List, Optional, Tuple
 
-from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionMessageToolCall
 from openai.types.chat.chat_completion_message_tool_call import Function
 
 from sensei_search.agents.shogun.prompts import (
     answer_prompt,
-    classification_prompt,
     general_prompt,
+    query_understanding_prompt,
     related_questions_prompt,
-    search_prompt,
 )
-from sensei_search.base_agent import BaseAgent, NoAccessError
-from sensei_search.chat_store import ThreadMetadata
+from sensei_search.base_agent import BaseAgent, EnrichedQuery, QueryTags
 from sensei_search.config import (
     MD_MODEL,
     MD_MODEL_API_KEY,
+    MD_MODEL_CONTEXT_TOKENS,
     MD_MODEL_URL,
+    MEDIUM_SEARCH_TIMEOUT,
+    QUERY_UNDERSTANDING_TIMEOUT,
+    RELATED_QUESTIONS_AFTER_CHUNKS,
+    RELATED_QUESTIONS_START,
+    RELATED_QUESTIONS_TIMEOUT,
     SM_MODEL,
     SM_MODEL_API_KEY,
     SM_MODEL_URL,
 )
+from sensei_search.context_packing import pack_documents
+from sensei_search.llm_clients import LLMClients
+from sensei_search.llm_memo import memoized_completion
 from sensei_search.logger import logger
 from sensei_search.models import MetaData
+from sensei_search.pipeline import Pipeline
 from sensei_search.tools.search import Category
 from sensei_search.tools.search import Input as SearchInput
 from sensei_search.tools.search import TopResults, get_search_tool
-from sensei_search.utils import create_slug
 
 
 async def noop() -> None:
@@ -46,6 +52,10 @@ class ShogunAgent(BaseAgent):
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
+        # Related questions can be generated from the start of the answer, see
+        # RELATED_QUESTIONS_START
+        self.answer_complete = False
+        self.partial_answer = asyncio.Event()
 
     def search_results_to_string(self, search_results: TopResults) -> str:
         # Construct the search context as this format:
@@ -53,102 +63,63 @@ class ShogunAgent(BaseAgent):
         # Page 1 url
         # Page 1 title
         # Page 1 content
+        general_results = search_results["general"]
+        contents = pack_documents(
+            [result["content"] for result in general_results], MD_MODEL_CONTEXT_TOKENS
+        )["documents"]
+
         search_context = []
-        for i, result in enumerate(search_results["general"]):
+        for i, (result, content) in enumerate(zip(general_results, contents)):
             search_context.append(
-                f"[{i+1}]\n{result['url']}\n{result['title']}\n{result['content']}"
+                f"[{i+1}]\n{result['url']}\n{result['title']}\n{content}"
             )
         return "\n\n".join(search_context)
 
-    async def gen_search_query(self) -> Optional[str]:
-        logger.info("generating search query")
-        client = AsyncOpenAI(
-            base_url=SM_MODEL_URL,
-            api_key=SM_MODEL_API_KEY,
-        )
+    async def process_user_query(self) -> EnrichedQuery:
+        """
+        Decide if a search is needed and generate the search query, and classify the query
+        to decide if images and videos should be searched, with a single small model call.
+        """
+        logger.info("understanding user query")
 
         chat_history = self.chat_history_to_string(["user", "assistant"], 5)
 
         user_current_query = self.chat_messages[-1]["content"]
 
-        prompt = search_prompt.format(
+        prompt = query_understanding_prompt.format(
             chat_history=chat_history,
             user_current_query=user_current_query,
-            current_date=datetime.now().isoformat(),
+            # Only the date, so that the prompt (and its memoized output) is stable all day
+            current_date=datetime.now().date().isoformat(),
         )
 
-        response = await client.chat.completions.create(
-            model=SM_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0,
-            max_tokens=500,
-        )
-        logger.info("Finished generating search query")
+        return await self.understand_query(prompt)
 
-        logger.info(f"Search query: {response.choices[0].message.content}")
-
-        if response.choices[0].message.content is None:
-            return None
-
-        if "NO_SEARCH_NEEDED" in response.choices[0].message.content:
-            logger.info(f"No search needed for {user_current_query}")
-            return None
-
-        query = response.choices[0].message.content
-        query = query.strip('"').strip("'").strip("\n")
-        return query
-
-    async def front_run_search(self) -> Optional[Tuple[TopResults, str]]:
-        search_query = await self.gen_search_query()
-
-        if not search_query:
+    async def front_run_search(
+        self, enriched_query: EnrichedQuery
+    ) -> Optional[Tuple[TopResults, str]]:
+        tags = enriched_query["tags"]
+        if tags is not None and not tags["needs_search"]:
+            logger.info(f"No search needed for {self.chat_messages[-1]['content']}")
             return None
 
+        search_query = enriched_query["search_query"]
         search_input = SearchInput(query=search_query, categories=[Category.general])
 
         return (await get_search_tool().search(search_input), search_query)
 
-    async def process_medium(self, query: Optional[str]) -> TopResults:
+    async def process_medium(
+        self, query: Optional[str], tags: Optional[QueryTags]
+    ) -> TopResults:
         medium_results = TopResults(general=[], images=[], videos=[])
 
-        if query:
+        if query and tags is not None:
             try:
-                client = AsyncOpenAI(
-                    base_url=SM_MODEL_URL,
-                    api_key=SM_MODEL_API_KEY,
-                )
-                chat_history = self.chat_history_to_string(["user", "assistant"], 5)
-                user_current_query = self.chat_messages[-1]["content"]
-
-                prompt = classification_prompt.format(
-                    chat_history=chat_history, user_current_query=user_current_query
-                )
-                response = await client.chat.completions.create(
-                    model=SM_MODEL,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.0,
-                    max_tokens=500,
-                    stream=False,
-                )
-
-                result = response.choices[0].message.content or ""
-
-                tags_dict = {}
-                for tag in result.split(","):
-                    try:
-                        key, value = tag.strip().split(":")
-                        tags_dict[key] = value
-                    except ValueError:
-                        logger.warning(f"Skipping ill-formatted tag: {tag}")
-
                 categories = []
 
-                search_images = tags_dict.get("SEARCH_IMAGE", "NO") == "YES"
-                search_videos = tags_dict.get("SEARCH_VIDEO", "NO") == "YES"
-
-                if search_images:
+                if tags["needs_image"]:
                     categories.append(Category.images)
-                if search_videos:
+                if tags["needs_video"]:
                     categories.append(Category.videos)
 
                 if categories:
@@ -157,22 +128,42 @@ class ShogunAgent(BaseAgent):
                     medium_results = await get_search_tool().search(search_input)
 
             except Exception as e:
-                logger.exception(f"Error generating related questions: {e}")
+                logger.exception(f"Error searching images and videos: {e}")
 
         await self.emit_medium_results(medium_results)
         return medium_results
 
-    async def gen_related_questions(self) -> List[str]:
+    def search_results_to_titles(self, search_results: TopResults) -> str:
+        titles = "; ".join(result["title"] for result in search_results["general"][:5])
+        return f"search results: {titles}" if titles else ""
+
+    async def emit_answer(self, answer: str) -> None:
+        await super().emit_answer(answer)
+        if len(self.answer_chunks) >= RELATED_QUESTIONS_AFTER_CHUNKS:
+            self.partial_answer.set()
+
+    async def wait_for_partial_answer(self) -> str:
+        """
+        Wait for the first RELATED_QUESTIONS_AFTER_CHUNKS chunks of the answer (or the
+        whole answer if it's shorter) and return them as chat history.
+        """
+        await self.partial_answer.wait()
+        # A complete answer is already in the chat history
+        if self.answer_complete:
+            return ""
+        return f"assistant: {''.join(self.answer_chunks)}"
+
+    async def gen_related_questions(self, context: str = "") -> List[str]:
         chat_history = self.chat_history_to_string(["user", "assistant"], 5)
+        if context:
+            chat_history = f"{chat_history}\n{context}"
 
         prompt = related_questions_prompt.format(chat_history=chat_history)
 
         try:
-            client = AsyncOpenAI(
-                base_url=SM_MODEL_URL,
-                api_key=SM_MODEL_API_KEY,
-            )
-            response = await client.chat.completions.create(
+            client = LLMClients().get(SM_MODEL_URL, SM_MODEL_API_KEY)
+            content = await memoized_completion(
+                client,
                 model=SM_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.0,
@@ -182,7 +173,7 @@ class ShogunAgent(BaseAgent):
 
             return [
                 re.sub(r"^\s*\d+\.\s*", "", item)
-                for item in (response.choices[0].message.content or "").split("\n")
+                for item in content.split("\n")
                 if item.strip()
             ]
         except Exception as e:
@@ -194,7 +185,7 @@ class ShogunAgent(BaseAgent):
     ) -> str:
         final_answer_parts = []
 
-        client = AsyncOpenAI(base_url=MD_MODEL_URL, api_key=MD_MODEL_API_KEY)
+        client = LLMClients().get(MD_MODEL_URL, MD_MODEL_API_KEY)
 
         system_prompt = answer_prompt.format(
             current_date=datetime.now().strftime("%A, %B %d, %Y")
@@ -230,19 +221,17 @@ class ShogunAgent(BaseAgent):
             stream=True,
         )
 
-        async for chunk in response:
-            if chunk.choices[0].delta.content:
-                final_answer_parts.append(chunk.choices[0].delta.content)
-                # Send the answer to the user ASAP
-                await self.emit_answer(chunk.choices[0].delta.content)
+        async with response:
+            async for chunk in response:
+                if chunk.choices[0].delta.content:
+                    final_answer_parts.append(chunk.choices[0].delta.content)
+                    # Send the answer to the user ASAP
+                    await self.emit_answer(chunk.choices[0].delta.content)
 
         return "".join(final_answer_parts)
 
     async def gen_answer(self) -> str:
-        client = AsyncOpenAI(
-            base_url=MD_MODEL_URL,
-            api_key=MD_MODEL_API_KEY,
-        )
+        client = LLMClients().get(MD_MODEL_URL, MD_MODEL_API_KEY)
 
         system_prompt = general_prompt.format(
             current_date=datetime.now().strftime("%A, %B %d, %Y")
@@ -263,50 +252,16 @@ class ShogunAgent(BaseAgent):
             stream=True,
         )
         final_answer_parts = []
-        async for chunk in response:
-            if chunk.choices[0].delta.content:
-                final_answer_parts.append(chunk.choices[0].delta.content)
-                await self.emit_answer(chunk.choices[0].delta.content)
+        async with response:
+            async for chunk in response:
+                if chunk.choices[0].delta.content:
+                    final_answer_parts.append(chunk.choices[0].delta.content)
+                    await self.emit_answer(chunk.choices[0].delta.content)
         return "".join(final_answer_parts)
 
-    async def run(self, user_message: str) -> None:
-        """
-        Entry point for the agent.
-        """
-        logger.info("shogun_agent runs")
-        # To save LLM tokens, we only load user's queries from the chat history
-        # This can already give us a good context for generating search queries and answers
-        _, thread_metadata = await asyncio.gather(
-            self.load_chat_history(self.thread_id, ["user", "assistant"]),
-            self.get_thread_metadata(),
-        )
-
-        logger.info(f"Thread metadata: {thread_metadata}")
-
-        # Check if the user has access to the thread
-        # We assume there is no easy way to guess the uuid of a user
-        if thread_metadata and thread_metadata["user_id"] != self.user_id:
-            logger.warning(
-                f"User {self.user_id} does not have access to thread {self.thread_id}"
-            )
-            raise NoAccessError()
-
-        logger.info(f"User original query: {user_message}")
-
-        # Append user message to chat history
-        self.append_message(role="user", content=user_message)
-
-        # Generate the search results ASAP
-        result = await self.front_run_search()
-
+    async def answer(self, search: Optional[Tuple[TopResults, str]]) -> str:
         # If we have search results, generate the answer with the search context
-        if result:
-            search_results, search_query = result
-
-            logger.info(search_results)
-
-            await self.emit_web_results(search_results["general"])
-
+        if search:
             tool_use_id = "toolu_123456"
             # Create a fake tool call
             tool_calls: List[ChatCompletionMessageToolCall] = [
@@ -315,7 +270,10 @@ class ShogunAgent(BaseAgent):
                     function=Function(
                         name="searxng_search_results_json",
                         arguments=json.dumps(
-                            {"query": user_message, "categories": ["general"]}
+                            {
+                                "query": self.chat_messages[-1]["content"],
+                                "categories": ["general"],
+                            }
                         ),
                     ),
                     type="function",
@@ -328,46 +286,120 @@ class ShogunAgent(BaseAgent):
                     json.dumps([tool.model_dump() for tool in tool_calls])
                 ),
             )
-            answer, medium_results = await asyncio.gather(
-                self.gen_answer_with_search_context(
-                    tool_use_id=tool_use_id, search_results=search_results
-                ),
-                self.process_medium(search_query),
+            answer = await self.gen_answer_with_search_context(
+                tool_use_id=tool_use_id, search_results=search[0]
             )
         # If no search results, generate a generic answer
         else:
-            await self.emit_web_results([])
-
-            answer, medium_results = await asyncio.gather(
-                self.gen_answer(), self.process_medium(None)
-            )
-            search_results = TopResults(general=[], images=[], videos=[])
+            answer = await self.gen_answer()
+        await self.flush_answer()
 
         self.append_message(role="assistant", content=answer)
+        self.answer_complete = True
+        self.partial_answer.set()
+        return answer
+
+    def add_related_questions_stages(self, pipeline: Pipeline) -> None:
+        if RELATED_QUESTIONS_START == "search":
+            # As soon as the search results are in
+            pipeline.stage(
+                "related",
+                lambda search: self.gen_related_questions(
+                    self.search_results_to_titles(search[0]) if search else ""
+                ),
+                depends_on=["search"],
+                timeout=RELATED_QUESTIONS_TIMEOUT,
+                fallback=list,
+            )
+            return
 
-        # Generate related questions
-        related_questions = await self.gen_related_questions()
-        await self.emit_related_questions(related_questions)
-
-        if not thread_metadata:
-            # Create a new thread metadata
-            thread_metadata = ThreadMetadata(
-                name=user_message[:50],
-                user_id=self.user_id,
-                created_at=datetime.now().isoformat(),
-                slug=create_slug(user_message),
-                related_questions=related_questions,
+        if RELATED_QUESTIONS_START == "partial":
+            pipeline.stage(
+                "partial_answer",
+                lambda search: self.wait_for_partial_answer(),
+                depends_on=["search"],
             )
-            # We send the thread metadata to the client for it save it in the local storage
-            await asyncio.gather(
-                self.emit_thread_metadata(thread_metadata),
-                self.upsert_thread_metadata(thread_metadata),
+            pipeline.stage(
+                "related",
+                lambda partial_answer: self.gen_related_questions(partial_answer),
+                depends_on=["partial_answer"],
+                timeout=RELATED_QUESTIONS_TIMEOUT,
+                fallback=list,
             )
-            logger.info(f"Saved thread metadata: {thread_metadata}")
+            return
+
+        pipeline.stage(
+            "related",
+            lambda answer: self.gen_related_questions(),
+            depends_on=["answer"],
+            timeout=RELATED_QUESTIONS_TIMEOUT,
+            fallback=list,
+        )
+
+    async def run(self, user_message: str) -> None:
+        """
+        Entry point for the agent.
+        """
+        logger.info("shogun_agent runs")
+        self.pipeline = pipeline = Pipeline("shogun")
 
-        # Save the chat history
-        metadata = MetaData(has_math=False)
+        self.add_turn_stages(pipeline, user_message, ["user", "assistant"])
 
-        await self.save_chat_history(
-            user_message, answer, medium_results, search_results["general"], metadata
+        # Generate the search results ASAP
+        pipeline.stage(
+            "query",
+            lambda turn: self.process_user_query(),
+            depends_on=["turn"],
+            timeout=QUERY_UNDERSTANDING_TIMEOUT,
+            fallback=self.raw_query,
+        )
+        pipeline.stage(
+            "search", lambda query: self.front_run_search(query), depends_on=["query"]
+        )
+        pipeline.stage(
+            "web_results",
+            lambda search: self.emit_web_results(
+                search[0]["general"] if search else []
+            ),
+            depends_on=["search"],
+        )
+        pipeline.stage(
+            "answer",
+            lambda search, web_results: self.answer(search),
+            depends_on=["search", "web_results"],
         )
+        pipeline.stage(
+            "medium",
+            lambda query, search, web_results: self.process_medium(
+                search[1] if search else None, query["tags"] if search else None
+            ),
+            depends_on=["query", "search", "web_results"],
+            timeout=MEDIUM_SEARCH_TIMEOUT,
+            fallback=self.no_medium_results,
+        )
+        self.add_related_questions_stages(pipeline)
+        pipeline.stage(
+            "persist",
+            lambda turn, thread_metadata, search, answer, medium, related: (
+                self.finish_turn(
+                    user_message,
+                    turn,
+                    thread_metadata,
+                    answer,
+                    medium,
+                    search[0]["general"] if search else [],
+                    related,
+                    MetaData(has_math=False),
+                )
+            ),
+            depends_on=[
+                "turn",
+                "thread_metadata",
+                "search",
+                "answer",
+                "medium",
+                "related",
+            ],
+        )
+
+        await pipeline.run()
@@ -97,7 +97,7 @@ Now write down your questions, starting with the first question:
 
 """
 
-search_prompt = """
+query_understanding_prompt = """
 You are Sensei, a helpful search assistant.
 
 ## Chat History
@@ -109,38 +109,29 @@ You are Sensei, a helpful search assistant.
 Current Date: {current_date}
 
 ## General Instructions
-Your task is to decide if a search tool is needed to help find the best results for the user's latest query from a chat history. If yes, produce the search query. You should follow below steps closely:
-1. A search is not needed for general greetings, introductions, or other non-informational requests (e.g., "how are you?", "what's your name?", "what can you do?"). If no search is needed, just print "NO_SEARCH_NEEDED", nothing else.
+Your task is to decide if a search tool is needed to help find the best results for the user's latest query from a chat history. If yes, produce the search query. You also classify the query to decide if images and videos should be searched. You should follow below steps closely:
+1. A search is not needed for general greetings, introductions, or other non-informational requests (e.g., "how are you?", "what's your name?", "what can you do?"). If no search is needed, set "needs_search" to false.
 - Previous messages in the chat history should not influence your decision.
 - Do not skip a search based on previous messages in the chat history.
 - Do not use any reasoning to skip a search.
 
-2. If a search is needed, your answer MUST be the search query without any introductory or qualifying phrases or reasons. e.g. "Best summer movies 2024". Produce the search query with below guidelines:
+2. If a search is needed, "search_query" MUST be the search query without any introductory or qualifying phrases or reasons. e.g. "Best summer movies 2024". Produce the search query with below guidelines:
 - Write the query using the same language the user used.
 - Preserve user's original query as much as possible. Only modify the query when search tool doesn't know the context. e.g. "He" or "She" should be replaced with the person's name.
-- Give the direct query in single line, NOTHING ELSE. No markdown formatting is needed.
+- Give the direct query in single line. No markdown formatting is needed.
 
-Think carefully about the instructions before answering. Now decide if a search tool is needed and provide the search query if necessary.
-"""
-
-classification_prompt = """
-Your name is Sensei, a helpful agent. Your role is to classify user queries into specific categories.
-
-## Chat History
-{chat_history}
-
-## Instructions
-Classify the user's most recent query into the following categories:
-- **SEARCH_IMAGE**: You MUST select `YES` when the query and answer relate to individuals, places, or objects where visual representation provides extra value.
-- **SEARCH_VIDEO**: You MUST select `YES` when the query and answer relate to learning, academic research, science and math, dynamic actions, events, demonstrations, coding and tutorials where video might be useful to provide additional value.
+3. Classify the user's latest query:
+- "needs_image": You MUST select true when the query and answer relate to individuals, places, or objects where visual representation provides extra value.
+- "needs_video": You MUST select true when the query and answer relate to learning, academic research, science and math, dynamic actions, events, demonstrations, coding and tutorials where video might be useful to provide additional value.
 
-Provide your classification in the following format: CATEGORY:YES/NO, CATEGORY:YES/NO..., as shown in these examples:
+## Answer Format
+Answer with a single JSON object and nothing else, as shown in these examples:
 
 Query: Who is Yo-Yo Ma?
-Answer: SEARCH_IMAGE:YES, SEARCH_VIDEO:NO
+Answer: {{"search_query": "Yo-Yo Ma", "needs_search": true, "needs_image": true, "needs_video": false}}
 
-Strictly follow the answer format. DO NOT include your reasons. Repeat the instructions in your mind before answering. Now classify the user's query.
+Query: What's your name?
+Answer: {{"search_query": "", "needs_search": false, "needs_image": false, "needs_video": false}}
 
-Query: {user_current_query}
-Answer:
+Think carefully about the instructions before answering. DO NOT include your reasons.
 """
@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from typing_extensions import TypedDict
+
+from sensei_search.cache import CacheStats, LRUCache
+from sensei_search.chat_store import ChatStore
+from sensei_search.config import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_INDEX_REFRESH,
+    ANSWER_CACHE_INDEX_SIZE,
+    ANSWER_CACHE_LOCAL_SIZE,
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_TTL,
+)
+from sensei_search.logger import logger
+from sensei_search.models import MetaData
+from sensei_search.text import QUESTION_WORDS, STOP_WORDS, words
+from sensei_search.tools.search import (
+    GeneralResult,
+    TopResults,
+    is_time_sensitive,
+    normalize_query,
+)
+
+# MinHash signatures are split into bands for locality-sensitive hashing. Two questions
+# become candidates if all the rows of any band match, which is likely above a
+# similarity of ~0.5 and unlikely below ~0.3 with 16 bands of 4 rows.
+NUM_BANDS = 16
+ROWS_PER_BAND = 4
+NUM_HASHES = NUM_BANDS * ROWS_PER_BAND
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5E75E1)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_HASHES)
+]
+
+# Bumped when the content words change, entries of the old index never match again
+INDEX_KEY = "answer_cache:index:v2"
+
+
+class CachedAnswer(TypedDict):
+    query: str
+    answer: str
+    web_results: List[GeneralResult]
+    medium_results: TopResults
+    related_questions: List[str]
+    metadata: MetaData
+
+
+class AnswerCacheStats(TypedDict):
+    hits: int
+    near_duplicate_hits: int
+    misses: int
+    stored: int
+    # Time sensitive or content-free questions, never cached
+    skipped: int
+    index_size: int
+    local: CacheStats
+
+
+def content_words(query: str) -> FrozenSet[str]:
+    return frozenset(
+        word
+        for word in words(query)
+        if word not in STOP_WORDS or word in QUESTION_WORDS
+    )
+
+
+def numbers(words: FrozenSet[str]) -> FrozenSet[str]:
+    # "best laptop 2023" and "best laptop 2024" are similar, but not the same question
+    return frozenset(word for word in words if any(c.isdigit() for c in word))
+
+
+def question_words(words: FrozenSet[str]) -> FrozenSet[str]:
+    # "where was einstein born" and "when was einstein born" only differ by one word
+    return words & QUESTION_WORDS
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def minhash(words: FrozenSet[str]) -> Tuple[int, ...]:
+    hashes = [
+        int.from_bytes(hashlib.blake2b(w.encode(), digest_size=8).digest(), "big")
+        for w in words
+    ]
+    return tuple(
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS
+    )
+
+
+class _IndexEntry:
+    def __init__(self, words: FrozenSet[str], expires_at: float) -> None:
+        self.words = words
+        self.expires_at = expires_at
+        self.bands = _bands(minhash(words))
+
+
+def _bands(signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+    return [
+        signature[i : i + ROWS_PER_BAND] for i in range(0, NUM_HASHES, ROWS_PER_BAND)
+    ]
+
+
+class MinHashIndex:
+    """
+    An in-memory locality-sensitive hashing index over sets of words.
+
+    Only the band buckets and the (short) word sets are kept, and candidates found
+    through the buckets are verified with their exact Jaccard similarity. The oldest
+    entries are evicted beyond `max_size`.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: OrderedDict[str, _IndexEntry] = OrderedDict()
+        self._buckets: List[Dict[Tuple[int, ...], Set[str]]] = [
+            {} for _ in range(NUM_BANDS)
+        ]
+
+    def add(self, key: str, words: FrozenSet[str], expires_at: float) -> None:
+        self.remove(key)
+        entry = _IndexEntry(words, expires_at)
+        self._entries[key] = entry
+        for buckets, band in zip(self._buckets, entry.bands):
+            buckets.setdefault(band, set()).add(key)
+
+        while len(self._entries) > self.max_size:
+            self.remove(next(iter(self._entries)))
+
+    def remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for buckets, band in zip(self._buckets, entry.bands):
+            bucket = buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del buckets[band]
+
+    def query(
+        self, words: FrozenSet[str], prefix: str = ""
+    ) -> Optional[Tuple[str, float]]:
+        """
+        Find the most similar live entry whose key starts with `prefix`, returning its
+        key and similarity.
+        """
+        candidates: Set[str] = set()
+        for buckets, band in zip(self._buckets, _bands(minhash(words))):
+            candidates |= buckets.get(band, set())
+
+        now = time.time()
+        best: Optional[Tuple[str, float]] = None
+        for key in candidates:
+            if not key.startswith(prefix):
+                continue
+            entry = self._entries[key]
+            if entry.expires_at < now:
+                self.remove(key)
+                continue
+            if numbers(entry.words) != numbers(words):
+                continue
+            if question_words(entry.words) != question_words(words):
+                continue
+            similarity = jaccard(entry.words, words)
+            if best is None or similarity > best[1]:
+                best = (key, similarity)
+        return best
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class AnswerCache:
+    """
+    Caches complete answers to first-turn questions, so that a rephrased version of a
+    recent question ("how far is mars", "How far away is Mars?") is answered without
+    any search or LLM call. Each agent has its own answers.
+
+    Questions are reduced to their content words, question words and symbols included,
+    and indexed with MinHash/LSH. The index is mirrored in a Redis hash and reloaded
+    periodically, so that workers share answers. The answers themselves are stored in
+    Redis (through the ChatStore connection) with a small in-process LRU in front. Time
+    sensitive questions are never cached.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args: Any, **kwargs: Any) -> AnswerCache:
+        # Ensure only one instance of AnswerCache is created
+        if not cls._instance:
+            cls._instance = super(AnswerCache, cls).__new__(cls, *args, **kwargs)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not hasattr(self, "index"):
+            self.index = MinHashIndex(ANSWER_CACHE_INDEX_SIZE)
+            self.local: LRUCache[CachedAnswer] = LRUCache(
+                max_size=ANSWER_CACHE_LOCAL_SIZE, ttl=ANSWER_CACHE_TTL
+            )
+            self.loaded_at = 0.0
+            self.counters: Dict[str, int] = {
+                "hits": 0,
+                "near_duplicate_hits": 0,
+                "misses": 0,
+                "stored": 0,
+                "skipped": 0,
+            }
+
+    def _get_prefix(self, agent: str) -> str:
+        return f"answer_cache:{agent}:"
+
+    def _get_key(self, agent: str, words: FrozenSet[str]) -> str:
+        digest = hashlib.sha1(" ".join(sorted(words)).encode("utf-8")).hexdigest()
+        return f"{self._get_prefix(agent)}{digest}"
+
+    def _cacheable(self, query: str) -> Optional[FrozenSet[str]]:
+        if not ANSWER_CACHE_ENABLED:
+            return None
+        words = content_words(query)
+        if not words - QUESTION_WORDS or is_time_sensitive(normalize_query(query)):
+            self.counters["skipped"] += 1
+            return None
+        return words
+
+    async def load_index(self) -> None:
+        """
+        Pick up the entries added by other workers and drop the expired ones.
+        """
+        self.loaded_at = time.monotonic()
+        entries = await ChatStore().get_index_entries(INDEX_KEY)
+
+        now = time.time()
+        expired = []
+        for key, value in entries.items():
+            entry = json.loads(value)
+            if entry["expires_at"] < now:
+                expired.append(key)
+            elif key not in self.index:
+                self.index.add(key, frozenset(entry["words"]), entry["expires_at"])
+
+        if expired:
+            await ChatStore().delete_index_entries(INDEX_KEY, expired)
+
+    async def lookup(self, agent: str, query: str) -> Optional[CachedAnswer]:
+        """
+        Find the cached answer of `agent` to a near-duplicate of `query`.
+        """
+        words = self._cacheable(query)
+        if words is None:
+            return None
+
+        if time.monotonic() - self.loaded_at > ANSWER_CACHE_INDEX_REFRESH:
+            await self.load_index()
+
+        match = self.index.query(words, self._get_prefix(agent))
+        if match is None or match[1] < ANSWER_CACHE_SIMILARITY:
+            self.counters["misses"] += 1
+            return None
+
+        key, similarity = match
+        answer = self.local.get(key)
+        if answer is None:
+            cached = await ChatStore().get_cache(key)
+            if cached is None:
+                # Expired or evicted from Redis
+                self.index.remove(key)
+                self.counters["misses"] += 1
+                return None
+            answer = json.loads(cached)
+            self.local.set(key, answer)
+
+        self.counters["hits"] += 1
+        if similarity < 1.0:
+            self.counters["near_duplicate_hits"] += 1
+        logger.info(
+            f"Answer cache hit for {query!r}: {answer['query']!r} ({similarity:.2f})"
+        )
+        return answer
+
+    async def store(self, agent: str, answer: CachedAnswer) -> None:
+        words = self._cacheable(answer["query"])
+        if words is None or not answer["answer"]:
+            return
+
+        key = self._get_key(agent, words)
+        expires_at = time.time() + ANSWER_CACHE_TTL
+
+        self.local.set(key, answer)
+        self.index.add(key, words, expires_at)
+        self.counters["stored"] += 1
+
+        chat_store = ChatStore()
+        await chat_store.set_cache(key, json.dumps(answer), ANSWER_CACHE_TTL)
+        await chat_store.set_index_entry(
+            INDEX_KEY,
+            key,
+            json.dumps({"words": sorted(words), "expires_at": expires_at}),
+        )
+
+    def stats(self) -> AnswerCacheStats:
+        return AnswerCacheStats(
+            hits=self.counters["hits"],
+            near_duplicate_hits=self.counters["near_duplicate_hits"],
+            misses=self.counters["misses"],
+            stored=self.counters["stored"],
+            skipped=self.counters["skipped"],
+            index_size=len(self.index),
+            local=self.local.stats(),
+        )
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from typing_extensions import TypedDict
+
+from sensei_search.config import ANSWER_FLUSH_BYTES, ANSWER_FLUSH_INTERVAL
+
+if TYPE_CHECKING:
+    from sensei_search.base_agent import EventEmitter
+
+ANSWER_EVENT = "answer"
+
+
+class AnswerFramingStats(TypedDict):
+    answers: int
+    # Deltas received from the LLMs, one frame each without coalescing
+    deltas: int
+    frames: int
+    deltas_per_answer: float
+    frames_per_answer: float
+
+
+_counters = {"answers": 0, "deltas": 0, "frames": 0}
+
+
+class CoalescingEmitter:
+    """
+    Wraps an EventEmitter to send the answer in fewer, larger frames.
+
+    LLMs stream about a token per delta, and each one would be its own event with its
+    JSON encoding and transport overhead. The first delta is sent right away, to keep
+    the time to first token. The following ones are buffered until `interval` seconds
+    have passed since the first of them or `max_bytes` are buffered. Any other event
+    flushes the buffer first, so events keep their order.
+    """
+
+    def __init__(
+        self,
+        emitter: EventEmitter,
+        interval: float = ANSWER_FLUSH_INTERVAL,
+        max_bytes: int = ANSWER_FLUSH_BYTES,
+    ) -> None:
+        self.emitter = emitter
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.buffer: List[str] = []
+        self.buffered_bytes = 0
+        self.started = False
+        self.timer: Optional[asyncio.Task] = None
+        # Frames are sent in the order the buffer was swapped out
+        self.lock = asyncio.Lock()
+
+    async def emit(self, event: str, data: Dict) -> None:
+        if event != ANSWER_EVENT:
+            await self.flush()
+            async with self.lock:
+                await self.emitter.emit(event, data)
+            return
+
+        _counters["deltas"] += 1
+        if not self.started:
+            self.started = True
+            _counters["answers"] += 1
+            await self._send([data["data"]])
+            return
+
+        self.buffer.append(data["data"])
+        self.buffered_bytes += len(data["data"].encode("utf-8"))
+        if self.interval <= 0 or self.buffered_bytes >= self.max_bytes:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        """
+        Send the buffered part of the answer now.
+        """
+        if self.timer is not None and self.timer is not asyncio.current_task():
+            self.timer.cancel()
+        self.timer = None
+
+        if self.buffer:
+            deltas, self.buffer, self.buffered_bytes = self.buffer, [], 0
+            await self._send(deltas)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def _send(self, deltas: List[str]) -> None:
+        _counters["frames"] += 1
+        async with self.lock:
+            await self.emitter.emit(ANSWER_EVENT, {"data": "".join(deltas)})
+
+
+def get_framing_stats() -> AnswerFramingStats:
+    answers = _counters["answers"]
+    return AnswerFramingStats(
+        answers=answers,
+        deltas=_counters["deltas"],
+        frames=_counters["frames"],
+        deltas_per_answer=_counters["deltas"] / answers if answers else 0.0,
+        frames_per_answer=_counters["frames"] / answers if answers else 0.0,
+    )
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+from typing_extensions import TypedDict
+
+from sensei_search.chat_store import ChatStore
+from sensei_search.config import (
+    STREAM_APPEND_TIMEOUT,
+    STREAM_MAX_LENGTH,
+    STREAM_TAIL_TIMEOUT,
+    STREAM_TTL,
+)
+from sensei_search.logger import logger
+
+if TYPE_CHECKING:
+    from sensei_search.base_agent import EventEmitter
+
+# Written when a request is over, so that readers know to stop
+END_EVENT = "end"
+
+
+class AnswerStreamStats(TypedDict):
+    appended: int
+    append_errors: int
+    resumes: int
+    replayed: int
+
+
+_counters = {"appended": 0, "append_errors": 0, "resumes": 0, "replayed": 0}
+
+
+def _get_key(request_id: str) -> str:
+    return f"answer_stream:{request_id}"
+
+
+class StreamEmitter:
+    """
+    Records the events of a request in a Redis Stream on their way to the client, so a
+    client that lost its connection can resume the request with replay_stream().
+
+    Each event sent to the client carries the "id" of its stream entry, which is the
+    offset to resume from. The stream expires STREAM_TTL seconds after its last event.
+    It sits behind the outbound queue, so appending never holds up the agent. If an
+    append takes over STREAM_APPEND_TIMEOUT seconds, Redis is struggling: the following
+    events are sent without recording them (or an "id").
+    """
+
+    def __init__(self, emitter: EventEmitter, request_id: str) -> None:
+        self.emitter = emitter
+        self.key = _get_key(request_id)
+        self.timed_out = False
+
+    async def emit(self, event: str, data: Dict) -> None:
+        entry_id = await self._append(event, data)
+        if entry_id is None:
+            _counters["append_errors"] += 1
+        else:
+            _counters["appended"] += 1
+            data = {**data, "id": entry_id}
+        await self.emitter.emit(event, data)
+
+    async def end(self, status: str = "done") -> None:
+        """
+        Mark the stream as complete, nothing is appended after this.
+        """
+        await self._append(END_EVENT, {"status": status})
+
+    async def _append(self, event: str, data: Dict) -> Optional[str]:
+        if self.timed_out:
+            return None
+        try:
+            return await asyncio.wait_for(
+                ChatStore().append_stream(
+                    self.key,
+                    {"event": event, "data": json.dumps(data)},
+                    STREAM_TTL,
+                    STREAM_MAX_LENGTH,
+                ),
+                STREAM_APPEND_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Appending {event} to {self.key} timed out, giving up")
+            self.timed_out = True
+            return None
+
+
+async def replay_stream(
+    request_id: str,
+    offset: str,
+    emitter: EventEmitter,
+    tail_timeout: float = STREAM_TAIL_TIMEOUT,
+) -> bool:
+    """
+    Send the events of a request after the entry `offset` ("0" for all of them), then the
+    new ones as they are appended, until the request is over or nothing was appended for
+    `tail_timeout` seconds. Returns False if there is no such request (or it expired), if
+    it was cancelled or if its stream can't be read.
+    """
+    key = _get_key(request_id)
+    chat_store = ChatStore()
+    if not await chat_store.stream_exists(key):
+        return False
+
+    _counters["resumes"] += 1
+    logger.info(f"Resuming request {request_id} from {offset}")
+
+    last_event_at = time.monotonic()
+    while time.monotonic() - last_event_at < tail_timeout:
+        entries = await chat_store.read_stream(key, offset, block=1000)
+        if entries is None:
+            return False
+        for entry_id, fields in entries:
+            offset = entry_id
+            if fields["event"] == END_EVENT:
+                return json.loads(fields["data"])["status"] != "cancelled"
+            _counters["replayed"] += 1
+            data = {**json.loads(fields["data"]), "id": entry_id}
+            await emitter.emit(fields["event"], data)
+        if entries:
+            last_event_at = time.monotonic()
+
+    logger.info(f"Stopped tailing request {request_id}, nothing new in {tail_timeout}s")
+    return True
+
+
+def get_stream_stats() -> AnswerStreamStats:
+    return AnswerStreamStats(
+        appended=_counters["appended"],
+        append_errors=_counters["append_errors"],
+        resumes=_counters["resumes"],
+        replayed=_counters["replayed"],
+    )
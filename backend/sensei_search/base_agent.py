@@ -1,22 +1,43 @@
 from __future__ import annotations
 
 import asyncio
+import json
+import re
 import uuid
 from abc import ABC, abstractmethod
+from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Literal, Optional, Protocol, Union
+from typing import Any, Dict, List, Literal, Optional, Protocol, Union
 
-import trafilatura  # type: ignore[import]
-from aiohttp import ClientSession, ClientTimeout
 from pydantic import BaseModel, Field
 from typing_extensions import TypedDict
 
-from sensei_search.chat_store import ChatHistoryItem, ChatStore, ThreadMetadata
+from sensei_search.answer_cache import AnswerCache, CachedAnswer
+from sensei_search.answer_framing import CoalescingEmitter
+from sensei_search.chat_store import (
+    CHAT_HISTORY_LIMIT,
+    ChatHistoryItem,
+    ChatStore,
+    ThreadMetadata,
+)
+from sensei_search.config import (
+    SM_MODEL,
+    SM_MODEL_API_KEY,
+    SM_MODEL_JSON_MODE,
+    SM_MODEL_URL,
+)
+from sensei_search.llm_clients import LLMClients
+from sensei_search.llm_memo import memoized_completion
 from sensei_search.logger import logger
 from sensei_search.models import MediumImage, MediumVideo, MetaData, WebResult
+from sensei_search.pipeline import Pipeline, StopPipeline
 from sensei_search.tools import GeneralResult, TopResults
-
-FETCH_WEBPAGE_TIMEOUT = 3
+from sensei_search.utils import create_slug
+from sensei_search.web_pages import (
+    DeadlineFetchResult,
+    fetch_pages,
+    fetch_pages_by_deadline,
+)
 
 
 class NoAccessError(Exception):
@@ -95,6 +116,94 @@ class EnrichedQuery(TypedDict, total=False):
     tags: Optional[QueryTags]
 
 
+# The classification tags used by the older `CATEGORY:YES/NO` prompts
+LEGACY_TAG_NAMES = {
+    "SEARCH_NEEDED": "needs_search",
+    "SEARCH_IMAGE": "needs_image",
+    "SEARCH_VIDEO": "needs_video",
+    "CONTENT_VIOLATION": "content_violation",
+    "MATH": "has_math",
+}
+
+KEY_VALUE_RE = re.compile(r"""["']?(\w+)["']?\s*:\s*("[^"]*"|[^,\n}]*)""")
+
+
+def _to_bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        value = value.strip().strip("\"'").lower()
+        if value in ("true", "yes"):
+            return True
+        if value in ("false", "no"):
+            return False
+    return None
+
+
+def _find_json_object(content: str) -> Dict[str, Any]:
+    """
+    The first JSON object in `content`, decoded from the first `{` it starts at, so
+    braces in the surrounding text don't get in the way.
+    """
+    decoder = json.JSONDecoder()
+    start = content.find("{")
+    while start != -1:
+        try:
+            parsed, _ = decoder.raw_decode(content, start)
+            if isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+        start = content.find("{", start + 1)
+    return {}
+
+
+def parse_enriched_query(content: str, fallback_query: str) -> EnrichedQuery:
+    """
+    Parse the reply of a query understanding prompt, a JSON object with the search query
+    and the QueryTags.
+
+    Small models don't always comply: code fences and surrounding text are ignored,
+    loose `key: value` pairs (including the legacy `SEARCH_IMAGE:YES` tags) and bare
+    search queries are understood, and anything missing falls back to `fallback_query`
+    and the default tags.
+    """
+    data = _find_json_object(content)
+
+    if not data and content.strip():
+        logger.warning(f"Query understanding reply is not valid JSON: {content}")
+        data = {key: value.strip() for key, value in KEY_VALUE_RE.findall(content)}
+
+    if not data and content.strip():
+        if "NO_SEARCH_NEEDED" in content:
+            data = {"needs_search": False}
+        elif "\n" not in content.strip():
+            # A bare search query, as returned by the older search prompts
+            data = {"search_query": content}
+
+    flags: Dict[str, bool] = {}
+    for key, value in data.items():
+        name = LEGACY_TAG_NAMES.get(key.upper(), key.lower())
+        flag = _to_bool(value)
+        if name in LEGACY_TAG_NAMES.values() and flag is not None:
+            flags[name] = flag
+
+    search_query = data.get("search_query")
+    if not isinstance(search_query, str) or not search_query.strip("\"' \n"):
+        search_query = fallback_query
+
+    return EnrichedQuery(
+        search_query=search_query.strip("\"' \n"),
+        tags=QueryTags(
+            needs_search=flags.get("needs_search", True),
+            needs_image=flags.get("needs_image", False),
+            needs_video=flags.get("needs_video", False),
+            content_violation=flags.get("content_violation", False),
+            has_math=flags.get("has_math", False),
+        ),
+    )
+
+
 class AgentInput(BaseModel):
     session_id: str = Field(..., description="A globally unique session ID")
     user_input: str = Field(..., description="The user's input")
@@ -106,16 +215,39 @@ class BaseAgent(ABC):
     """
 
     chat_messages: List[Dict]
-    emitter: EventEmitter
+    emitter: CoalescingEmitter
     thread_id: str
     user_id: str
 
-    def __init__(self, user_id: str, thread_id: str, emitter: EventEmitter) -> None:
+    # About how many upstream requests (LLM, search, page fetches) each stage makes, to
+    # estimate what cancelling a run saves
+    UPSTREAM_REQUESTS: Dict[str, int] = {
+        "query": 1,
+        "search": 1,
+        "web_pages": 5,
+        "answer": 1,
+        "medium": 1,
+        "related": 1,
+    }
+
+    def __init__(
+        self,
+        user_id: str,
+        thread_id: str,
+        emitter: EventEmitter,
+        history_cache: Optional[Dict[str, List[ChatHistoryItem]]] = None,
+    ) -> None:
         self.chat_messages = []
         self.chat_messages_loaded = False
+        # Chat histories by thread kept between the turns of a session, see
+        # load_chat_history()
+        self.history_cache = history_cache
         self.user_id = user_id
         self.thread_id = thread_id
-        self.emitter = emitter
+        self.emitter = CoalescingEmitter(emitter)
+        # The answer as streamed so far
+        self.answer_chunks: List[str] = []
+        self.pipeline: Optional[Pipeline] = None
 
     async def emit_thread_metadata(self, metadata: ThreadMetadata) -> None:
         """
@@ -176,8 +308,15 @@ class BaseAgent(ABC):
         """
         Send the LLM answer to the frontend.
         """
+        self.answer_chunks.append(answer)
         await self.emitter.emit(EventEnum.answer.value, {"data": answer})
 
+    async def flush_answer(self) -> None:
+        """
+        Send what's left of the answer, once it's complete.
+        """
+        await self.emitter.flush()
+
     async def emit_related_questions(self, related_questions: List[str]) -> None:
         """
         Send the related questions to the frontend.
@@ -190,22 +329,223 @@ class BaseAgent(ABC):
         """
         Fetch the web page contents for the search results.
         """
+        return await fetch_pages([result["url"] for result in results])
+
+    async def fetch_web_pages_by_deadline(
+        self, results: List[GeneralResult]
+    ) -> DeadlineFetchResult:
+        """
+        Fetch the web page contents for the search results, without waiting for the
+        slowest pages once enough of them have arrived.
+
+        Pages that didn't arrive in time are returned as empty strings, so that document
+        numbers still line up with the web results sent to the frontend for citations.
+        Their URLs are returned as "dropped".
+        """
+        return await fetch_pages_by_deadline([result["url"] for result in results])
 
-        async def fetch_page(url: str, session: ClientSession) -> str:
-            try:
-                async with session.get(url) as response:
-                    return await response.text()
-            except asyncio.TimeoutError:
-                logger.warning(f"Timeout occurred when fetching {url}")
-            except Exception as e:
-                logger.exception(f"Error fetching {url}: {e}")
-            return ""
+    async def understand_query(self, prompt: str) -> EnrichedQuery:
+        """
+        Rewrite the user's latest query for search and classify it with a single small
+        model call. If the call fails, the user's query is searched as is.
+        """
+        try:
+            client = LLMClients().get(SM_MODEL_URL, SM_MODEL_API_KEY)
+            params: Dict[str, Any] = {}
+            if SM_MODEL_JSON_MODE:
+                params["response_format"] = {"type": "json_object"}
+            content = await memoized_completion(
+                client,
+                model=SM_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+                max_tokens=500,
+                **params,
+            )
+        except Exception as e:
+            logger.exception(f"Error understanding user query: {e}")
+            content = ""
+
+        enriched_query = parse_enriched_query(
+            content, self.chat_messages[-1]["content"]
+        )
+        logger.info(enriched_query)
+        return enriched_query
+
+    def raw_query(self) -> EnrichedQuery:
+        """
+        The user's latest query, searched as is, for when the query can't be understood.
+        """
+        return parse_enriched_query("", self.chat_messages[-1]["content"])
 
-        timeout = ClientTimeout(total=FETCH_WEBPAGE_TIMEOUT)
-        async with ClientSession(timeout=timeout) as session:
-            tasks = [fetch_page(result["url"], session) for result in results]
-            html_web_pages = await asyncio.gather(*tasks)
-            return [trafilatura.extract(page) for page in html_web_pages]
+    async def no_medium_results(self) -> TopResults:
+        medium_results = TopResults(general=[], images=[], videos=[])
+        await self.emit_medium_results(medium_results)
+        return medium_results
+
+    def add_turn_stages(
+        self,
+        pipeline: Pipeline,
+        user_message: str,
+        roles: List[Literal["user", "assistant"]],
+    ) -> None:
+        """
+        Add the stages every agent starts with: "history" and "thread_metadata" load the
+        thread, and "turn" checks access, answers from the cache if it can (stopping the
+        pipeline) and appends the user message to the chat history. The result of "turn"
+        tells whether this is the first turn of the thread.
+        """
+        pipeline.stage("history", lambda: self.load_chat_history(self.thread_id, roles))
+        pipeline.stage("thread_metadata", self.get_thread_metadata)
+        pipeline.stage(
+            "turn",
+            lambda history, thread_metadata: self.start_turn(
+                user_message, thread_metadata
+            ),
+            depends_on=["history", "thread_metadata"],
+        )
+
+    async def start_turn(
+        self, user_message: str, thread_metadata: Optional[ThreadMetadata]
+    ) -> bool:
+        logger.info(f"Thread metadata: {thread_metadata}")
+
+        # Check if the user has access to the thread
+        # We assume there is no easy way to guess the uuid of a user
+        if thread_metadata and thread_metadata["user_id"] != self.user_id:
+            logger.warning(
+                f"User {self.user_id} does not have access to thread {self.thread_id}"
+            )
+            raise NoAccessError()
+
+        logger.info(f"User original query: {user_message}")
+
+        if await self.answer_from_cache(user_message, thread_metadata):
+            raise StopPipeline()
+
+        # Only the answers to first-turn questions are cached, the others depend on the
+        # chat history
+        first_turn = not self.chat_messages
+
+        # Append user message to chat history
+        self.append_message(role="user", content=user_message)
+        return first_turn
+
+    async def finish_turn(
+        self,
+        user_message: str,
+        first_turn: bool,
+        thread_metadata: Optional[ThreadMetadata],
+        answer: str,
+        medium_results: TopResults,
+        general_results: List[GeneralResult],
+        related_questions: List[str],
+        metadata: MetaData,
+    ) -> None:
+        """
+        Send the related questions, then save the thread and cache the answer.
+        """
+        logger.debug(f"Answer for query {user_message} is {answer}")
+        logger.debug(f"Related questions: {related_questions}")
+
+        await self.emit_related_questions(related_questions)
+
+        if not thread_metadata:
+            # Create a new thread metadata
+            thread_metadata = ThreadMetadata(
+                name=user_message[:50],
+                user_id=self.user_id,
+                created_at=datetime.now().isoformat(),
+                slug=create_slug(user_message),
+                related_questions=related_questions,
+            )
+            # We send the thread metadata to the client for it save it in the local storage
+            await asyncio.gather(
+                self.emit_thread_metadata(thread_metadata),
+                self.upsert_thread_metadata(thread_metadata),
+            )
+            logger.info(f"Saved thread metadata: {thread_metadata}")
+
+        await self.save_chat_history(
+            user_message, answer, medium_results, general_results, metadata
+        )
+
+        if first_turn:
+            await self.cache_answer(
+                user_message,
+                answer,
+                medium_results,
+                general_results,
+                related_questions,
+                metadata,
+            )
+
+    async def answer_from_cache(
+        self, user_message: str, thread_metadata: Optional[ThreadMetadata]
+    ) -> bool:
+        """
+        Replay the cached answer to a near-duplicate question, skipping the search and
+        both LLMs. Only first-turn questions are answered from the cache, later ones
+        depend on the chat history. Returns False if there is no usable cached answer.
+        """
+        if self.chat_messages:
+            return False
+
+        cached = await AnswerCache().lookup(type(self).__name__, user_message)
+        if cached is None:
+            return False
+
+        await self.emit_metadata(cached["metadata"])
+        await self.emit_web_results(cached["web_results"])
+        await self.emit_medium_results(cached["medium_results"])
+        await self.emit_answer(cached["answer"])
+        await self.emit_related_questions(cached["related_questions"])
+
+        if not thread_metadata:
+            thread_metadata = ThreadMetadata(
+                name=user_message[:50],
+                user_id=self.user_id,
+                created_at=datetime.now().isoformat(),
+                slug=create_slug(user_message),
+                related_questions=cached["related_questions"],
+            )
+            await asyncio.gather(
+                self.emit_thread_metadata(thread_metadata),
+                self.upsert_thread_metadata(thread_metadata),
+            )
+
+        await self.save_chat_history(
+            user_message,
+            cached["answer"],
+            cached["medium_results"],
+            cached["web_results"],
+            cached["metadata"],
+        )
+        return True
+
+    async def cache_answer(
+        self,
+        user_message: str,
+        answer: str,
+        medium_results: TopResults,
+        general_results: List[GeneralResult],
+        related_questions: List[str],
+        metadata: MetaData,
+    ) -> None:
+        """
+        Cache the answer to a first-turn question for near-duplicate questions.
+        """
+        await AnswerCache().store(
+            type(self).__name__,
+            CachedAnswer(
+                query=user_message,
+                answer=answer,
+                web_results=general_results,
+                medium_results=medium_results,
+                related_questions=related_questions,
+                metadata=metadata,
+            ),
+        )
 
     async def save_chat_history(
         self,
@@ -247,6 +587,10 @@ class BaseAgent(ABC):
             "metadata": metadata,
         }
         await chat_store.save_chat_history(self.thread_id, chat_history)
+        if self.history_cache is not None and self.thread_id in self.history_cache:
+            history = self.history_cache[self.thread_id]
+            history.append(chat_history)
+            del history[:-CHAT_HISTORY_LIMIT]
 
     async def load_chat_history(
         self, thread_id: str, roles: Optional[List[Literal["user", "assistant"]]] = None
@@ -255,6 +599,9 @@ class BaseAgent(ABC):
         Load the chat history for the current thread from Redis.
 
         We don't store system messages in the chat history, so we only load user and assistant messages.
+
+        With a history cache, the chat history is only loaded from Redis on the first turn
+        of the thread in the session, later turns reuse the cached one.
         """
         if self.chat_messages_loaded:
             return
@@ -262,9 +609,13 @@ class BaseAgent(ABC):
         if roles is None:
             roles = ["user", "assistant"]
 
-        chat_store = ChatStore()
-
-        chat_history = await chat_store.get_chat_history(thread_id)
+        if self.history_cache is not None and thread_id in self.history_cache:
+            chat_history = self.history_cache[thread_id]
+        else:
+            chat_store = ChatStore()
+            chat_history = await chat_store.get_chat_history(thread_id)
+            if self.history_cache is not None:
+                self.history_cache[thread_id] = chat_history
 
         for m in chat_history:
             if "user" in roles:
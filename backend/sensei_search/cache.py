@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+from typing_extensions import TypedDict
+
+V = TypeVar("V")
+
+
+class CacheStats(TypedDict):
+    size: int
+    weight: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+class LRUCache(Generic[V]):
+    """
+    A small in-process LRU cache with per-entry TTL.
+
+    Entries are evicted when the cache grows beyond `max_size` entries, or beyond
+    `max_weight` when a `weigher` is given (least recently used first), or lazily on access
+    once their TTL has expired. This is not thread-safe, it is meant to be used from the
+    event loop only.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        max_weight: Optional[int] = None,
+        weigher: Optional[Callable[[V], int]] = None,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self._entries: OrderedDict[Hashable, Tuple[float, int, V]] = OrderedDict()
+        self._weight = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+
+        expires_at, _, value = entry
+        if expires_at < time.monotonic():
+            self.delete(key)
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        weight = self.weigher(value) if self.weigher else 0
+
+        self.delete(key)
+        self._entries[key] = (expires_at, weight, value)
+        self._weight += weight
+
+        while len(self._entries) > self.max_size or (
+            self.max_weight is not None and self._weight > self.max_weight
+        ):
+            _, (_, evicted_weight, _) = self._entries.popitem(last=False)
+            self._weight -= evicted_weight
+            self._evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._weight -= entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._weight = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            size=len(self._entries),
+            weight=self._weight,
+            hits=self._hits,
+            misses=self._misses,
+            evictions=self._evictions,
+        )
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import json
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Tuple, cast
 
 import redis.asyncio as redis
 
@@ -102,6 +102,93 @@ class ChatStore:
             logger.exception(e)
             return []
 
+    async def get_cache(self, key: str) -> Optional[str]:
+        """
+        Read a plain cache entry. Cache failures should never fail a request, so any
+        error is logged and treated as a miss.
+        """
+        try:
+            return await self._awaitable_to_any(self.redis.get(key))
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+    async def set_cache(self, key: str, value: str, ttl: int) -> None:
+        """
+        Write a plain cache entry that expires after `ttl` seconds.
+        """
+        try:
+            await self._awaitable_to_any(self.redis.set(key, value, ex=ttl))
+        except Exception as e:
+            logger.exception(e)
+
+    async def set_index_entry(self, key: str, field: str, value: str) -> None:
+        """
+        Write a field of a cache index, a Redis hash. Errors are logged and ignored.
+        """
+        try:
+            await self._awaitable_to_any(self.redis.hset(key, field, value))
+        except Exception as e:
+            logger.exception(e)
+
+    async def get_index_entries(self, key: str) -> Dict[str, str]:
+        """
+        Read all the fields of a cache index, treating errors as an empty index.
+        """
+        try:
+            return await self._awaitable_to_any(self.redis.hgetall(key))
+        except Exception as e:
+            logger.exception(e)
+            return {}
+
+    async def delete_index_entries(self, key: str, fields: List[str]) -> None:
+        try:
+            await self._awaitable_to_any(self.redis.hdel(key, *fields))
+        except Exception as e:
+            logger.exception(e)
+
+    async def append_stream(
+        self, key: str, fields: Dict[str, str], ttl: int, max_length: int
+    ) -> Optional[str]:
+        """
+        Append an entry to a Redis Stream, (re)setting its expiry. Returns the id of the
+        entry, or None if it couldn't be written.
+        """
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            pipeline.xadd(
+                key, cast(Dict[Any, Any], fields), maxlen=max_length, approximate=True
+            )
+            pipeline.expire(key, ttl)
+            entry_id, _ = await pipeline.execute()
+            return entry_id
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+    async def read_stream(
+        self, key: str, offset: str, block: int
+    ) -> Optional[List[Tuple[str, Dict[str, str]]]]:
+        """
+        Read the entries of a Redis Stream after the entry `offset`, waiting for up to
+        `block` milliseconds for new ones. Returns None on errors.
+        """
+        try:
+            streams = await self._awaitable_to_any(
+                self.redis.xread({key: offset}, block=block)
+            )
+        except Exception as e:
+            logger.exception(e)
+            return None
+        return streams[0][1] if streams else []
+
+    async def stream_exists(self, key: str) -> bool:
+        try:
+            return bool(await self._awaitable_to_any(self.redis.exists(key)))
+        except Exception as e:
+            logger.exception(e)
+            return False
+
     @staticmethod
     async def _awaitable_to_any(awaitable: Any) -> Any:
         return await awaitable
@@ -1,4 +1,5 @@
 import os
+from typing import Literal
 
 from sensei_search.env import load_envs
 
@@ -17,3 +18,159 @@ SM_MODEL_API_KEY = os.environ["SM_MODEL_API_KEY"]
 MD_MODEL_URL = os.environ["MD_MODEL_URL"]
 MD_MODEL = os.environ["MD_MODEL"]
 MD_MODEL_API_KEY = os.environ["MD_MODEL_API_KEY"]
+
+# Shared HTTP connection pool
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "200"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+
+# Search result cache
+SEARCH_CACHE_LOCAL_SIZE = int(os.getenv("SEARCH_CACHE_LOCAL_SIZE", "1000"))
+SEARCH_CACHE_LOCAL_TTL = int(os.getenv("SEARCH_CACHE_LOCAL_TTL", "300"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "21600"))
+SEARCH_CACHE_FRESH_TTL = int(os.getenv("SEARCH_CACHE_FRESH_TTL", "300"))
+
+# Image accessibility checks
+IMAGE_CHECK_CONCURRENCY = int(os.getenv("IMAGE_CHECK_CONCURRENCY", "32"))
+IMAGE_CHECK_TIMEOUT = float(os.getenv("IMAGE_CHECK_TIMEOUT", "1.5"))
+IMAGE_FILTER_DEADLINE = float(os.getenv("IMAGE_FILTER_DEADLINE", "2"))
+IMAGE_VERDICT_CACHE_SIZE = int(os.getenv("IMAGE_VERDICT_CACHE_SIZE", "10000"))
+IMAGE_VERDICT_TTL = int(os.getenv("IMAGE_VERDICT_TTL", "86400"))
+IMAGE_VERDICT_NEGATIVE_TTL = int(os.getenv("IMAGE_VERDICT_NEGATIVE_TTL", "600"))
+IMAGE_HOST_FAILURE_TTL = int(os.getenv("IMAGE_HOST_FAILURE_TTL", "60"))
+
+# HTML extraction worker pool, EXTRACTION_EXECUTOR is either "process" or "thread"
+EXTRACTION_EXECUTOR = os.getenv("EXTRACTION_EXECUTOR", "process")
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+EXTRACTION_MAX_QUEUE = int(os.getenv("EXTRACTION_MAX_QUEUE", "64"))
+EXTRACTION_MAX_INPUT_CHARS = int(os.getenv("EXTRACTION_MAX_INPUT_CHARS", "2000000"))
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "2"))
+
+# Extracted web page cache. Fresh entries are served without network I/O, stale ones
+# are revalidated with a conditional GET. Entries are kept for PAGE_CACHE_TTL, with at
+# most PAGE_CACHE_MAX_TEXT_CHARS characters of text. The Redis tier shares the chat
+# history's Redis: at about 8 pages per question, budget PAGE_CACHE_TTL worth of
+# questions times 8 * PAGE_CACHE_MAX_TEXT_CHARS bytes, or run Redis with a maxmemory
+# and an LRU eviction policy.
+PAGE_CACHE_FRESH_TTL = int(os.getenv("PAGE_CACHE_FRESH_TTL", "3600"))
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "86400"))
+PAGE_CACHE_MAX_TEXT_CHARS = int(os.getenv("PAGE_CACHE_MAX_TEXT_CHARS", "50000"))
+PAGE_CACHE_LOCAL_SIZE = int(os.getenv("PAGE_CACHE_LOCAL_SIZE", "5000"))
+PAGE_CACHE_LOCAL_MAX_BYTES = int(os.getenv("PAGE_CACHE_LOCAL_MAX_BYTES", "67108864"))
+
+# Deadline-driven page fetching. Once FETCH_SOFT_DEADLINE has passed and FETCH_QUORUM
+# pages have arrived, the rest are dropped. A duplicate request is fired for pages that
+# are still loading after FETCH_HEDGE_AFTER seconds, set it to 0 to disable hedging.
+FETCH_SOFT_DEADLINE = float(os.getenv("FETCH_SOFT_DEADLINE", "1.5"))
+FETCH_HARD_DEADLINE = float(os.getenv("FETCH_HARD_DEADLINE", "4"))
+FETCH_QUORUM = int(os.getenv("FETCH_QUORUM", "3"))
+FETCH_HEDGE_AFTER = float(os.getenv("FETCH_HEDGE_AFTER", "0.8")) or None
+
+# Search providers, e.g. "searxng,bing". When empty, SearxNG is used in development and
+# Bing in production. With several providers, SEARCH_FUSION_MODE is either "fuse" (merge
+# all results) or "first" (the first provider with enough results wins). Providers slower
+# than SEARCH_PROVIDER_TIMEOUT seconds are left out of the results, unless none was
+# faster.
+SEARCH_PROVIDERS = os.getenv("SEARCH_PROVIDERS", "")
+SEARCH_FUSION_MODE: Literal["fuse", "first"] = (
+    "first" if os.getenv("SEARCH_FUSION_MODE", "fuse") == "first" else "fuse"
+)
+SEARCH_FUSION_MIN_RESULTS = int(os.getenv("SEARCH_FUSION_MIN_RESULTS", "3"))
+SEARCH_RRF_K = int(os.getenv("SEARCH_RRF_K", "60"))
+SEARCH_PROVIDER_TIMEOUT = float(os.getenv("SEARCH_PROVIDER_TIMEOUT", "3"))
+
+# Web page bodies are truncated to this many bytes before extraction
+PAGE_MAX_BYTES = int(os.getenv("PAGE_MAX_BYTES", "1500000"))
+
+# Shared LLM client connection pools, one per model endpoint. HTTP/2 is used when
+# LLM_HTTP2 is set and the h2 package is installed.
+LLM_POOL_LIMIT = int(os.getenv("LLM_POOL_LIMIT", "100"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+
+# Ask the small model for a JSON object (OpenAI's response_format). Only enable it for
+# endpoints that support it, the reply is parsed leniently either way.
+SM_MODEL_JSON_MODE = os.getenv("SM_MODEL_JSON_MODE", "false").lower() == "true"
+
+# Memoized small model outputs (query understanding, related questions). Entries expire
+# at midnight at the latest, as prompts refer to the current date.
+LLM_MEMO_TTL = int(os.getenv("LLM_MEMO_TTL", "86400"))
+LLM_MEMO_LOCAL_SIZE = int(os.getenv("LLM_MEMO_LOCAL_SIZE", "2000"))
+
+# Near-duplicate answer cache for first-turn questions. A cached answer is replayed when
+# the content words of two questions have a Jaccard similarity of at least
+# ANSWER_CACHE_SIMILARITY and their numbers (e.g. years) and question words (who, when,
+# why...) are the same.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.65"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "21600"))
+ANSWER_CACHE_INDEX_SIZE = int(os.getenv("ANSWER_CACHE_INDEX_SIZE", "50000"))
+ANSWER_CACHE_LOCAL_SIZE = int(os.getenv("ANSWER_CACHE_LOCAL_SIZE", "1000"))
+ANSWER_CACHE_INDEX_REFRESH = int(os.getenv("ANSWER_CACHE_INDEX_REFRESH", "60"))
+
+# Token budgets for the search context in prompts, per model. CONTEXT_TOKENIZER is
+# "auto" (tiktoken when installed), "tiktoken" or "chars" (~4 characters per token).
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "auto")
+SM_MODEL_CONTEXT_TOKENS = int(os.getenv("SM_MODEL_CONTEXT_TOKENS", "1250"))
+MD_MODEL_CONTEXT_TOKENS = int(os.getenv("MD_MODEL_CONTEXT_TOKENS", "6000"))
+
+# Fetched pages are split into passages of about RERANK_PASSAGE_WORDS words, and only
+# the RERANK_TOP_PASSAGES passages that best match the search query (BM25) are kept as
+# context for the answer and the related questions. Pages that can't be reranked within
+# RERANK_TIMEOUT seconds, e.g. when the extraction workers are busy, are used as they are.
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+RERANK_PASSAGE_WORDS = int(os.getenv("RERANK_PASSAGE_WORDS", "120"))
+RERANK_TOP_PASSAGES = int(os.getenv("RERANK_TOP_PASSAGES", "12"))
+RERANK_TIMEOUT = float(os.getenv("RERANK_TIMEOUT", "1"))
+
+# When ShogunAgent starts generating related questions: "answer" (after the whole answer,
+# from the answer), "partial" (once the answer has streamed RELATED_QUESTIONS_AFTER_CHUNKS
+# chunks, from the start of the answer) or "search" (as soon as the search results are
+# in, from the search results only). The earlier modes trade some quality for latency.
+RELATED_QUESTIONS_START = os.getenv("RELATED_QUESTIONS_START", "answer")
+RELATED_QUESTIONS_AFTER_CHUNKS = int(os.getenv("RELATED_QUESTIONS_AFTER_CHUNKS", "40"))
+
+# Timeouts in seconds of the agent stages that have a fallback: the raw user query for
+# the query understanding, no images and videos for the medium search, no web pages for
+# the answer and no related questions. The web pages timeout is a backstop, fetching
+# them already gives up after FETCH_HARD_DEADLINE and reranking after RERANK_TIMEOUT.
+QUERY_UNDERSTANDING_TIMEOUT = float(os.getenv("QUERY_UNDERSTANDING_TIMEOUT", "5"))
+MEDIUM_SEARCH_TIMEOUT = float(os.getenv("MEDIUM_SEARCH_TIMEOUT", "5"))
+WEB_PAGES_TIMEOUT = float(os.getenv("WEB_PAGES_TIMEOUT", "8"))
+RELATED_QUESTIONS_TIMEOUT = float(os.getenv("RELATED_QUESTIONS_TIMEOUT", "10"))
+
+# Answer deltas are coalesced into frames sent every ANSWER_FLUSH_INTERVAL_MS, or as soon
+# as ANSWER_FLUSH_BYTES are buffered. The first delta is always sent right away. An
+# interval of 0 sends every delta as its own frame.
+ANSWER_FLUSH_INTERVAL = int(os.getenv("ANSWER_FLUSH_INTERVAL_MS", "20")) / 1000
+ANSWER_FLUSH_BYTES = int(os.getenv("ANSWER_FLUSH_BYTES", "512"))
+
+# Events are sent to each client from a queue of OUTBOUND_QUEUE_SIZE events, so that a
+# slow client doesn't slow its agent down. When the queue is full, answer chunks are
+# merged ("coalesce"), superseded events are dropped as well ("drop"), or the client is
+# disconnected ("abort"). Queued events get OUTBOUND_DRAIN_TIMEOUT seconds to be sent
+# once the answer is complete.
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "64"))
+OUTBOUND_OVERFLOW_POLICY = os.getenv("OUTBOUND_OVERFLOW_POLICY", "coalesce")
+OUTBOUND_DRAIN_TIMEOUT = float(os.getenv("OUTBOUND_DRAIN_TIMEOUT", "10"))
+
+# Clients can ask for a resumable request. Its events are then also appended to a Redis
+# Stream, kept STREAM_TTL seconds (and up to about STREAM_MAX_LENGTH events), so that the
+# client can resume the request if it loses its connection. Its run is kept going for
+# RESUME_GRACE_PERIOD seconds after a disconnect, waiting for the client to resume, while
+# other runs are cancelled right away. Appends taking over STREAM_APPEND_TIMEOUT seconds
+# are given up. Resumed streams are tailed until the request is over, or nothing happened
+# for STREAM_TAIL_TIMEOUT seconds. RESUMABLE_STREAMS=false turns resumable requests off.
+RESUMABLE_STREAMS = os.getenv("RESUMABLE_STREAMS", "true").lower() == "true"
+STREAM_TTL = int(os.getenv("STREAM_TTL", "600"))
+STREAM_MAX_LENGTH = int(os.getenv("STREAM_MAX_LENGTH", "5000"))
+RESUME_GRACE_PERIOD = float(os.getenv("RESUME_GRACE_PERIOD", "30"))
+STREAM_TAIL_TIMEOUT = float(os.getenv("STREAM_TAIL_TIMEOUT", "30"))
+STREAM_APPEND_TIMEOUT = float(os.getenv("STREAM_APPEND_TIMEOUT", "1"))
+
+# Clients can keep their socket.io connection open between questions with persistent
+# sessions. The socket of a persistent session is closed after SESSION_IDLE_TIMEOUT
+# seconds without a request.
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "300"))
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import math
+import re
+from typing import Callable, Dict, List, Optional
+
+from typing_extensions import TypedDict
+
+from sensei_search.config import CONTEXT_TOKENIZER
+from sensei_search.logger import logger
+
+# Counts the tokens of a text
+Tokenizer = Callable[[str], int]
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?。！？])\s+|\n+")
+
+
+class PackedContext(TypedDict):
+    # Aligned with the input documents, empty documents stay empty
+    documents: List[str]
+    tokens: int
+    tokens_saved: int
+
+
+class ContextPackingStats(TypedDict):
+    packed: int
+    truncated_documents: int
+    tokens: int
+    tokens_saved: int
+
+
+_counters = {"packed": 0, "truncated_documents": 0, "tokens": 0, "tokens_saved": 0}
+
+
+def count_tokens_by_chars(text: str) -> int:
+    # About 4 characters per token for English text with the common BPE tokenizers
+    return math.ceil(len(text) / 4)
+
+
+def _tiktoken_tokenizer() -> Optional[Tokenizer]:
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.info(f"tiktoken is not available, estimating tokens from length: {e}")
+        return None
+
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+_tokenizers: Dict[str, Tokenizer] = {}
+
+
+def get_tokenizer(name: str = CONTEXT_TOKENIZER) -> Tokenizer:
+    """
+    Get a tokenizer by name: "tiktoken", "chars" or "auto" (tiktoken when installed).
+    """
+    if name not in _tokenizers:
+        tokenizer = None
+        if name in ("auto", "tiktoken"):
+            tokenizer = _tiktoken_tokenizer()
+        _tokenizers[name] = tokenizer or count_tokens_by_chars
+    return _tokenizers[name]
+
+
+def register_tokenizer(name: str, tokenizer: Tokenizer) -> None:
+    """
+    Make a tokenizer available to get_tokenizer(), e.g. one matching a self-hosted model.
+    """
+    _tokenizers[name] = tokenizer
+
+
+def truncate_to_tokens(text: str, max_tokens: int, tokenizer: Tokenizer) -> str:
+    """
+    Cut a text to at most `max_tokens` on a sentence boundary. If not even the first
+    sentence fits, the text is cut on a word boundary instead.
+    """
+    if tokenizer(text) <= max_tokens:
+        return text
+
+    kept: List[str] = []
+    used = 0
+    position = 0
+    for match in SENTENCE_END_RE.finditer(text + "\n"):
+        sentence = text[position : match.end()]
+        tokens = tokenizer(sentence)
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+        position = match.end()
+
+    if kept:
+        return "".join(kept).rstrip()
+
+    words: List[str] = []
+    for word in text.split():
+        tokens = tokenizer(word + " ")
+        if used + tokens > max_tokens:
+            break
+        words.append(word)
+        used += tokens
+    return " ".join(words)
+
+
+def pack_documents(
+    documents: List[str], budget: int, tokenizer: Optional[Tokenizer] = None
+) -> PackedContext:
+    """
+    Fit documents into a token budget.
+
+    The budget is shared fairly: documents shorter than an equal share are kept whole
+    and what they leave unused goes to the longer ones, which are truncated on sentence
+    boundaries. The order of the documents is kept.
+    """
+    tokenizer = tokenizer or get_tokenizer()
+    sizes = [tokenizer(document) if document else 0 for document in documents]
+
+    allocation = [0] * len(documents)
+    remaining = budget
+    order = sorted((i for i, size in enumerate(sizes) if size), key=lambda i: sizes[i])
+    for rank, i in enumerate(order):
+        share = remaining // (len(order) - rank)
+        allocation[i] = min(sizes[i], share)
+        remaining -= allocation[i]
+
+    packed = []
+    truncated = 0
+    for document, size, tokens in zip(documents, sizes, allocation):
+        if size > tokens:
+            truncated += 1
+            document = truncate_to_tokens(document, tokens, tokenizer)
+        packed.append(document)
+
+    total = sum(tokenizer(document) if document else 0 for document in packed)
+    tokens_saved = sum(sizes) - total
+
+    _counters["packed"] += 1
+    _counters["truncated_documents"] += truncated
+    _counters["tokens"] += total
+    _counters["tokens_saved"] += tokens_saved
+    if tokens_saved:
+        logger.info(f"Packed context into {total} tokens, saved {tokens_saved} tokens")
+
+    return PackedContext(documents=packed, tokens=total, tokens_saved=tokens_saved)
+
+
+def get_packing_stats() -> ContextPackingStats:
+    return ContextPackingStats(
+        packed=_counters["packed"],
+        truncated_documents=_counters["truncated_documents"],
+        tokens=_counters["tokens"],
+        tokens_saved=_counters["tokens_saved"],
+    )
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, Tuple, TypeVar
+
+import trafilatura  # type: ignore[import]
+from typing_extensions import TypedDict
+
+from sensei_search.config import (
+    EXTRACTION_EXECUTOR,
+    EXTRACTION_MAX_INPUT_CHARS,
+    EXTRACTION_MAX_QUEUE,
+    EXTRACTION_TIMEOUT,
+    EXTRACTION_WORKERS,
+)
+from sensei_search.logger import logger
+
+T = TypeVar("T")
+
+# How often a queued job is checked for having started, its time limit starts then
+EXTRACTION_START_POLL_INTERVAL = 0.05
+
+
+class ExtractorStats(TypedDict):
+    executor: str
+    pending: int
+    extracted: int
+    rejected: int
+    timed_out: int
+    failed: int
+    truncated: int
+    queue_wait_seconds: float
+    extraction_seconds: float
+
+
+def _extract(html: str, submitted_at: float) -> Tuple[Optional[str], float, float]:
+    """
+    Runs in a worker. Returns the extracted text along with the time the job waited in
+    the queue and the time it took to extract. Wall-clock time is used because the
+    timestamps cross process boundaries.
+    """
+    started_at = time.time()
+    text = trafilatura.extract(html)
+    return text, started_at - submitted_at, time.time() - started_at
+
+
+class Extractor:
+    """
+    Extracts the main text from HTML pages in a worker pool.
+
+    trafilatura is CPU bound, running it on the event loop stalls every other socket.io
+    session served by the worker. Instead, pages are extracted in a process pool (or a
+    thread pool when configured, or when a process pool can't be created).
+
+    To keep the pool from becoming a bottleneck under load:
+    - The number of pending jobs is bounded, pages over the limit are not extracted. A
+      job is pending until the pool is done with it, abandoned or not.
+    - Inputs are capped to `EXTRACTION_MAX_INPUT_CHARS` characters.
+    - Each page has an extraction time limit, counted from when the pool starts the job.
+      A job that runs over is abandoned, although the worker keeps running it to
+      completion.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args: Any, **kwargs: Any) -> Extractor:
+        # Ensure only one instance of Extractor is created
+        if not cls._instance:
+            cls._instance = super(Extractor, cls).__new__(cls, *args, **kwargs)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not hasattr(self, "_stats"):
+            self._executor: Optional[Executor] = None
+            self._executor_kind = EXTRACTION_EXECUTOR
+            self._stats = ExtractorStats(
+                executor=self._executor_kind,
+                pending=0,
+                extracted=0,
+                rejected=0,
+                timed_out=0,
+                failed=0,
+                truncated=0,
+                queue_wait_seconds=0.0,
+                extraction_seconds=0.0,
+            )
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._create_executor()
+        return self._executor
+
+    def start(self) -> None:
+        # Create the pool eagerly so the first request doesn't pay for spawning workers
+        if self._executor is None:
+            self._executor = self._create_executor()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            logger.info(f"Shutting down extraction pool, stats: {self.stats()}")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def stats(self) -> ExtractorStats:
+        return ExtractorStats(**self._stats)
+
+    async def extract(self, html: str) -> str:
+        """
+        Extract the main text of a page. Returns an empty string if there is nothing to
+        extract, or the page couldn't be extracted in time.
+        """
+        if not html:
+            return ""
+
+        if self._stats["pending"] >= EXTRACTION_MAX_QUEUE:
+            self._stats["rejected"] += 1
+            logger.warning("Extraction queue is full, skipping page")
+            return ""
+
+        if len(html) > EXTRACTION_MAX_INPUT_CHARS:
+            self._stats["truncated"] += 1
+            html = html[:EXTRACTION_MAX_INPUT_CHARS]
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = self.executor.submit(_extract, html, time.time())
+        except BrokenProcessPool as e:
+            logger.exception(f"Extraction pool is broken, falling back to threads: {e}")
+            self._stats["failed"] += 1
+            self._fallback_to_threads()
+            return ""
+
+        self._stats["pending"] += 1
+        future.add_done_callback(lambda _: self._job_done(loop))
+        try:
+            text, queue_wait, extraction_time = await self._wait(future)
+        except asyncio.TimeoutError:
+            self._stats["timed_out"] += 1
+            logger.warning("Timeout occurred when extracting page")
+            return ""
+        except BrokenProcessPool as e:
+            logger.exception(f"Extraction pool is broken, falling back to threads: {e}")
+            self._stats["failed"] += 1
+            self._fallback_to_threads()
+            return ""
+        except Exception as e:
+            logger.exception(f"Error extracting page: {e}")
+            self._stats["failed"] += 1
+            return ""
+
+        self._stats["extracted"] += 1
+        self._stats["queue_wait_seconds"] += queue_wait
+        self._stats["extraction_seconds"] += extraction_time
+
+        return text or ""
+
+    async def _wait(self, future: Future) -> Tuple[Optional[str], float, float]:
+        """
+        Wait for a job, for up to EXTRACTION_TIMEOUT seconds once the pool has started
+        it. Jobs still queued are cancelled if the caller is.
+        """
+        loop = asyncio.get_running_loop()
+        waiter = asyncio.wrap_future(future)
+        deadline: Optional[float] = None
+        while not waiter.done():
+            if deadline is None and future.running():
+                deadline = loop.time() + EXTRACTION_TIMEOUT
+            if deadline is None:
+                # The pool doesn't tell when a job starts, check now and then
+                timeout = EXTRACTION_START_POLL_INTERVAL
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    # Nobody will look at the result of the abandoned job
+                    waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+                    raise asyncio.TimeoutError()
+            try:
+                await asyncio.wait({waiter}, timeout=timeout)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+        return waiter.result()
+
+    def _job_done(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Called from a pool thread
+        def done() -> None:
+            self._stats["pending"] -= 1
+
+        try:
+            loop.call_soon_threadsafe(done)
+        except RuntimeError:
+            # The loop is closed, shutting down
+            pass
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Run other CPU bound work in the pool, e.g. reranking. `fn` must be picklable, a
+        module-level function. The extraction limits don't apply.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, fn, *args)
+        except BrokenProcessPool as e:
+            logger.exception(f"Extraction pool is broken, falling back to threads: {e}")
+            self._fallback_to_threads()
+            return await loop.run_in_executor(self.executor, fn, *args)
+
+    def _create_executor(self) -> Executor:
+        if self._executor_kind == "process":
+            try:
+                logger.info(f"Creating extraction process pool ({EXTRACTION_WORKERS})")
+                return ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+            except (NotImplementedError, OSError) as e:
+                logger.warning(f"Process pool unavailable, using threads: {e}")
+                self._executor_kind = "thread"
+                self._stats["executor"] = self._executor_kind
+
+        logger.info(f"Creating extraction thread pool ({EXTRACTION_WORKERS})")
+        return ThreadPoolExecutor(
+            max_workers=EXTRACTION_WORKERS, thread_name_prefix="extractor"
+        )
+
+    def _fallback_to_threads(self) -> None:
+        broken = self._executor
+        self._executor_kind = "thread"
+        self._stats["executor"] = self._executor_kind
+        self._executor = self._create_executor()
+        if broken is not None:
+            broken.shutdown(wait=False)
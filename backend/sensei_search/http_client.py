@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from types import SimpleNamespace
+from typing import Any, Optional
+
+from aiohttp import (
+    ClientSession,
+    TCPConnector,
+    TraceConfig,
+    TraceConnectionCreateEndParams,
+    TraceConnectionReuseconnParams,
+    TraceDnsCacheHitParams,
+    TraceDnsCacheMissParams,
+    TraceRequestStartParams,
+)
+from typing_extensions import TypedDict
+
+from sensei_search.config import (
+    HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_POOL_LIMIT,
+    HTTP_POOL_LIMIT_PER_HOST,
+)
+from sensei_search.logger import logger
+
+
+class HttpClientStats(TypedDict):
+    requests: int
+    connections_created: int
+    connections_reused: int
+    dns_cache_hits: int
+    dns_cache_misses: int
+
+
+class HttpClient:
+    """
+    A process-wide pooled HTTP client shared by the search tools and page fetching.
+
+    Opening a new ClientSession per call means a fresh TCP+TLS handshake and DNS lookup
+    for every request. Instead, a single session (and its connection pool) lives for the
+    lifetime of the app. It is started and closed from the FastAPI startup/shutdown hooks,
+    and lazily created on first use when running outside of the server.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args: Any, **kwargs: Any) -> HttpClient:
+        # Ensure only one instance of HttpClient is created
+        if not cls._instance:
+            cls._instance = super(HttpClient, cls).__new__(cls, *args, **kwargs)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not hasattr(self, "_stats"):
+            self._session: Optional[ClientSession] = None
+            self._stats = HttpClientStats(
+                requests=0,
+                connections_created=0,
+                connections_reused=0,
+                dns_cache_hits=0,
+                dns_cache_misses=0,
+            )
+
+    @property
+    def session(self) -> ClientSession:
+        """
+        The shared session. Callers must not close it.
+        """
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    async def start(self) -> None:
+        # Create the session eagerly so the first request doesn't pay for it
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            logger.info(f"Closing shared HTTP client, stats: {self.stats()}")
+            await self._session.close()
+        self._session = None
+
+    def stats(self) -> HttpClientStats:
+        return HttpClientStats(**self._stats)
+
+    def _create_session(self) -> ClientSession:
+        logger.info("Creating shared HTTP client")
+        connector = TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            use_dns_cache=True,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        )
+        return ClientSession(
+            connector=connector, trace_configs=[self._create_trace_config()]
+        )
+
+    def _create_trace_config(self) -> TraceConfig:
+        stats = self._stats
+
+        async def on_request_start(
+            session: ClientSession,
+            ctx: SimpleNamespace,
+            params: TraceRequestStartParams,
+        ) -> None:
+            stats["requests"] += 1
+
+        async def on_connection_create_end(
+            session: ClientSession,
+            ctx: SimpleNamespace,
+            params: TraceConnectionCreateEndParams,
+        ) -> None:
+            stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(
+            session: ClientSession,
+            ctx: SimpleNamespace,
+            params: TraceConnectionReuseconnParams,
+        ) -> None:
+            stats["connections_reused"] += 1
+
+        async def on_dns_cache_hit(
+            session: ClientSession, ctx: SimpleNamespace, params: TraceDnsCacheHitParams
+        ) -> None:
+            stats["dns_cache_hits"] += 1
+
+        async def on_dns_cache_miss(
+            session: ClientSession,
+            ctx: SimpleNamespace,
+            params: TraceDnsCacheMissParams,
+        ) -> None:
+            stats["dns_cache_misses"] += 1
+
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import importlib.util
+from typing import Any, Dict, List, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from typing_extensions import TypedDict
+
+from sensei_search.config import (
+    LLM_HTTP2,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_POOL_LIMIT,
+    LLM_POOL_MAX_KEEPALIVE,
+)
+from sensei_search.logger import logger
+
+
+class LLMClientStats(TypedDict):
+    base_url: str
+    http2: bool
+    requests: int
+    # Snapshot of the connection pool
+    max_connections: int
+    connections: int
+    active_connections: int
+    idle_connections: int
+
+
+class _Entry:
+    def __init__(
+        self,
+        base_url: str,
+        client: AsyncOpenAI,
+        transport: httpx.AsyncHTTPTransport,
+        http2: bool,
+    ) -> None:
+        self.base_url = base_url
+        self.client = client
+        self.transport = transport
+        self.http2 = http2
+        self.requests = 0
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class LLMClients:
+    """
+    A process-wide registry of OpenAI clients, one per (base_url, api_key).
+
+    Creating a client per call means a new connection pool, and so a new TCP+TLS
+    handshake, for every LLM request. The clients here live for the lifetime of the app
+    and keep their connections alive between requests. HTTP/2 is used when enabled and
+    the `h2` package is installed.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args: Any, **kwargs: Any) -> LLMClients:
+        # Ensure only one instance of LLMClients is created
+        if not cls._instance:
+            cls._instance = super(LLMClients, cls).__new__(cls, *args, **kwargs)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not hasattr(self, "_clients"):
+            self._clients: Dict[Tuple[str, str], _Entry] = {}
+            self._http2 = LLM_HTTP2 and _http2_available()
+            if LLM_HTTP2 and not self._http2:
+                logger.info("h2 is not installed, LLM clients use HTTP/1.1")
+
+    def get(self, base_url: str, api_key: str) -> AsyncOpenAI:
+        """
+        The shared client for an endpoint. Callers must not close it.
+        """
+        key = (base_url, api_key)
+        if key not in self._clients:
+            self._clients[key] = self._create(base_url, api_key)
+        return self._clients[key].client
+
+    async def close(self) -> None:
+        for entry in self._clients.values():
+            await entry.client.close()
+        if self._clients:
+            logger.info(f"Closed LLM clients, stats: {self.stats()}")
+        self._clients = {}
+
+    def stats(self) -> List[LLMClientStats]:
+        return [self._entry_stats(entry) for entry in self._clients.values()]
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=LLM_POOL_LIMIT,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        )
+
+    def _create(self, base_url: str, api_key: str) -> _Entry:
+        logger.info(f"Creating shared LLM client for {base_url}")
+        transport = httpx.AsyncHTTPTransport(limits=self._limits(), http2=self._http2)
+
+        async def on_request(request: httpx.Request) -> None:
+            entry.requests += 1
+
+        http_client = DefaultAsyncHttpxClient(
+            transport=transport, event_hooks={"request": [on_request]}
+        )
+        client = AsyncOpenAI(
+            base_url=base_url, api_key=api_key, http_client=http_client
+        )
+        entry = _Entry(base_url, client, transport, self._http2)
+        return entry
+
+    @staticmethod
+    def _entry_stats(entry: _Entry) -> LLMClientStats:
+        # httpx doesn't expose its connection pool, read it from the transport
+        pool = getattr(entry.transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return LLMClientStats(
+            base_url=entry.base_url,
+            http2=entry.http2,
+            requests=entry.requests,
+            max_connections=LLM_POOL_LIMIT,
+            connections=len(connections),
+            active_connections=len(connections) - idle,
+            idle_connections=idle,
+        )
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Any
+
+from openai import AsyncOpenAI
+from typing_extensions import TypedDict
+
+from sensei_search.cache import CacheStats, LRUCache
+from sensei_search.chat_store import ChatStore
+from sensei_search.config import LLM_MEMO_LOCAL_SIZE, LLM_MEMO_TTL
+from sensei_search.logger import logger
+from sensei_search.single_flight import SingleFlight
+
+
+class LLMMemoStats(TypedDict):
+    local_hits: int
+    remote_hits: int
+    misses: int
+    # Skipped calls are not deterministic (temperature > 0) and are never memoized
+    skipped: int
+    hit_rate: float
+    local: CacheStats
+
+
+_local_cache: LRUCache[str] = LRUCache(max_size=LLM_MEMO_LOCAL_SIZE, ttl=LLM_MEMO_TTL)
+_counters = {"local_hits": 0, "remote_hits": 0, "misses": 0, "skipped": 0}
+_memo_flight: SingleFlight[str] = SingleFlight("llm_memo")
+
+
+def _get_key(client: AsyncOpenAI, params: Any, day: str) -> str:
+    raw = json.dumps({"base_url": str(client.base_url), **params}, sort_keys=True)
+    digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    return f"llm_memo:{day}:{digest}"
+
+
+def _seconds_until_tomorrow(now: datetime) -> int:
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return max(1, int((tomorrow - now).total_seconds()))
+
+
+async def memoized_completion(client: AsyncOpenAI, **params: Any) -> str:
+    """
+    Run a non-streaming chat completion and return the message content, memoized by a
+    hash of the endpoint, the model, the messages and all the other parameters.
+
+    Only calls at temperature 0 are memoized, their output is (close enough to)
+    deterministic. Entries are bucketed by day and expire at midnight, as prompts refer
+    to the current date. Like the search cache, entries live in an in-process LRU and in
+    Redis, and concurrent identical calls share a single request.
+    """
+    if params.get("temperature", 1.0) != 0.0 or params.get("stream"):
+        _counters["skipped"] += 1
+        return await _complete(client, params)
+
+    now = datetime.now()
+    key = _get_key(client, params, now.date().isoformat())
+
+    content = _local_cache.get(key)
+    if content is not None:
+        _counters["local_hits"] += 1
+        return content
+
+    ttl = min(LLM_MEMO_TTL, _seconds_until_tomorrow(now))
+    return await _memo_flight.do(key, lambda: _memoized(client, params, key, ttl))
+
+
+async def _memoized(client: AsyncOpenAI, params: Any, key: str, ttl: int) -> str:
+    chat_store = ChatStore()
+    cached = await chat_store.get_cache(key)
+    if cached is not None:
+        _counters["remote_hits"] += 1
+        _local_cache.set(key, cached, ttl)
+        return cached
+
+    _counters["misses"] += 1
+    content = await _complete(client, params)
+
+    # Empty replies are usually errors on the model side, don't pin them for a day
+    if content:
+        _local_cache.set(key, content, ttl)
+        await chat_store.set_cache(key, content, ttl)
+    else:
+        logger.warning(f"Not memoizing empty completion for {params.get('model')}")
+
+    return content
+
+
+async def _complete(client: AsyncOpenAI, params: Any) -> str:
+    response = await client.chat.completions.create(**params)
+    return response.choices[0].message.content or ""
+
+
+def get_memo_stats() -> LLMMemoStats:
+    hits = _counters["local_hits"] + _counters["remote_hits"]
+    lookups = hits + _counters["misses"]
+    return LLMMemoStats(
+        local_hits=_counters["local_hits"],
+        remote_hits=_counters["remote_hits"],
+        misses=_counters["misses"],
+        skipped=_counters["skipped"],
+        hit_rate=hits / lookups if lookups else 0.0,
+        local=_local_cache.stats(),
+    )
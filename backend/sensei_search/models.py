@@ -1,6 +1,6 @@
 from typing import List, Optional, Union
 
-from typing_extensions import TypedDict
+from typing_extensions import NotRequired, TypedDict
 
 
 class WebResult(TypedDict):
@@ -46,3 +46,10 @@ class ChatThread(TypedDict):
     thread_id: str
     chat_history: List[ChatHistoryItem]
     metadata: ThreadMetadata
+
+
+class AskRequest(TypedDict):
+    thread_id: str
+    user_query: str
+    user_id: str
+    resumable: NotRequired[bool]
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Optional, Tuple
+
+from typing_extensions import TypedDict
+
+from sensei_search.answer_framing import ANSWER_EVENT
+from sensei_search.config import (
+    OUTBOUND_DRAIN_TIMEOUT,
+    OUTBOUND_OVERFLOW_POLICY,
+    OUTBOUND_QUEUE_SIZE,
+)
+from sensei_search.logger import logger
+
+if TYPE_CHECKING:
+    from sensei_search.base_agent import EventEmitter
+
+
+class OutboundStats(TypedDict):
+    queues: int
+    # Events waiting in all the queues right now, and the most seen in a single queue
+    depth: int
+    max_depth: int
+    enqueued: int
+    sent: int
+    # Answer chunks merged into the one queued before, superseded events replaced
+    coalesced: int
+    dropped: int
+    aborted: int
+
+
+_queues: Dict[int, QueuedEmitter] = {}
+_counters = {
+    "max_depth": 0,
+    "enqueued": 0,
+    "sent": 0,
+    "coalesced": 0,
+    "dropped": 0,
+    "aborted": 0,
+}
+
+
+class QueuedEmitter:
+    """
+    Decouples an agent from its client's bandwidth: events are put in a bounded queue
+    and sent by a dedicated task, so emitting never waits on the network.
+
+    When the queue is full, OUTBOUND_OVERFLOW_POLICY decides what happens:
+    - "coalesce": an answer chunk is merged into the answer chunk queued before it.
+    - "drop": also, an event replaces a queued event of the same type, which it
+      supersedes (answer chunks are never dropped).
+    - "abort": the client is too slow, `on_abort` is called and events are discarded.
+    Coalescing never loses data, so the queue can go past its size with the first two.
+    """
+
+    def __init__(
+        self,
+        emitter: EventEmitter,
+        max_size: int = OUTBOUND_QUEUE_SIZE,
+        policy: str = OUTBOUND_OVERFLOW_POLICY,
+        on_abort: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.emitter = emitter
+        self.max_size = max_size
+        self.policy = policy
+        self.on_abort = on_abort
+        self.queue: Deque[Tuple[str, Dict]] = deque()
+        self.aborted = False
+        self.ready = asyncio.Event()
+        self.drained = asyncio.Event()
+        self.drained.set()
+        self.sender = asyncio.create_task(self._send_loop())
+        _queues[id(self)] = self
+
+    async def emit(self, event: str, data: Dict) -> None:
+        if self.aborted:
+            return
+
+        if len(self.queue) >= self.max_size and not self._overflow(event, data):
+            return
+
+        self.queue.append((event, data))
+        _counters["enqueued"] += 1
+        _counters["max_depth"] = max(_counters["max_depth"], len(self.queue))
+        self.drained.clear()
+        self.ready.set()
+
+    def _overflow(self, event: str, data: Dict) -> bool:
+        """
+        Make room for an event, returning False if it shouldn't be queued.
+        """
+        if self.policy == "abort":
+            logger.warning("Outbound queue is full, aborting the slow client")
+            _counters["aborted"] += 1
+            self.aborted = True
+            _counters["dropped"] += len(self.queue) + 1
+            self.queue.clear()
+            if self.on_abort is not None:
+                self.on_abort()
+            return False
+
+        if event == ANSWER_EVENT:
+            last_event, last_data = self.queue[-1]
+            if last_event == ANSWER_EVENT:
+                # The merged chunk keeps the other fields of the latest one, e.g. its
+                # stream offset
+                merged = {**data, "data": last_data["data"] + data["data"]}
+                self.queue[-1] = (event, merged)
+                _counters["coalesced"] += 1
+                return False
+        elif self.policy == "drop":
+            for i, (queued_event, _) in enumerate(self.queue):
+                if queued_event == event:
+                    del self.queue[i]
+                    _counters["dropped"] += 1
+                    break
+        return True
+
+    async def _send_loop(self) -> None:
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.queue:
+                event, data = self.queue.popleft()
+                try:
+                    await self.emitter.emit(event, data)
+                    _counters["sent"] += 1
+                except Exception as e:
+                    logger.warning(f"Failed to send {event}: {e}")
+            self.drained.set()
+
+    async def close(self, timeout: float = OUTBOUND_DRAIN_TIMEOUT) -> None:
+        """
+        Wait for the queued events to be sent, for up to `timeout` seconds, and stop the
+        sender.
+        """
+        try:
+            await asyncio.wait_for(self.drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {len(self.queue)} events not sent in time")
+            _counters["dropped"] += len(self.queue)
+        finally:
+            self.discard()
+
+    def discard(self) -> None:
+        """
+        Stop sending, dropping whatever is still queued.
+        """
+        self.sender.cancel()
+        self.queue.clear()
+        _queues.pop(id(self), None)
+
+
+def get_outbound_stats() -> OutboundStats:
+    return OutboundStats(
+        queues=len(_queues),
+        depth=sum(len(queue.queue) for queue in _queues.values()),
+        max_depth=_counters["max_depth"],
+        enqueued=_counters["enqueued"],
+        sent=_counters["sent"],
+        coalesced=_counters["coalesced"],
+        dropped=_counters["dropped"],
+        aborted=_counters["aborted"],
+    )
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional
+
+from typing_extensions import TypedDict
+
+from sensei_search.logger import logger
+
+StageStatus = Literal["ok", "timeout", "error", "cancelled", "skipped"]
+
+# Width of the waterfall bars, in characters
+WATERFALL_WIDTH = 40
+
+
+class StopPipeline(Exception):
+    """
+    Raised by a stage when the request is fully handled, e.g. answered from the cache.
+    The stages still running are cancelled and the others never start.
+    """
+
+
+class StageTiming(TypedDict):
+    name: str
+    # Seconds since the start of the pipeline
+    start: float
+    duration: float
+    status: StageStatus
+    # The fallback result was used, after a timeout or an error
+    fallback: bool
+
+
+class StageStats(TypedDict):
+    runs: int
+    mean_duration: float
+    max_duration: float
+    timeouts: int
+    errors: int
+    fallbacks: int
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[..., Awaitable[Any]],
+        depends_on: List[str],
+        timeout: Optional[float],
+        fallback: Optional[Callable[[], Any]],
+    ) -> None:
+        self.name = name
+        self.fn = fn
+        self.depends_on = depends_on
+        self.timeout = timeout
+        self.fallback = fallback
+
+
+class _StageCounters:
+    def __init__(self) -> None:
+        self.runs = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.timeouts = 0
+        self.errors = 0
+        self.fallbacks = 0
+
+
+# Per pipeline name, per stage name
+_stats: Dict[str, Dict[str, _StageCounters]] = {}
+
+
+class Pipeline:
+    """
+    Runs the stages of an agent as a dependency graph.
+
+    Each stage is an async function called with the results of the stages it depends on
+    as keyword arguments, and it starts as soon as all of them are done. A stage can have
+    a timeout and a fallback; the fallback (a function, possibly async) provides its
+    result when the stage times out or fails. Without a fallback, the failure cancels the
+    whole pipeline and is raised from run().
+
+    The timing of every stage is recorded and logged as a waterfall when the pipeline
+    completes.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.stages: Dict[str, Stage] = {}
+        self.timings: Dict[str, StageTiming] = {}
+        self.stopped = False
+
+    def stage(
+        self,
+        name: str,
+        fn: Callable[..., Awaitable[Any]],
+        depends_on: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        fallback: Optional[Callable[[], Any]] = None,
+    ) -> Pipeline:
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already defined")
+        for dependency in depends_on or []:
+            if dependency not in self.stages:
+                # Declaring stages in order also rules out cycles
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+        self.stages[name] = Stage(name, fn, depends_on or [], timeout, fallback)
+        return self
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Run all the stages, returning their results by name.
+        """
+        self.started_at = time.monotonic()
+        tasks: Dict[str, asyncio.Task[Any]] = {}
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.create_task(
+                self._run_stage(stage, [tasks[d] for d in stage.depends_on])
+            )
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except StopPipeline:
+            self.stopped = True
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            # Let the cancelled stages record their timing
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            self._record()
+            logger.info(self.waterfall())
+
+        return {
+            name: task.result()
+            for name, task in tasks.items()
+            if not task.cancelled() and task.exception() is None
+        }
+
+    async def _run_stage(self, stage: Stage, dependencies: List[asyncio.Task]) -> Any:
+        try:
+            results = [await dependency for dependency in dependencies]
+        except BaseException:
+            self._time(stage, time.monotonic(), "skipped")
+            raise
+
+        kwargs = dict(zip(stage.depends_on, results))
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(stage.fn(**kwargs), stage.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.name}: stage {stage.name} timed out")
+            return await self._fall_back(stage, start, "timeout")
+        except asyncio.CancelledError:
+            self._time(stage, start, "cancelled")
+            raise
+        except StopPipeline:
+            self._time(stage, start, "ok")
+            raise
+        except Exception as e:
+            if stage.fallback is None:
+                self._time(stage, start, "error")
+                raise
+            logger.exception(f"{self.name}: stage {stage.name} failed: {e}")
+            return await self._fall_back(stage, start, "error")
+
+        self._time(stage, start, "ok")
+        return result
+
+    async def _fall_back(self, stage: Stage, start: float, status: StageStatus) -> Any:
+        if stage.fallback is None:
+            self._time(stage, start, status)
+            raise asyncio.TimeoutError(f"Stage {stage.name} timed out")
+
+        result = stage.fallback()
+        if inspect.isawaitable(result):
+            result = await result
+        self._time(stage, start, status, fallback=True)
+        return result
+
+    def _time(
+        self, stage: Stage, start: float, status: StageStatus, fallback: bool = False
+    ) -> None:
+        self.timings[stage.name] = StageTiming(
+            name=stage.name,
+            start=start - self.started_at,
+            duration=time.monotonic() - start,
+            status=status,
+            fallback=fallback,
+        )
+
+    def _record(self) -> None:
+        stats = _stats.setdefault(self.name, {})
+        for timing in self.timings.values():
+            if timing["status"] in ("skipped", "cancelled"):
+                continue
+            counters = stats.setdefault(timing["name"], _StageCounters())
+            counters.runs += 1
+            counters.total_duration += timing["duration"]
+            counters.max_duration = max(counters.max_duration, timing["duration"])
+            counters.timeouts += timing["status"] == "timeout"
+            counters.errors += timing["status"] == "error"
+            counters.fallbacks += timing["fallback"]
+
+    def waterfall(self) -> str:
+        """
+        The stage timings as a text chart, in start order.
+        """
+        timings = sorted(self.timings.values(), key=lambda t: t["start"])
+        total = max((t["start"] + t["duration"] for t in timings), default=0.0)
+        scale = WATERFALL_WIDTH / total if total else 0.0
+        width = max((len(t["name"]) for t in timings), default=0)
+
+        lines = [f"{self.name} waterfall, {total:.3f}s:"]
+        for timing in timings:
+            offset = int(timing["start"] * scale)
+            length = max(1, int(timing["duration"] * scale))
+            status = timing["status"] + (" (fallback)" if timing["fallback"] else "")
+            bar = (" " * offset + "#" * length).ljust(WATERFALL_WIDTH)
+            lines.append(
+                f"  {timing['name']:<{width}} {bar} {timing['start']:7.3f}"
+                f" +{timing['duration']:.3f} {status}"
+            )
+        return "\n".join(lines)
+
+
+def get_pipeline_stats() -> Dict[str, Dict[str, StageStats]]:
+    return {
+        pipeline: {
+            stage: StageStats(
+                runs=counters.runs,
+                mean_duration=counters.total_duration / counters.runs,
+                max_duration=counters.max_duration,
+                timeouts=counters.timeouts,
+                errors=counters.errors,
+                fallbacks=counters.fallbacks,
+            )
+            for stage, counters in stages.items()
+        }
+        for pipeline, stages in _stats.items()
+    }
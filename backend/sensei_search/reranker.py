@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from typing_extensions import TypedDict
+
+from sensei_search.config import (
+    RERANK_PASSAGE_WORDS,
+    RERANK_TIMEOUT,
+    RERANK_TOP_PASSAGES,
+)
+from sensei_search.context_packing import SENTENCE_END_RE
+from sensei_search.extractor import Extractor
+from sensei_search.logger import logger
+from sensei_search.text import STOP_WORDS
+
+WORD_RE = re.compile(r"\w+")
+
+# BM25 parameters, the usual defaults
+K1 = 1.2
+B = 0.75
+
+
+class Passage(TypedDict):
+    # Index of the page the passage comes from, used for citations
+    document: int
+    # Position of the passage in its page
+    position: int
+    text: str
+    score: float
+
+
+class RerankerStats(TypedDict):
+    reranked: int
+    passages: int
+    kept: int
+    timed_out: int
+
+
+_counters = {"reranked": 0, "passages": 0, "kept": 0, "timed_out": 0}
+
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in WORD_RE.findall(text.casefold()) if word not in STOP_WORDS]
+
+
+def split_passages(text: str, max_words: int = RERANK_PASSAGE_WORDS) -> List[str]:
+    """
+    Split a page into passages of about `max_words` words, on sentence boundaries.
+    """
+    passages: List[str] = []
+    current: List[str] = []
+    words = 0
+    for sentence in SENTENCE_END_RE.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        # Pages without punctuation are cut on words instead
+        tokens = sentence.split()
+        if len(tokens) > max_words and current:
+            # Keep the passages in page order
+            passages.append(" ".join(current))
+            current, words = [], 0
+        while len(tokens) > max_words:
+            passages.append(" ".join(tokens[:max_words]))
+            tokens = tokens[max_words:]
+        current.append(" ".join(tokens))
+        words += len(tokens)
+        if words >= max_words:
+            passages.append(" ".join(current))
+            current, words = [], 0
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def bm25_scores(query: List[str], passages: List[List[str]]) -> List[float]:
+    """
+    Score tokenized passages against a tokenized query with Okapi BM25.
+    """
+    if not passages:
+        return []
+
+    avg_length = sum(len(p) for p in passages) / len(passages) or 1.0
+    document_frequency: Counter = Counter()
+    for passage in passages:
+        document_frequency.update(set(passage))
+
+    idf: Dict[str, float] = {
+        term: math.log(
+            1
+            + (len(passages) - document_frequency[term] + 0.5)
+            / (document_frequency[term] + 0.5)
+        )
+        for term in set(query)
+    }
+
+    scores = []
+    for passage in passages:
+        frequencies = Counter(passage)
+        norm = K1 * (1 - B + B * len(passage) / avg_length)
+        scores.append(
+            sum(
+                idf[term] * frequencies[term] * (K1 + 1) / (frequencies[term] + norm)
+                for term in query
+                if frequencies[term]
+            )
+        )
+    return scores
+
+
+def page_passages(pages: List[str]) -> List[Passage]:
+    return [
+        Passage(document=document, position=position, text=text, score=0.0)
+        for document, page in enumerate(pages)
+        for position, text in enumerate(split_passages(page))
+    ]
+
+
+def rank_passages(
+    query: str, passages: List[Passage], top_k: int = RERANK_TOP_PASSAGES
+) -> List[Passage]:
+    """
+    Return the `top_k` passages most relevant to the query, best first. Passages that
+    share no term with the query are never returned.
+    """
+    scores = bm25_scores(tokenize(query), [tokenize(p["text"]) for p in passages])
+    for passage, score in zip(passages, scores):
+        passage["score"] = score
+
+    ranked = sorted(
+        (p for p in passages if p["score"] > 0), key=lambda p: p["score"], reverse=True
+    )
+    return ranked[:top_k]
+
+
+async def rerank_pages(query: str, pages: List[str]) -> List[str]:
+    """
+    Reduce each page to its passages among the most relevant ones to the query, in their
+    original order. The result is aligned with `pages`, so document numbers still match
+    for citations, and pages without any relevant passage become empty. The pages are
+    returned unchanged if nothing matches the query at all.
+
+    Scoring is CPU bound pure Python, it runs in the extraction worker pool. The pool
+    can be busy extracting pages, the pages are returned unchanged if they can't be
+    reranked within RERANK_TIMEOUT seconds.
+    """
+    try:
+        reranked, passages, kept = await asyncio.wait_for(
+            Extractor().run(_rerank, query, pages), RERANK_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        _counters["timed_out"] += 1
+        logger.warning(
+            f"Reranking timed out for {query!r}, keeping the pages as they are"
+        )
+        return pages
+
+    _counters["reranked"] += 1
+    _counters["passages"] += passages
+    _counters["kept"] += kept
+
+    if not kept:
+        logger.info(f"No passage matches {query!r}, keeping the pages as they are")
+        return pages
+    return reranked
+
+
+def _rerank(query: str, pages: List[str]) -> Tuple[List[str], int, int]:
+    """
+    Runs in a worker. Returns the reranked pages, how many passages were scored and how
+    many were kept.
+    """
+    passages = page_passages(pages)
+    top = rank_passages(query, passages)
+    if not top:
+        return pages, len(passages), 0
+
+    kept: Dict[int, List[Passage]] = {}
+    for passage in top:
+        kept.setdefault(passage["document"], []).append(passage)
+
+    reranked = [
+        " ... ".join(
+            p["text"] for p in sorted(kept.get(i, []), key=lambda p: p["position"])
+        )
+        for i in range(len(pages))
+    ]
+    return reranked, len(passages), len(top)
+
+
+def get_reranker_stats() -> RerankerStats:
+    return RerankerStats(
+        reranked=_counters["reranked"],
+        passages=_counters["passages"],
+        kept=_counters["kept"],
+        timed_out=_counters["timed_out"],
+    )
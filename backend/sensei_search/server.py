@@ -1,18 +1,41 @@
 from __future__ import annotations
 
 import asyncio
+import json
 import os
-from typing import Dict, List, Optional
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 
 import socketio  # type: ignore[import-untyped]
-from fastapi import FastAPI
+from fastapi import FastAPI, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
 from sensei_search.agents.shogun.agent_v2 import ShogunAgent
-from sensei_search.base_agent import NoAccessError
-from sensei_search.chat_store import ChatStore
+from sensei_search.answer_cache import AnswerCache
+from sensei_search.answer_framing import get_framing_stats
+from sensei_search.answer_streams import StreamEmitter, get_stream_stats, replay_stream
+from sensei_search.base_agent import EventEmitter, NoAccessError
+from sensei_search.chat_store import ChatHistoryItem, ChatStore
+from sensei_search.config import RESUMABLE_STREAMS, RESUME_GRACE_PERIOD
+from sensei_search.context_packing import get_packing_stats
+from sensei_search.extractor import Extractor
+from sensei_search.http_client import HttpClient
+from sensei_search.llm_clients import LLMClients
+from sensei_search.llm_memo import get_memo_stats
 from sensei_search.logger import logger
-from sensei_search.models import ChatThread
+from sensei_search.models import AskRequest, ChatThread
+from sensei_search.outbound import QueuedEmitter, get_outbound_stats
+from sensei_search.pipeline import get_pipeline_stats
+from sensei_search.reranker import get_reranker_stats
+from sensei_search.sessions import (
+    REQUEST_DONE_EVENT,
+    PersistentSessions,
+    SessionTasks,
+)
+from sensei_search.single_flight import SingleFlight
+from sensei_search.tools.search import CachedSearchTool, get_accessibility_stats
+from sensei_search.web_pages import PageCache, get_fetch_stats
 
 env = os.getenv("ENV", "development")
 
@@ -25,16 +48,96 @@ if env == "production":
 
 
 class SocketIOEmitter:
-    def __init__(self, sio: socketio.AsyncServer, sid: str):
+    def __init__(
+        self, sio: socketio.AsyncServer, sid: str, request_id: Optional[str] = None
+    ):
         self.sio = sio
         self.sid = sid
+        # Tags the events, for clients with many requests on the socket
+        self.request_id = request_id
 
     async def emit(self, event: str, data: Dict) -> None:
+        if self.request_id is not None:
+            data = {**data, "request_id": self.request_id}
         await self.sio.emit(event, data, room=self.sid)
 
 
+class SSEEmitter:
+    """
+    Formats events as Server-Sent Events, for a streaming response to read with
+    frames(). Only a few frames are buffered, so a slow client backs up into its
+    outbound queue.
+
+    Once closed, events are dropped, emits waiting for room give up, and frames() stops
+    after the frames already buffered.
+    """
+
+    def __init__(self, max_frames: int = 16) -> None:
+        self.queue: asyncio.Queue[str] = asyncio.Queue(max_frames)
+        self.closed = asyncio.Event()
+
+    async def emit(self, event: str, data: Dict) -> None:
+        if self.closed.is_set():
+            # The stream is over, or the client is gone
+            return
+        lines = [f"event: {event}", f"data: {json.dumps(data)}"]
+        if "id" in data:
+            # Reconnecting EventSource clients send it back as Last-Event-ID
+            lines.insert(0, f"id: {data['id']}")
+        frame = "\n".join(lines) + "\n\n"
+
+        if not self.queue.full():
+            self.queue.put_nowait(frame)
+            return
+        put = asyncio.ensure_future(self.queue.put(frame))
+        await self._until_closed(put)
+
+    def close(self) -> None:
+        self.closed.set()
+
+    async def frames(self) -> AsyncIterator[str]:
+        while True:
+            if not self.queue.empty():
+                yield self.queue.get_nowait()
+                continue
+            if self.closed.is_set():
+                return
+            get = asyncio.ensure_future(self.queue.get())
+            await self._until_closed(get)
+            if not get.cancelled():
+                yield get.result()
+
+    async def _until_closed(self, future: asyncio.Future) -> None:
+        """
+        Wait for `future`, cancelling it if the emitter is closed first.
+        """
+        closed = asyncio.ensure_future(self.closed.wait())
+        try:
+            await asyncio.wait({future, closed}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            closed.cancel()
+            future.cancel()
+        # Let the cancellation go through
+        await asyncio.gather(future, return_exceptions=True)
+
+
 app = FastAPI()
 
+
+@app.on_event("startup")
+async def startup() -> None:
+    await HttpClient().start()
+    Extractor().start()
+    await AnswerCache().load_index()
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await HttpClient().close()
+    await LLMClients().close()
+    Extractor().close()
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"] if origins is None else origins,
@@ -57,49 +160,282 @@ app.add_websocket_route("/socket.io/", sio_asgi_app)
 
 # Event handlers
 @sio.event
-async def connect(sid: str, environ: Dict) -> None:
+async def connect(sid: str, environ: Dict, auth: Optional[Dict] = None) -> None:
     print(f"Client connected: {sid}")
+    # Clients connecting with {"persistent": true} keep the socket for many questions
+    if auth and auth.get("persistent"):
+        PersistentSessions().open(
+            sid, on_idle=lambda: asyncio.ensure_future(sio.disconnect(sid))
+        )
 
 
 @sio.event
 async def disconnect(sid: str) -> None:
     print(f"Client disconnected: {sid}")
+    # Nobody is listening anymore, stop streaming, fetching and calling LLMs, unless the
+    # client reconnects and resumes its resumable requests in time
+    SessionTasks().cancel(sid, RESUME_GRACE_PERIOD)
+    PersistentSessions().close(sid)
+
+
+def outbound(
+    emitter: EventEmitter,
+    request_id: str,
+    resumable: bool,
+    on_abort: Callable[[], None],
+) -> Tuple[QueuedEmitter, Optional[StreamEmitter]]:
+    """
+    The queue to send the events of a request through. The events of a resumable request
+    are recorded on their way out of the queue.
+    """
+    if resumable and RESUMABLE_STREAMS:
+        stream_emitter = StreamEmitter(emitter, request_id)
+        return QueuedEmitter(stream_emitter, on_abort=on_abort), stream_emitter
+    return QueuedEmitter(emitter, on_abort=on_abort), None
+
+
+async def run_agent(
+    queued_emitter: QueuedEmitter,
+    stream_emitter: Optional[StreamEmitter],
+    thread_id: str,
+    user_query: str,
+    user_id: str,
+    history_cache: Optional[Dict[str, List[ChatHistoryItem]]] = None,
+) -> None:
+    """
+    Run the agent for a question, sending its events to the client through its queue.
+    The queue is drained once the run completes, and the stream of a resumable request
+    is marked as complete (or cancelled).
+    """
+    agent = ShogunAgent(
+        emitter=queued_emitter,
+        thread_id=thread_id,
+        user_id=user_id,
+        history_cache=history_cache,
+    )
+
+    try:
+        await agent.run(user_query)
+        SessionTasks().record_completed(agent)
+    except asyncio.CancelledError:
+        SessionTasks().record_cancelled(agent)
+        queued_emitter.discard()
+        if stream_emitter is not None:
+            # Otherwise the sessions resuming it tail the stream until they time out
+            await asyncio.shield(stream_emitter.end("cancelled"))
+        raise
+    except NoAccessError as e:
+        await queued_emitter.emit("app_error", {"message": e.message})
+    except Exception as e:
+        logger.exception(e)
+        await queued_emitter.emit(
+            "app_error",
+            {"message": "An error occurred while processing your request."},
+        )
+
+    await queued_emitter.close()
+    if stream_emitter is not None:
+        await stream_emitter.end()
+
+
+async def resume_run(
+    queued_emitter: QueuedEmitter, session_id: str, request_id: str, offset: str
+) -> None:
+    """
+    Send the events of a request again from `offset`, then live until it's over.
+    """
+    # Keep the run going, it's now this session's to cancel
+    SessionTasks().resume(request_id, session_id)
+
+    try:
+        if not await replay_stream(request_id, offset, queued_emitter):
+            await queued_emitter.emit(
+                "app_error", {"message": "This request can't be resumed."}
+            )
+    except asyncio.CancelledError:
+        queued_emitter.discard()
+        raise
+
+    await queued_emitter.close()
+
+
+async def end_request(sid: str, request_id: str, task: asyncio.Task) -> None:
+    """
+    Once a request is over, disconnect the client, or tell it the request is done if the
+    socket is kept for more.
+    """
+    # Disconnecting cancels the runs of the session, this one is done
+    SessionTasks().forget(task)
+    if PersistentSessions().is_persistent(sid):
+        await sio.emit(REQUEST_DONE_EVENT, {"request_id": request_id}, room=sid)
+        PersistentSessions().touch(sid)
+    else:
+        # Disconnect the client after the conversation is complete
+        await sio.disconnect(sid)
 
 
 @sio.event
-async def sensei_ask(sid: str, thread_id: str, user_query: str, user_id: str) -> None:
+async def sensei_ask(
+    sid: str, thread_id: str, user_query: str, user_id: str, resumable: bool = False
+) -> str:
     """
     Handles the 'sensei_ask' event by creating a SamuraiAgent and running it.
 
+    In a persistent session, requests can overlap: their events carry a "request_id",
+    which is also the acknowledgement of this event.
+
     Args:
         sid (str): The session ID for the client's socket connection.
         thread_id (str): The ID of the conversation thread.
         user_query (str): The query from the user.
+        resumable (bool): Whether the client can resume the request with
+            'sensei_resume' if it loses its connection.
     """
-    emitter = SocketIOEmitter(sio, sid)
-    agent = ShogunAgent(emitter=emitter, thread_id=thread_id, user_id=user_id)
+    # The client needs the request id to resume the request
+    request_id = str(uuid.uuid4())
+    history_cache = PersistentSessions().start_request(sid, thread_id)
+    # Disconnecting a client too slow for its queue also cancels its run
+    queued_emitter, stream_emitter = outbound(
+        SocketIOEmitter(sio, sid, request_id if history_cache is not None else None),
+        request_id,
+        resumable,
+        on_abort=lambda: asyncio.ensure_future(sio.disconnect(sid)),
+    )
+    await queued_emitter.emit("request_id", {"data": request_id})
+
+    async def ask() -> None:
+        await run_agent(
+            queued_emitter,
+            stream_emitter,
+            thread_id,
+            user_query,
+            user_id,
+            history_cache,
+        )
+        await end_request(sid, request_id, task)
+
+    task = asyncio.create_task(ask())
+    # Only resumable runs are kept going for a while after a disconnect
+    SessionTasks().track(sid, task, request_id if stream_emitter else None)
+    return request_id
+
 
-    async def run_agent() -> None:
+@sio.event
+async def sensei_resume(sid: str, request_id: str, offset: str = "0") -> None:
+    """
+    Handles the 'sensei_resume' event, sent by a client that lost its connection during
+    a request. The events of the request are sent again from `offset`, the "id" of the
+    last event the client received ("0" for all of them), then live until it's over.
+    The request ends like after 'sensei_ask'.
+
+    Args:
+        sid (str): The session ID for the client's socket connection.
+        request_id (str): The ID of the request, sent as the 'request_id' event.
+        offset (str): The ID of the last event received.
+    """
+    persistent = PersistentSessions().is_persistent(sid)
+    PersistentSessions().touch(sid)
+    queued_emitter = QueuedEmitter(
+        SocketIOEmitter(sio, sid, request_id if persistent else None),
+        on_abort=lambda: asyncio.ensure_future(sio.disconnect(sid)),
+    )
+
+    async def resume() -> None:
+        await resume_run(queued_emitter, sid, request_id, offset)
+        await end_request(sid, request_id, task)
+
+    task = asyncio.create_task(resume())
+    SessionTasks().track(sid, task)
+
+
+def sse_response(
+    sse_emitter: SSEEmitter, session_id: str, task: asyncio.Task
+) -> StreamingResponse:
+    """
+    Stream the events of a session. If the client goes away before the end, its runs are
+    cancelled like those of a disconnected socket.io client.
+    """
+
+    async def frames() -> AsyncIterator[str]:
         try:
-            await agent.run(user_query)
-        except NoAccessError as e:
-            await sio.emit(
-                "app_error",
-                {"message": e.message},
-                room=sid,
+            async for frame in sse_emitter.frames():
+                yield frame
+        finally:
+            # Nothing is sent anymore, the outbound queue can drain
+            sse_emitter.close()
+            if not task.done():
+                SessionTasks().cancel(session_id, RESUME_GRACE_PERIOD)
+
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        # Proxies must not buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/ask")
+async def ask(request: AskRequest) -> StreamingResponse:
+    """
+    Answers a question like the 'sensei_ask' socket.io event, as a stream of Server-Sent
+    Events. The events are the same, starting with 'request_id', and their data is the
+    JSON payload of the socket.io event. The stream ends with the request. Resumable
+    requests can be resumed with GET /ask/{request_id}.
+    """
+    session_id = f"sse:{uuid.uuid4()}"
+    sse_emitter = SSEEmitter()
+    request_id = str(uuid.uuid4())
+    # Ending the stream of a client too slow for its queue also cancels its run
+    queued_emitter, stream_emitter = outbound(
+        sse_emitter,
+        request_id,
+        request.get("resumable", False),
+        on_abort=sse_emitter.close,
+    )
+    await queued_emitter.emit("request_id", {"data": request_id})
+
+    async def ask_agent() -> None:
+        try:
+            await run_agent(
+                queued_emitter,
+                stream_emitter,
+                request["thread_id"],
+                request["user_query"],
+                request["user_id"],
             )
-        except Exception as e:
-            logger.exception(e)
-            await sio.emit(
-                "app_error",
-                {"message": "An error occurred while processing your request."},
-                room=sid,
+        finally:
+            sse_emitter.close()
+
+    task = asyncio.create_task(ask_agent())
+    SessionTasks().track(session_id, task, request_id if stream_emitter else None)
+    return sse_response(sse_emitter, session_id, task)
+
+
+@app.get("/ask/{request_id}")
+async def resume_ask(
+    request_id: str,
+    offset: str = "0",
+    last_event_id: Optional[str] = Header(default=None),
+) -> StreamingResponse:
+    """
+    Resumes the event stream of a request, from the `Last-Event-ID` header sent by
+    reconnecting EventSource clients or from `offset`.
+    """
+    session_id = f"sse:{uuid.uuid4()}"
+    sse_emitter = SSEEmitter()
+    queued_emitter = QueuedEmitter(sse_emitter, on_abort=sse_emitter.close)
+
+    async def resume() -> None:
+        try:
+            await resume_run(
+                queued_emitter, session_id, request_id, last_event_id or offset
             )
         finally:
-            # Disconnect the client after the conversation is complete
-            await sio.disconnect(sid)
+            sse_emitter.close()
 
-    asyncio.create_task(run_agent())
+    task = asyncio.create_task(resume())
+    SessionTasks().track(session_id, task)
+    return sse_response(sse_emitter, session_id, task)
 
 
 @app.get("/threads/{slug}")
@@ -129,3 +465,30 @@ async def get_thread(slug: str) -> ChatThread:
 @app.get("/health")
 async def health() -> Dict[str, str]:
     return {"status": "ok"}
+
+
+@app.get("/stats")
+async def stats() -> Dict[str, Any]:
+    """
+    Exposes runtime counters of the shared resources, e.g. connection pool reuse.
+    """
+    return {
+        "http_client": HttpClient().stats(),
+        "llm_clients": LLMClients().stats(),
+        "llm_memo": get_memo_stats(),
+        "answer_cache": AnswerCache().stats(),
+        "context_packing": get_packing_stats(),
+        "reranker": get_reranker_stats(),
+        "pipelines": get_pipeline_stats(),
+        "sessions": SessionTasks().stats(),
+        "persistent_sessions": PersistentSessions().stats(),
+        "answer_framing": get_framing_stats(),
+        "outbound": get_outbound_stats(),
+        "answer_streams": get_stream_stats(),
+        "search_cache": CachedSearchTool.stats(),
+        "image_accessibility": get_accessibility_stats(),
+        "extractor": Extractor().stats(),
+        "page_cache": PageCache().stats(),
+        "page_fetch": get_fetch_stats(),
+        "single_flight": SingleFlight.all_stats(),
+    }
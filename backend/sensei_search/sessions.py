@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from typing_extensions import TypedDict
+
+from sensei_search.base_agent import BaseAgent
+from sensei_search.chat_store import ChatHistoryItem
+from sensei_search.config import SESSION_IDLE_TIMEOUT
+from sensei_search.logger import logger
+
+# Sent to persistent sessions when a request is over, as their socket stays open
+REQUEST_DONE_EVENT = "request_done"
+
+
+class SessionStats(TypedDict):
+    active_sessions: int
+    active_runs: int
+    cancelled_runs: int
+    resumed_runs: int
+    # Stages cancelled while running, and stages that never started
+    stages_aborted: int
+    stages_skipped: int
+    # Estimates, see UPSTREAM_REQUESTS and record_cancelled()
+    requests_saved: int
+    answer_tokens_saved: int
+
+
+class PersistentSessionStats(TypedDict):
+    sessions: int
+    requests: int
+    idle_closed: int
+    # Turns whose chat history was already loaded by the session
+    history_hits: int
+    history_misses: int
+
+
+class SessionTasks:
+    """
+    Tracks the agent runs of each socket.io session, so that they can be cancelled when
+    the client disconnects instead of answering nobody. With resumable streams, the
+    runs of a disconnected client are only cancelled if it doesn't resume them in time.
+
+    Cancelling the task of a run cancels its pipeline, which cancels every running stage:
+    streaming LLM responses are closed and pending page fetches are cancelled.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args: Any, **kwargs: Any) -> SessionTasks:
+        # Ensure only one instance of SessionTasks is created
+        if not cls._instance:
+            cls._instance = super(SessionTasks, cls).__new__(cls, *args, **kwargs)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not hasattr(self, "tasks"):
+            self.tasks: Dict[str, Set[asyncio.Task]] = {}
+            self.sessions: Dict[asyncio.Task, str] = {}
+            # Resumable runs by request id, to be picked up by a resuming client
+            self.requests: Dict[str, asyncio.Task] = {}
+            # Runs of disconnected clients, cancelled unless resumed in time
+            self.pending_cancels: Dict[asyncio.Task, asyncio.TimerHandle] = {}
+            # Streamed chunks of the completed answers, a chunk being about a token
+            self.answers = 0
+            self.answer_chunks = 0
+            self.counters: Dict[str, int] = {
+                "cancelled_runs": 0,
+                "resumed_runs": 0,
+                "stages_aborted": 0,
+                "stages_skipped": 0,
+                "requests_saved": 0,
+                "answer_tokens_saved": 0,
+            }
+
+    def track(
+        self, sid: str, task: asyncio.Task, request_id: Optional[str] = None
+    ) -> None:
+        self.tasks.setdefault(sid, set()).add(task)
+        self.sessions[task] = sid
+        if request_id is not None:
+            self.requests[request_id] = task
+        task.add_done_callback(lambda _: self._done(task, request_id))
+
+    def _done(self, task: asyncio.Task, request_id: Optional[str]) -> None:
+        self.forget(task)
+        handle = self.pending_cancels.pop(task, None)
+        if handle is not None:
+            handle.cancel()
+        if request_id is not None:
+            self.requests.pop(request_id, None)
+
+    def forget(self, task: asyncio.Task) -> None:
+        """
+        Stop tracking a run, disconnecting its session won't cancel it.
+        """
+        sid = self.sessions.pop(task, None)
+        if sid is None or sid not in self.tasks:
+            return
+        self.tasks[sid].discard(task)
+        if not self.tasks[sid]:
+            del self.tasks[sid]
+
+    def cancel(self, sid: str, grace: float = 0.0) -> int:
+        """
+        Cancel the runs of a session. Resumable runs (tracked with a request id) are
+        cancelled after `grace` seconds if they are not resumed by then. Returns how many
+        runs will be cancelled.
+        """
+        tasks = self.tasks.pop(sid, set())
+        resumable = set(self.requests.values()) if grace > 0 else set()
+        for task in tasks:
+            self.sessions.pop(task, None)
+            if task in resumable:
+                self.pending_cancels[task] = asyncio.get_running_loop().call_later(
+                    grace, self._cancel_pending, task
+                )
+            else:
+                task.cancel()
+        if tasks:
+            logger.info(f"Cancelling {len(tasks)} run(s) of session {sid} in {grace}s")
+        return len(tasks)
+
+    def _cancel_pending(self, task: asyncio.Task) -> None:
+        self.pending_cancels.pop(task, None)
+        task.cancel()
+
+    def resume(self, request_id: str, sid: str) -> bool:
+        """
+        Hand the run of a request over to a new session, if it's still going. Returns
+        False if the run is over (or unknown).
+        """
+        task = self.requests.get(request_id)
+        if task is None or task.done():
+            return False
+
+        handle = self.pending_cancels.pop(task, None)
+        if handle is not None:
+            handle.cancel()
+        self.forget(task)
+        self.tasks.setdefault(sid, set()).add(task)
+        self.sessions[task] = sid
+        self.counters["resumed_runs"] += 1
+        return True
+
+    def record_completed(self, agent: BaseAgent) -> None:
+        if agent.answer_chunks:
+            self.answers += 1
+            self.answer_chunks += len(agent.answer_chunks)
+
+    def record_cancelled(self, agent: BaseAgent) -> None:
+        """
+        Estimate what cancelling the run of an agent saved: the upstream requests of the
+        stages that were cut short or never ran, and the rest of the answer, assuming it
+        would have been as long as the average answer.
+        """
+        self.counters["cancelled_runs"] += 1
+        if agent.pipeline is None:
+            return
+
+        answer_cut = False
+        for timing in agent.pipeline.timings.values():
+            if timing["status"] not in ("cancelled", "skipped"):
+                continue
+            if timing["status"] == "cancelled":
+                self.counters["stages_aborted"] += 1
+            else:
+                self.counters["stages_skipped"] += 1
+            self.counters["requests_saved"] += agent.UPSTREAM_REQUESTS.get(
+                timing["name"], 0
+            )
+            answer_cut = answer_cut or timing["name"] == "answer"
+
+        if answer_cut and self.answers:
+            average = self.answer_chunks // self.answers
+            saved = max(0, average - len(agent.answer_chunks))
+            self.counters["answer_tokens_saved"] += saved
+
+    def stats(self) -> SessionStats:
+        return SessionStats(
+            active_sessions=len(self.tasks),
+            active_runs=sum(len(tasks) for tasks in self.tasks.values()),
+            cancelled_runs=self.counters["cancelled_runs"],
+            resumed_runs=self.counters["resumed_runs"],
+            stages_aborted=self.counters["stages_aborted"],
+            stages_skipped=self.counters["stages_skipped"],
+            requests_saved=self.counters["requests_saved"],
+            answer_tokens_saved=self.counters["answer_tokens_saved"],
+        )
+
+
+class PersistentSession:
+    def __init__(self, sid: str, on_idle: Callable[[], None]) -> None:
+        self.sid = sid
+        self.on_idle = on_idle
+        self.histories: Dict[str, List[ChatHistoryItem]] = {}
+        self.idle_timer: Optional[asyncio.TimerHandle] = None
+
+
+class PersistentSessions:
+    """
+    Tracks the socket.io sessions that carry many requests instead of one, the client
+    demultiplexing the events by their "request_id". The chat history of each thread is
+    loaded once per session and kept up to date as turns are saved, and the socket is
+    closed with `on_idle` when the session has had no request for SESSION_IDLE_TIMEOUT
+    seconds.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args: Any, **kwargs: Any) -> PersistentSessions:
+        # Ensure only one instance of PersistentSessions is created
+        if not cls._instance:
+            cls._instance = super(PersistentSessions, cls).__new__(cls, *args, **kwargs)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not hasattr(self, "sessions"):
+            self.sessions: Dict[str, PersistentSession] = {}
+            self.counters: Dict[str, int] = {
+                "requests": 0,
+                "idle_closed": 0,
+                "history_hits": 0,
+                "history_misses": 0,
+            }
+
+    def open(self, sid: str, on_idle: Callable[[], None]) -> None:
+        self.sessions[sid] = PersistentSession(sid, on_idle)
+        self.touch(sid)
+
+    def close(self, sid: str) -> None:
+        session = self.sessions.pop(sid, None)
+        if session is not None and session.idle_timer is not None:
+            session.idle_timer.cancel()
+
+    def is_persistent(self, sid: str) -> bool:
+        return sid in self.sessions
+
+    def touch(self, sid: str) -> None:
+        """
+        Restart the idle timeout of a session.
+        """
+        session = self.sessions.get(sid)
+        if session is None:
+            return
+        if session.idle_timer is not None:
+            session.idle_timer.cancel()
+        session.idle_timer = asyncio.get_running_loop().call_later(
+            SESSION_IDLE_TIMEOUT, self._idle, sid
+        )
+
+    def _idle(self, sid: str) -> None:
+        session = self.sessions.get(sid)
+        if session is None:
+            return
+        if sid in SessionTasks().tasks:
+            # Still answering, e.g. a long resumed request
+            self.touch(sid)
+            return
+        logger.info(f"Closing session {sid}, idle for {SESSION_IDLE_TIMEOUT}s")
+        self.counters["idle_closed"] += 1
+        self.close(sid)
+        session.on_idle()
+
+    def start_request(
+        self, sid: str, thread_id: str
+    ) -> Optional[Dict[str, List[ChatHistoryItem]]]:
+        """
+        Count a request of a session and restart its idle timeout. Returns the history
+        cache of the session, for the agent.
+        """
+        session = self.sessions.get(sid)
+        if session is None:
+            return None
+
+        self.touch(sid)
+        self.counters["requests"] += 1
+        if thread_id in session.histories:
+            self.counters["history_hits"] += 1
+        else:
+            self.counters["history_misses"] += 1
+        return session.histories
+
+    def stats(self) -> PersistentSessionStats:
+        return PersistentSessionStats(
+            sessions=len(self.sessions),
+            requests=self.counters["requests"],
+            idle_closed=self.counters["idle_closed"],
+            history_hits=self.counters["history_hits"],
+            history_misses=self.counters["history_misses"],
+        )
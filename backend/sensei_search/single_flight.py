@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+from typing_extensions import TypedDict
+
+T = TypeVar("T")
+
+
+class SingleFlightStats(TypedDict):
+    calls: int
+    collapsed: int
+    in_flight: int
+
+
+class _Call(Generic[T]):
+    def __init__(self, task: asyncio.Future[T]) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces concurrent calls for the same key into a single in-flight call.
+
+    The first caller for a key starts the call, callers arriving while it is in flight
+    wait for the same result (or exception). Nothing is cached once the call completes.
+    The call is cancelled only when every waiter has been cancelled, so one client going
+    away doesn't fail the others.
+    """
+
+    _registry: Dict[str, SingleFlight] = {}
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: Dict[Hashable, _Call[T]] = {}
+        self._total = 0
+        self._collapsed = 0
+        SingleFlight._registry[name] = self
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        self._total += 1
+
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self._collapsed += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: Hashable, call: _Call[T]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> SingleFlightStats:
+        return SingleFlightStats(
+            calls=self._total, collapsed=self._collapsed, in_flight=len(self._calls)
+        )
+
+    @staticmethod
+    def all_stats() -> Dict[str, SingleFlightStats]:
+        return {name: sf.stats() for name, sf in SingleFlight._registry.items()}
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import List
+
+# Words that ask what kind of answer is wanted: "who invented the telephone" and "when
+# was the telephone invented" are different questions
+QUESTION_WORDS = {
+    "how",
+    "what",
+    "whats",
+    "when",
+    "where",
+    "which",
+    "who",
+    "why",
+}
+
+# Words that don't change what a text is about, ignored when scoring passages. Questions
+# are compared with their question words.
+STOP_WORDS = QUESTION_WORDS | {
+    "a",
+    "about",
+    "an",
+    "and",
+    "are",
+    "be",
+    "can",
+    "could",
+    "did",
+    "do",
+    "does",
+    "for",
+    "i",
+    "in",
+    "is",
+    "it",
+    "its",
+    "me",
+    "my",
+    "of",
+    "on",
+    "or",
+    "please",
+    "tell",
+    "that",
+    "the",
+    "there",
+    "this",
+    "to",
+    "was",
+    "were",
+    "you",
+    "your",
+}
+
+# Words keep their symbols ("c++", "c#", "node.js"), punctuation around them is dropped
+WORD_RE = re.compile(r"\w(?:[\w+#]|[.\-](?=\w))*")
+
+
+def words(text: str) -> List[str]:
+    return WORD_RE.findall(unicodedata.normalize("NFKC", text).casefold())
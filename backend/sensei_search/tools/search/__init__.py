@@ -1,13 +1,32 @@
 import os
+from typing import Dict, List
+
+from sensei_search.config import SEARCH_FUSION_MODE, SEARCH_PROVIDERS
 
 from .base import *
 from .bing import *
+from .cached import *
+from .fusion import *
 from .searxng import *
 
 
+def get_search_provider(name: str) -> SearchTool:
+    providers: Dict[str, SearchTool] = {"searxng": SearxNG(), "bing": Bing()}
+    if name not in providers:
+        raise ValueError(f"Unknown search provider: {name}")
+    return providers[name]
+
+
 def get_search_tool() -> SearchTool:
-    env = os.getenv("ENV", "development")
-    if env == "development":
-        return SearxNG()
-    else:
-        return Bing()
+    names: List[str] = [name.strip().lower() for name in SEARCH_PROVIDERS.split(",")]
+    names = [name for name in names if name]
+
+    if not names:
+        env = os.getenv("ENV", "development")
+        names = ["searxng"] if env == "development" else ["bing"]
+
+    if len(names) == 1:
+        return CachedSearchTool(get_search_provider(names[0]))
+
+    providers = [get_search_provider(name) for name in names]
+    return CachedSearchTool(FusedSearchTool(providers, mode=SEARCH_FUSION_MODE))
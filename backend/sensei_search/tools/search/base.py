@@ -4,14 +4,26 @@ import asyncio
 import os
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import Any, List, Union
-from urllib.parse import urljoin
+from typing import Any, List, Optional, Union
+from urllib.parse import urljoin, urlparse
 
-from aiohttp import ClientSession
+from aiohttp import ClientConnectionError, ClientTimeout
 from pydantic import BaseModel, Field
 from typing_extensions import TypedDict
 
+from sensei_search.cache import CacheStats, LRUCache
+from sensei_search.config import (
+    IMAGE_CHECK_CONCURRENCY,
+    IMAGE_CHECK_TIMEOUT,
+    IMAGE_FILTER_DEADLINE,
+    IMAGE_HOST_FAILURE_TTL,
+    IMAGE_VERDICT_CACHE_SIZE,
+    IMAGE_VERDICT_NEGATIVE_TTL,
+    IMAGE_VERDICT_TTL,
+)
+from sensei_search.http_client import HttpClient
 from sensei_search.logger import logger
+from sensei_search.single_flight import SingleFlight
 
 
 class BaseResult(TypedDict):
@@ -45,13 +57,68 @@ class TopResults(TypedDict):
     videos: List[VideoResult]
 
 
+class AccessibilityStats(TypedDict):
+    url_verdicts: CacheStats
+    unreachable_hosts: CacheStats
+
+
+# Thumbnails repeat heavily across queries, so we remember both positive and negative
+# verdicts per URL. Hosts that time out or refuse connections are also remembered for a
+# short while so that the other thumbnails they serve are not retried right away.
+_url_verdicts: LRUCache[bool] = LRUCache(
+    max_size=IMAGE_VERDICT_CACHE_SIZE, ttl=IMAGE_VERDICT_TTL
+)
+_unreachable_hosts: LRUCache[bool] = LRUCache(
+    max_size=IMAGE_VERDICT_CACHE_SIZE, ttl=IMAGE_HOST_FAILURE_TTL
+)
+_check_semaphore: Optional[asyncio.Semaphore] = None
+_head_flight: SingleFlight[bool] = SingleFlight("image_head")
+
+
+def _get_check_semaphore() -> asyncio.Semaphore:
+    # Created lazily so that it is bound to the running event loop
+    global _check_semaphore
+    if _check_semaphore is None:
+        _check_semaphore = asyncio.Semaphore(IMAGE_CHECK_CONCURRENCY)
+    return _check_semaphore
+
+
+def get_accessibility_stats() -> AccessibilityStats:
+    return AccessibilityStats(
+        url_verdicts=_url_verdicts.stats(),
+        unreachable_hosts=_unreachable_hosts.stats(),
+    )
+
+
 async def is_url_accessible(url: str) -> bool:
-    async with ClientSession() as session:
+    verdict = _url_verdicts.get(url)
+    if verdict is not None:
+        return verdict
+
+    host = urlparse(url).hostname or ""
+    if _unreachable_hosts.get(host):
+        return False
+
+    # The same thumbnails show up in concurrent searches, they share a single check
+    return await _head_flight.do(url, lambda: _check_url(url, host))
+
+
+async def _check_url(url: str, host: str) -> bool:
+    timeout = ClientTimeout(total=IMAGE_CHECK_TIMEOUT)
+    async with _get_check_semaphore():
         try:
-            async with session.head(url) as response:
-                return response.status == 200
-        except:
-            return False
+            async with HttpClient().session.head(url, timeout=timeout) as response:
+                verdict = response.status == 200
+        except (asyncio.TimeoutError, ClientConnectionError):
+            _unreachable_hosts.set(host, True)
+            verdict = False
+        except Exception:
+            verdict = False
+
+    _url_verdicts.set(
+        url, verdict, IMAGE_VERDICT_TTL if verdict else IMAGE_VERDICT_NEGATIVE_TTL
+    )
+    return verdict
 
 
 def get_top_results(
@@ -82,22 +149,32 @@ def get_top_results(
 async def filter_medium_by_accessibility(results: TopResults) -> TopResults:
     """
     Filter out images that are not accessible.
+
+    The checks share a deadline. Images that haven't been verified by then are dropped,
+    so a single slow host can't hold back the whole medium result.
     """
 
     logger.info("Filtering medium by accessibility")
     # Only accessible images are returned
     images = results["images"]
-    accessible_images = []
-
-    tasks = [is_url_accessible(image["img_src"]) for image in images]
-
-    accessibilities = await asyncio.gather(*tasks)
-
-    for i, accessible in enumerate(accessibilities):
-        if accessible:
-            accessible_images.append(images[i])
-
-    results["images"] = accessible_images
+    if not images:
+        return results
+
+    tasks = [
+        asyncio.ensure_future(is_url_accessible(image["img_src"])) for image in images
+    ]
+
+    done, pending = await asyncio.wait(tasks, timeout=IMAGE_FILTER_DEADLINE)
+    if pending:
+        logger.warning(
+            f"Dropping {len(pending)} of {len(tasks)} images not verified in time"
+        )
+        for task in pending:
+            task.cancel()
+
+    results["images"] = [
+        image for image, task in zip(images, tasks) if task in done and task.result()
+    ]
     return results
 
 
@@ -120,6 +197,13 @@ class Input(BaseModel):
 
 class SearchTool(ABC):
 
+    @property
+    def name(self) -> str:
+        """
+        A stable name for the provider, e.g. used in cache keys.
+        """
+        return type(self).__name__
+
     @staticmethod
     @abstractmethod
     async def search(args: Input) -> TopResults:
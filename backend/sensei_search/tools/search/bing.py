@@ -4,9 +4,8 @@ import asyncio
 import os
 from typing import Any, Callable, Coroutine, Dict, List, TypeVar
 
-from aiohttp import ClientSession
-
 from sensei_search.config import BING_API_KEY
+from sensei_search.http_client import HttpClient
 from sensei_search.logger import logger
 from sensei_search.tools.search.base import (
     Category,
@@ -103,12 +102,12 @@ class Bing(SearchTool):
         parse_function: Callable[[Dict[str, Any]], List[T]],
     ) -> List[T]:
         params = {"q": query, "count": MAX_RESULTS}
-        async with ClientSession() as session:
-            async with session.get(url, params=params, headers=headers) as response:
-                logger.debug(f"Response status code: {response.status}")
-                response.raise_for_status()
-                result = await response.json()
-                return parse_function(result)
+        session = HttpClient().session
+        async with session.get(url, params=params, headers=headers) as response:
+            logger.debug(f"Response status code: {response.status}")
+            response.raise_for_status()
+            result = await response.json()
+            return parse_function(result)
 
     @staticmethod
     def parse_web_results(results: Dict[str, Any]) -> List[GeneralResult]:
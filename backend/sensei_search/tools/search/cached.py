@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import re
+import unicodedata
+from datetime import datetime
+
+from typing_extensions import TypedDict
+
+from sensei_search.cache import CacheStats, LRUCache
+from sensei_search.chat_store import ChatStore
+from sensei_search.config import (
+    SEARCH_CACHE_FRESH_TTL,
+    SEARCH_CACHE_LOCAL_SIZE,
+    SEARCH_CACHE_LOCAL_TTL,
+    SEARCH_CACHE_TTL,
+)
+from sensei_search.logger import logger
+from sensei_search.single_flight import SingleFlight
+from sensei_search.tools.search.base import Category, Input, SearchTool, TopResults
+
+# Queries mentioning any of these terms are about things that change quickly,
+# so their results are only cached for a short while.
+FRESHNESS_TERMS = {
+    "today",
+    "tonight",
+    "yesterday",
+    "tomorrow",
+    "now",
+    "current",
+    "currently",
+    "latest",
+    "live",
+    "breaking",
+    "news",
+    "weather",
+    "forecast",
+    "score",
+    "scores",
+    "price",
+    "prices",
+    "stock",
+    "stocks",
+}
+
+
+class SearchCacheStats(TypedDict):
+    local_hits: int
+    remote_hits: int
+    misses: int
+    # Empty results, never cached
+    empty: int
+    local: CacheStats
+
+
+# Shared by all CachedSearchTool instances, get_search_tool() creates a new one per call
+_local_cache: LRUCache[TopResults] = LRUCache(
+    max_size=SEARCH_CACHE_LOCAL_SIZE, ttl=SEARCH_CACHE_LOCAL_TTL
+)
+_counters = {"local_hits": 0, "remote_hits": 0, "misses": 0, "empty": 0}
+_search_flight: SingleFlight[TopResults] = SingleFlight("search")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a search query so that trivially different spellings share a cache entry,
+    e.g. "How far is Mars?" and "how far is  MARS?" both become "how far is mars?".
+    Symbols are kept: "c++", "c#" and "c" are different queries.
+    """
+    query = unicodedata.normalize("NFKC", query).casefold()
+    return " ".join(query.split())
+
+
+def is_time_sensitive(normalized_query: str) -> bool:
+    words = set(re.findall(r"\w+", normalized_query))
+    return bool(words & FRESHNESS_TERMS) or str(datetime.now().year) in words
+
+
+class CachedSearchTool(SearchTool):
+    """
+    Wraps any SearchTool with a two-tier cache.
+
+    The first tier is an in-process LRU shared by all wrappers, the second tier is Redis
+    (reusing the ChatStore connection) so that results are shared across workers. Entries
+    are keyed by the provider, the normalized query and the set of categories. Queries that
+    look time sensitive are cached with a much shorter TTL.
+    """
+
+    def __init__(self, tool: SearchTool) -> None:
+        self.tool = tool
+
+    def _get_key(self, args: Input) -> str:
+        categories = sorted({Category(c).value for c in args.categories})
+        raw = f"{normalize_query(args.query)}|{','.join(categories)}"
+        digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        return f"search_cache:{self.tool.name}:{digest}"
+
+    def _get_ttl(self, args: Input) -> int:
+        if is_time_sensitive(normalize_query(args.query)):
+            return SEARCH_CACHE_FRESH_TTL
+        return SEARCH_CACHE_TTL
+
+    async def search(self, args: Input) -> TopResults:  # type: ignore[override]
+        key = self._get_key(args)
+
+        results = _local_cache.get(key)
+        if results is not None:
+            _counters["local_hits"] += 1
+            logger.info(f"Search cache hit (local) for {args.query}")
+            return copy.deepcopy(results)
+
+        # Concurrent identical searches share a single lookup, so each caller gets a copy
+        results = await _search_flight.do(key, lambda: self._search(key, args))
+        return copy.deepcopy(results)
+
+    async def _search(self, key: str, args: Input) -> TopResults:
+        ttl = self._get_ttl(args)
+
+        chat_store = ChatStore()
+        cached = await chat_store.get_cache(key)
+        if cached is not None:
+            _counters["remote_hits"] += 1
+            logger.info(f"Search cache hit (redis) for {args.query}")
+            results = json.loads(cached)
+            _local_cache.set(key, results, min(ttl, SEARCH_CACHE_LOCAL_TTL))
+            return results
+
+        _counters["misses"] += 1
+        results = await self.tool.search(args)
+
+        if not any(results.values()):
+            # Providers answer with empty results when their upstream engines fail or
+            # are rate limited, caching them would hide the query's results for hours
+            _counters["empty"] += 1
+            logger.warning(f"Not caching empty search results for {args.query}")
+            return results
+
+        _local_cache.set(key, results, min(ttl, SEARCH_CACHE_LOCAL_TTL))
+        await chat_store.set_cache(key, json.dumps(results), ttl)
+
+        return results
+
+    @staticmethod
+    def stats() -> SearchCacheStats:
+        return SearchCacheStats(
+            local_hits=_counters["local_hits"],
+            remote_hits=_counters["remote_hits"],
+            misses=_counters["misses"],
+            empty=_counters["empty"],
+            local=_local_cache.stats(),
+        )
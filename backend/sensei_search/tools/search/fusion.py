@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, List, Literal, Optional, Sequence
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sensei_search.config import (
+    SEARCH_FUSION_MIN_RESULTS,
+    SEARCH_PROVIDER_TIMEOUT,
+    SEARCH_RRF_K,
+)
+from sensei_search.logger import logger
+from sensei_search.tools.search.base import Category, Input, SearchTool, TopResults
+
+MAX_RESULTS = 5
+
+TRACKING_PARAMS = {"fbclid", "gclid", "msclkid", "ref", "ref_src"}
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Reduce a URL to a canonical form so that the same page returned by different
+    providers is recognized as a duplicate.
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith("utm_") and key not in TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/") or "/"
+
+    # Both schemes are treated as the same page
+    return urlunsplit(("", host, path, urlencode(query), ""))
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[str]], k: int = SEARCH_RRF_K
+) -> Dict[str, float]:
+    """
+    Score items by reciprocal rank fusion: each ranking contributes 1 / (k + rank) for
+    every item it contains, with ranks starting at 1.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def fuse_results(
+    results: Sequence[TopResults], categories: Sequence[Category]
+) -> TopResults:
+    """
+    Merge the results of several providers, de-duplicated by canonical URL and ranked by
+    reciprocal rank fusion. The fused score replaces the provider score.
+    """
+    fused: TopResults = {"general": [], "images": [], "videos": []}
+
+    for category in categories:
+        rankings: List[List[str]] = []
+        merged: Dict[str, Any] = {}
+
+        for result in results:
+            ranking = []
+            for item in result[category.value]:
+                key = canonicalize_url(item["url"])
+                if key in merged:
+                    # Keep the first provider's item but remember every engine that found it
+                    engines = merged[key]["engines"]
+                    merged[key]["engines"] = engines + [
+                        engine for engine in item["engines"] if engine not in engines
+                    ]
+                    if not merged[key]["content"] and item["content"]:
+                        merged[key]["content"] = item["content"]
+                else:
+                    merged[key] = {**item, "engines": list(item["engines"])}
+                if key not in ranking:
+                    ranking.append(key)
+            rankings.append(ranking)
+
+        scores = reciprocal_rank_fusion(rankings)
+        ranked = sorted(scores, key=lambda key: scores[key], reverse=True)
+
+        fused[category.value] = [  # type: ignore[typeddict-item]
+            {**merged[key], "score": scores[key]} for key in ranked[:MAX_RESULTS]
+        ]
+
+    return fused
+
+
+class FusedSearchTool(SearchTool):
+    """
+    Queries several search providers concurrently and merges their results.
+
+    In the "fuse" mode the providers are awaited for up to SEARCH_PROVIDER_TIMEOUT
+    seconds, and the results that arrived are merged with reciprocal rank fusion. If none
+    did, the first one to arrive is used. A failing provider is logged and skipped.
+
+    In the "first" mode the first provider to return a good enough result (at least
+    `SEARCH_FUSION_MIN_RESULTS` results for every requested category) wins and the other
+    requests are cancelled. If no provider is good enough, the results are fused.
+
+    Without categories, the general category is searched.
+    """
+
+    def __init__(
+        self, providers: List[SearchTool], mode: Literal["fuse", "first"] = "fuse"
+    ) -> None:
+        self.providers = providers
+        self.mode = mode
+
+    @property
+    def name(self) -> str:
+        return "+".join(provider.name for provider in self.providers)
+
+    async def search(self, args: Input) -> TopResults:  # type: ignore[override]
+        if not args.categories:
+            args = args.model_copy(update={"categories": [Category.general]})
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SEARCH_PROVIDER_TIMEOUT
+        pending = {
+            asyncio.ensure_future(provider.search(args)) for provider in self.providers
+        }
+        results: List[TopResults] = []
+
+        try:
+            while pending:
+                timeout: Optional[float] = deadline - loop.time()
+                if timeout is not None and timeout <= 0:
+                    if results:
+                        logger.warning(
+                            f"Fusing without {len(pending)} slow search provider(s)"
+                        )
+                        break
+                    # Nothing yet, wait for the first provider to answer
+                    timeout = None
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        logger.exception(f"Search provider failed: {e}")
+                        continue
+
+                    if self.mode == "first" and self._is_good_enough(result, args):
+                        return result
+                    results.append(result)
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if not results:
+            raise RuntimeError("All search providers failed")
+
+        return fuse_results(results, args.categories)
+
+    @staticmethod
+    def _is_good_enough(result: TopResults, args: Input) -> bool:
+        return all(
+            len(result[category.value]) >= SEARCH_FUSION_MIN_RESULTS
+            for category in args.categories
+        )
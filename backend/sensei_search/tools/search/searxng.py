@@ -2,9 +2,8 @@ from __future__ import annotations
 
 from urllib.parse import urljoin
 
-from aiohttp import ClientSession
-
 from sensei_search.config import SEARXNG_URL
+from sensei_search.http_client import HttpClient
 from sensei_search.logger import logger
 from sensei_search.tools.search.base import (
     Input,
@@ -65,12 +64,12 @@ class SearxNG(SearchTool):
         if categories:
             params["categories"] = ",".join(categories)
 
-        async with ClientSession() as session:
-            async with session.get(searxng_url, params=params) as response:
-                logger.debug(f"Response status code: {response.status}")
+        session = HttpClient().session
+        async with session.get(searxng_url, params=params) as response:
+            logger.debug(f"Response status code: {response.status}")
 
-                response.raise_for_status()
-                result = await response.json()
+            response.raise_for_status()
+            result = await response.json()
 
         final: TopResults = {
             "general": [],
@@ -0,0 +1,368 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientResponse, ClientTimeout
+from typing_extensions import TypedDict
+
+from sensei_search.cache import CacheStats, LRUCache
+from sensei_search.chat_store import ChatStore
+from sensei_search.config import (
+    FETCH_HARD_DEADLINE,
+    FETCH_HEDGE_AFTER,
+    FETCH_QUORUM,
+    FETCH_SOFT_DEADLINE,
+    PAGE_CACHE_FRESH_TTL,
+    PAGE_CACHE_LOCAL_MAX_BYTES,
+    PAGE_CACHE_LOCAL_SIZE,
+    PAGE_CACHE_MAX_TEXT_CHARS,
+    PAGE_CACHE_TTL,
+    PAGE_MAX_BYTES,
+)
+from sensei_search.extractor import Extractor
+from sensei_search.http_client import HttpClient
+from sensei_search.logger import logger
+from sensei_search.single_flight import SingleFlight
+
+FETCH_WEBPAGE_TIMEOUT = 3
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Only these content types are worth handing to the extractor
+HTML_CONTENT_TYPES = {"text/html", "application/xhtml+xml", "text/plain"}
+
+META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w.:-]+)""", re.IGNORECASE)
+
+
+class CachedPage(TypedDict):
+    url: str
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # Unix timestamp after which the page must be revalidated before being served
+    fresh_until: float
+
+
+class PageCacheStats(TypedDict):
+    fresh_hits: int
+    revalidated: int
+    misses: int
+    local: CacheStats
+
+
+class DeadlineFetchResult(TypedDict):
+    # Aligned with the requested URLs, pages that didn't arrive in time are empty strings
+    pages: List[str]
+    dropped: List[str]
+
+
+class FetchStats(TypedDict):
+    deadline_fetches: int
+    hedged: int
+    dropped: int
+    skipped_content_type: int
+    truncated: int
+
+
+_fetch_counters = {
+    "deadline_fetches": 0,
+    "hedged": 0,
+    "dropped": 0,
+    "skipped_content_type": 0,
+    "truncated": 0,
+}
+
+
+_page_flight: SingleFlight[str] = SingleFlight("page")
+
+
+class PageCache:
+    """
+    Caches the extracted text of web pages, keyed by URL.
+
+    Entries are kept in an in-process LRU bounded by the total size of the extracted text,
+    and in Redis (reusing the ChatStore connection) so that they survive restarts and are
+    shared across workers. The text of each page is capped to PAGE_CACHE_MAX_TEXT_CHARS
+    to bound the Redis memory. Along with the text, the ETag and Last-Modified validators are
+    stored so that stale entries can be revalidated with a conditional GET.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args: Any, **kwargs: Any) -> PageCache:
+        # Ensure only one instance of PageCache is created
+        if not cls._instance:
+            cls._instance = super(PageCache, cls).__new__(cls, *args, **kwargs)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not hasattr(self, "local"):
+            self.local: LRUCache[CachedPage] = LRUCache(
+                max_size=PAGE_CACHE_LOCAL_SIZE,
+                ttl=PAGE_CACHE_TTL,
+                max_weight=PAGE_CACHE_LOCAL_MAX_BYTES,
+                weigher=lambda page: len(page["text"]),
+            )
+            self.counters: Dict[str, int] = {
+                "fresh_hits": 0,
+                "revalidated": 0,
+                "misses": 0,
+            }
+
+    def _get_key(self, url: str) -> str:
+        return f"page_cache:{url}"
+
+    async def get(self, url: str) -> Optional[CachedPage]:
+        page = self.local.get(url)
+        if page is not None:
+            return page
+
+        cached = await ChatStore().get_cache(self._get_key(url))
+        if cached is None:
+            return None
+
+        page = json.loads(cached)
+        self.local.set(url, page)
+        return page
+
+    async def set(self, page: CachedPage) -> None:
+        # Still far more text than the context budgets of the models
+        page = CachedPage(**{**page, "text": page["text"][:PAGE_CACHE_MAX_TEXT_CHARS]})
+        self.local.set(page["url"], page)
+        await ChatStore().set_cache(
+            self._get_key(page["url"]), json.dumps(page), PAGE_CACHE_TTL
+        )
+
+    def stats(self) -> PageCacheStats:
+        return PageCacheStats(
+            fresh_hits=self.counters["fresh_hits"],
+            revalidated=self.counters["revalidated"],
+            misses=self.counters["misses"],
+            local=self.local.stats(),
+        )
+
+
+def detect_charset(response: ClientResponse, body: bytearray) -> str:
+    """
+    Find the page encoding from the Content-Type header or a <meta> tag near the top of
+    the page, falling back to UTF-8. This avoids the statistical detection aiohttp runs
+    when the header doesn't specify one.
+    """
+    candidates = [response.charset]
+    match = META_CHARSET_RE.search(body, 0, 2048)
+    if match:
+        candidates.append(match.group(1).decode("ascii"))
+
+    for charset in candidates:
+        if not charset:
+            continue
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            continue
+    return "utf-8"
+
+
+async def read_html(response: ClientResponse, max_bytes: int = PAGE_MAX_BYTES) -> str:
+    """
+    Read at most `max_bytes` of an HTML response body. Returns an empty string without
+    reading the body if the response isn't HTML (e.g. a PDF).
+    """
+    # aiohttp reports application/octet-stream when the header is missing, in which
+    # case we give the page the benefit of the doubt
+    has_content_type = "Content-Type" in response.headers
+    if has_content_type and response.content_type not in HTML_CONTENT_TYPES:
+        _fetch_counters["skipped_content_type"] += 1
+        logger.info(
+            f"Skipping {response.url} with content type {response.content_type}"
+        )
+        return ""
+
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+        body += chunk
+        if len(body) >= max_bytes:
+            _fetch_counters["truncated"] += 1
+            # Truncate in place, the rest of the body is never read
+            del body[max_bytes:]
+            break
+
+    return body.decode(detect_charset(response, body), errors="replace")
+
+
+async def fetch_page(url: str) -> str:
+    """
+    Fetch a web page and extract its main text. Concurrent fetches of the same URL share
+    a single request.
+    """
+    return await _page_flight.do(url, lambda: _fetch_page(url))
+
+
+async def _fetch_page(url: str) -> str:
+    """
+    Fetch a web page and extract its main text.
+
+    Fresh cache entries are served without any network I/O. Stale entries are revalidated
+    with a conditional GET, and a 304 response reuses the cached text without extracting
+    the page again. Returns an empty string if the page couldn't be fetched.
+    """
+    page_cache = PageCache()
+    cached = await page_cache.get(url)
+
+    if cached is not None and cached["fresh_until"] > time.time():
+        page_cache.counters["fresh_hits"] += 1
+        return cached["text"]
+
+    headers = {}
+    if cached is not None:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    timeout = ClientTimeout(total=FETCH_WEBPAGE_TIMEOUT)
+    try:
+        async with HttpClient().session.get(
+            url, headers=headers, timeout=timeout
+        ) as response:
+            if response.status == 304 and cached is not None:
+                page_cache.counters["revalidated"] += 1
+                cached["fresh_until"] = time.time() + PAGE_CACHE_FRESH_TTL
+                await page_cache.set(cached)
+                return cached["text"]
+
+            html = await read_html(response)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            cacheable = response.status == 200 and "no-store" not in (
+                response.headers.get("Cache-Control", "")
+            )
+    except asyncio.TimeoutError:
+        logger.warning(f"Timeout occurred when fetching {url}")
+        return ""
+    except Exception as e:
+        logger.exception(f"Error fetching {url}: {e}")
+        return ""
+
+    page_cache.counters["misses"] += 1
+    if not html:
+        return ""
+
+    text = await Extractor().extract(html)
+
+    if text and cacheable:
+        await page_cache.set(
+            CachedPage(
+                url=url,
+                text=text,
+                etag=etag,
+                last_modified=last_modified,
+                fresh_until=time.time() + PAGE_CACHE_FRESH_TTL,
+            )
+        )
+
+    return text
+
+
+async def fetch_pages(urls: List[str]) -> List[str]:
+    """
+    Fetch and extract several web pages concurrently, in the order of `urls`.
+    """
+    return await asyncio.gather(*[fetch_page(url) for url in urls])
+
+
+async def fetch_page_hedged(url: str, hedge_after: Optional[float]) -> str:
+    """
+    Fetch a web page, firing a duplicate request if the first one hasn't completed after
+    `hedge_after` seconds. Whichever request returns content first wins.
+    """
+    tasks = [asyncio.ensure_future(fetch_page(url))]
+    try:
+        if hedge_after is None:
+            return await tasks[0]
+
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            _fetch_counters["hedged"] += 1
+            logger.info(f"Hedging slow request to {url}")
+            # The duplicate bypasses single-flight, it would join the slow request
+            tasks.append(asyncio.ensure_future(_fetch_page(url)))
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                text = task.result()
+                if text:
+                    return text
+        return ""
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def fetch_pages_by_deadline(
+    urls: List[str],
+    soft_deadline: float = FETCH_SOFT_DEADLINE,
+    quorum: int = FETCH_QUORUM,
+    hard_deadline: float = FETCH_HARD_DEADLINE,
+    hedge_after: Optional[float] = FETCH_HEDGE_AFTER,
+) -> DeadlineFetchResult:
+    """
+    Fetch several web pages, returning early instead of waiting for the slowest one.
+
+    Once `soft_deadline` seconds have passed and at least `quorum` pages have content, the
+    pages that arrived so far are returned. Whatever happens, nothing is awaited past
+    `hard_deadline`. Stragglers are cancelled and reported as dropped.
+    """
+    _fetch_counters["deadline_fetches"] += 1
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
+    quorum = min(quorum, len(urls))
+
+    tasks = [asyncio.ensure_future(fetch_page_hedged(url, hedge_after)) for url in urls]
+    pending = set(tasks)
+
+    try:
+        while pending:
+            elapsed = loop.time() - started_at
+            arrived = sum(1 for task in tasks if task.done() and task.result())
+            if elapsed >= soft_deadline and arrived >= quorum:
+                break
+
+            deadline = soft_deadline if elapsed < soft_deadline else hard_deadline
+            if elapsed >= deadline:
+                break
+
+            _, pending = await asyncio.wait(
+                pending, timeout=deadline - elapsed, return_when=asyncio.FIRST_COMPLETED
+            )
+    finally:
+        # Also when the caller is cancelled, e.g. the client went away
+        for task in pending:
+            task.cancel()
+
+    pages = [task.result() if task.done() else "" for task in tasks]
+    dropped = [url for url, task in zip(urls, tasks) if task in pending]
+    if dropped:
+        _fetch_counters["dropped"] += len(dropped)
+        logger.info(f"Dropped pages not fetched in time: {dropped}")
+
+    return DeadlineFetchResult(pages=pages, dropped=dropped)
+
+
+def get_fetch_stats() -> FetchStats:
+    return FetchStats(
+        deadline_fetches=_fetch_counters["deadline_fetches"],
+        hedged=_fetch_counters["hedged"],
+        dropped=_fetch_counters["dropped"],
+        skipped_content_type=_fetch_counters["skipped_content_type"],
+        truncated=_fetch_counters["truncated"],
+    )
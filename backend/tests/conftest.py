@@ -0,0 +1,23 @@
+from typing import Iterator
+
+import pytest
+
+from benchmarks.agent_latency import configure_env, free_port
+from benchmarks.fakes import FakeServices, FakeSettings
+
+# The config of sensei_search is read when it's first imported, point it at the fake
+# services before any test module imports it
+FAKE_SERVICES_PORT = free_port()
+configure_env(f"http://127.0.0.1:{FAKE_SERVICES_PORT}", "localhost")
+
+
+@pytest.fixture
+def fake_services() -> Iterator[FakeServices]:
+    """
+    The LLM, search and web page services the agents talk to, with a short answer
+    streamed slowly enough for concurrent sessions to overlap.
+    """
+    fakes = FakeServices(FakeSettings(answer_tokens=40, llm_tokens_per_second=40.0))
+    fakes.start_in_thread("127.0.0.1", FAKE_SERVICES_PORT)
+    yield fakes
+    fakes.stop_thread()
@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from sensei_search.answer_cache import MinHashIndex, content_words, jaccard
+from sensei_search.config import ANSWER_CACHE_SIMILARITY
+
+SAME_QUESTION = [
+    ("how far is mars", "How far away is Mars?"),
+    ("Why is the sky blue?", "why is the sky  blue"),
+]
+
+DIFFERENT_QUESTIONS = [
+    ("who invented the telephone", "when was the telephone invented"),
+    ("where was einstein born", "when was einstein born"),
+    ("why is the sky blue", "is the sky blue"),
+    ("c++ tutorial", "c# tutorial"),
+    ("c++ tutorial", "c tutorial"),
+    ("best laptop 2023", "best laptop 2024"),
+]
+
+
+def match(cached: str, query: str) -> float:
+    index = MinHashIndex(max_size=10)
+    index.add("key", content_words(cached), time.time() + 60)
+    found = index.query(content_words(query))
+    return 0.0 if found is None else found[1]
+
+
+def test_content_words_keep_question_words_and_symbols() -> None:
+    assert content_words("Who invented the telephone?") == {
+        "who",
+        "invented",
+        "telephone",
+    }
+    assert content_words("C++ tutorial") == {"c++", "tutorial"}
+    assert content_words("c# tutorial") == {"c#", "tutorial"}
+
+
+@pytest.mark.parametrize("cached, query", SAME_QUESTION)
+def test_paraphrases_match(cached: str, query: str) -> None:
+    assert match(cached, query) >= ANSWER_CACHE_SIMILARITY
+
+
+@pytest.mark.parametrize("cached, query", DIFFERENT_QUESTIONS)
+def test_different_questions_dont_match(cached: str, query: str) -> None:
+    assert match(cached, query) < ANSWER_CACHE_SIMILARITY
+
+
+def test_jaccard() -> None:
+    assert jaccard(frozenset({"a", "b"}), frozenset({"b", "c"})) == pytest.approx(1 / 3)
+    assert jaccard(frozenset(), frozenset()) == 1.0
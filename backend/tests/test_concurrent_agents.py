@@ -0,0 +1,103 @@
+import asyncio
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+from benchmarks.agent_latency import monitor_loop_lag
+from benchmarks.fakes import FakeServices
+from sensei_search.agents import SamuraiAgent
+from sensei_search.chat_store import ChatStore
+from sensei_search.extractor import Extractor
+from sensei_search.http_client import HttpClient
+from sensei_search.llm_clients import LLMClients
+
+SESSIONS = 3
+# Much longer than anything the agents do on the event loop between two awaits
+MAX_LOOP_LAG = 0.5
+
+
+class SessionEmitter:
+    """
+    Records the events of one session, in the order all sessions emitted them.
+    """
+
+    def __init__(self, session: int, events: List[Tuple[int, str]]) -> None:
+        self.session = session
+        self.events = events
+
+    async def emit(self, event: str, data: Dict) -> None:
+        self.events.append((self.session, event))
+
+
+@pytest.fixture
+def in_memory_store(monkeypatch: pytest.MonkeyPatch) -> None:
+    cache: Dict[str, str] = {}
+
+    async def get_cache(self: ChatStore, key: str) -> Optional[str]:
+        return cache.get(key)
+
+    async def set_cache(self: ChatStore, key: str, value: str, ttl: int) -> None:
+        cache[key] = value
+
+    async def nothing(self: ChatStore, *args: Any) -> None:
+        return None
+
+    async def no_history(self: ChatStore, thread_id: str) -> List:
+        return []
+
+    async def no_entries(self: ChatStore, key: str) -> Dict:
+        return {}
+
+    monkeypatch.setattr(ChatStore, "get_cache", get_cache)
+    monkeypatch.setattr(ChatStore, "set_cache", set_cache)
+    monkeypatch.setattr(ChatStore, "get_chat_history", no_history)
+    monkeypatch.setattr(ChatStore, "get_index_entries", no_entries)
+    for name in [
+        "create_thread",
+        "update_thread",
+        "get_thread_metadata",
+        "save_chat_history",
+        "set_index_entry",
+        "delete_index_entries",
+    ]:
+        monkeypatch.setattr(ChatStore, name, nothing)
+
+
+async def run_sessions(events: List[Tuple[int, str]], lags: List[float]) -> None:
+    await HttpClient().start()
+    monitor = asyncio.ensure_future(monitor_loop_lag(lags))
+    try:
+        await asyncio.gather(
+            *[
+                SamuraiAgent(
+                    emitter=SessionEmitter(session, events),
+                    thread_id=str(uuid.uuid4()),
+                    user_id=str(uuid.uuid4()),
+                ).run(f"How far is Mars? bench-{session}{uuid.uuid4().hex[:6]}")
+                for session in range(SESSIONS)
+            ]
+        )
+    finally:
+        monitor.cancel()
+        await HttpClient().close()
+        await LLMClients().close()
+        Extractor().close()
+
+
+def test_concurrent_sessions_stream_together(
+    fake_services: FakeServices, in_memory_store: None
+) -> None:
+    events: List[Tuple[int, str]] = []
+    lags: List[float] = []
+
+    asyncio.run(run_sessions(events, lags))
+
+    answers = [session for session, event in events if event == "answer"]
+    assert set(answers) == set(range(SESSIONS))
+    # Every session got its answer chunks while the others were streaming theirs
+    for session in range(SESSIONS):
+        first = answers.index(session)
+        last = len(answers) - 1 - answers[::-1].index(session)
+        assert set(answers[first : last + 1]) == set(range(SESSIONS))
+    assert max(lags) < MAX_LOOP_LAG
@@ -0,0 +1,35 @@
+import asyncio
+import json
+from typing import Dict
+
+import pytest
+
+from sensei_search.chat_store import ChatStore
+from sensei_search.config import PAGE_CACHE_MAX_TEXT_CHARS, PAGE_CACHE_TTL
+from sensei_search.web_pages import CachedPage, PageCache
+
+
+def test_stored_text_is_capped(monkeypatch: pytest.MonkeyPatch) -> None:
+    stored: Dict[str, str] = {}
+    ttls: Dict[str, int] = {}
+
+    async def set_cache(self: ChatStore, key: str, value: str, ttl: int) -> None:
+        stored[key] = value
+        ttls[key] = ttl
+
+    monkeypatch.setattr(ChatStore, "set_cache", set_cache)
+
+    url = "https://example.com/long-page"
+    page = CachedPage(
+        url=url,
+        text="x" * (PAGE_CACHE_MAX_TEXT_CHARS * 2),
+        etag=None,
+        last_modified=None,
+        fresh_until=0.0,
+    )
+    asyncio.run(PageCache().set(page))
+
+    (key,) = stored
+    assert len(json.loads(stored[key])["text"]) == PAGE_CACHE_MAX_TEXT_CHARS
+    assert ttls[key] == PAGE_CACHE_TTL
+    assert len(asyncio.run(PageCache().get(url))["text"]) == PAGE_CACHE_MAX_TEXT_CHARS
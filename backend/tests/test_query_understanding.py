@@ -0,0 +1,30 @@
+from typing import List
+
+from sensei_search.base_agent import parse_enriched_query
+from sensei_search.logger import logger
+
+
+def test_braces_around_the_json_are_ignored() -> None:
+    content = (
+        "Here is the {classification} you asked for:\n"
+        '{"search_query": "rust borrow checker", "needs_image": true}\n'
+        "Let me know if {anything} else is needed."
+    )
+
+    query = parse_enriched_query(content, "fallback")
+
+    assert query["search_query"] == "rust borrow checker"
+    assert query["tags"]["needs_image"] is True
+
+
+def test_empty_reply_falls_back_without_warning() -> None:
+    warnings: List[str] = []
+    sink = logger.add(warnings.append, level="WARNING")
+    try:
+        query = parse_enriched_query("", "what is rust")
+    finally:
+        logger.remove(sink)
+
+    assert query["search_query"] == "what is rust"
+    assert query["tags"]["needs_search"] is True
+    assert warnings == []
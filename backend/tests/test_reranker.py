@@ -0,0 +1,24 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+from sensei_search import reranker
+from sensei_search.extractor import Extractor
+
+
+def test_pages_are_kept_when_reranking_times_out(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    async def busy_pool(self: Extractor, fn: Any, *args: Any) -> Any:
+        # The extraction workers are all busy with pages
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(Extractor, "run", busy_pool)
+    monkeypatch.setattr(reranker, "RERANK_TIMEOUT", 0.05)
+
+    pages = ["Mars is the fourth planet from the Sun.", "Unrelated page."]
+    timed_out = reranker.get_reranker_stats()["timed_out"]
+
+    assert asyncio.run(reranker.rerank_pages("mars planet", pages)) == pages
+    assert reranker.get_reranker_stats()["timed_out"] == timed_out + 1
@@ -0,0 +1,77 @@
+import asyncio
+from typing import Dict, Optional
+
+import pytest
+
+from sensei_search.chat_store import ChatStore
+from sensei_search.tools.search import Input, SearchTool, TopResults
+from sensei_search.tools.search.cached import CachedSearchTool
+
+
+class FakeSearch(SearchTool):
+    def __init__(self, results: TopResults) -> None:
+        self.results = results
+        self.calls = 0
+
+    @property
+    def name(self) -> str:
+        return "fake"
+
+    def description(self) -> str:
+        return "fake"
+
+    async def search(self, args: Input) -> TopResults:  # type: ignore[override]
+        self.calls += 1
+        return self.results
+
+
+@pytest.fixture
+def redis_cache(monkeypatch: pytest.MonkeyPatch) -> Dict[str, str]:
+    cache: Dict[str, str] = {}
+
+    async def get_cache(self: ChatStore, key: str) -> Optional[str]:
+        return cache.get(key)
+
+    async def set_cache(self: ChatStore, key: str, value: str, ttl: int) -> None:
+        cache[key] = value
+
+    monkeypatch.setattr(ChatStore, "get_cache", get_cache)
+    monkeypatch.setattr(ChatStore, "set_cache", set_cache)
+    return cache
+
+
+def test_empty_results_are_not_cached(redis_cache: Dict[str, str]) -> None:
+    tool = FakeSearch({"general": [], "images": [], "videos": []})
+    cached = CachedSearchTool(tool)
+    args = Input(query="empty results query", categories=["general"])
+
+    asyncio.run(cached.search(args))
+    asyncio.run(cached.search(args))
+
+    assert tool.calls == 2
+    assert redis_cache == {}
+
+
+def test_results_are_cached(redis_cache: Dict[str, str]) -> None:
+    result = {"url": "https://example.com", "title": "t", "content": "c"}
+    tool = FakeSearch({"general": [result], "images": [], "videos": []})
+    cached = CachedSearchTool(tool)
+    args = Input(query="cached results query", categories=["general"])
+
+    first = asyncio.run(cached.search(args))
+    second = asyncio.run(cached.search(args))
+
+    assert tool.calls == 1
+    assert first == second
+    assert len(redis_cache) == 1
+
+
+def test_symbols_are_different_queries(redis_cache: Dict[str, str]) -> None:
+    result = {"url": "https://example.com", "title": "t", "content": "c"}
+    tool = FakeSearch({"general": [result], "images": [], "videos": []})
+    cached = CachedSearchTool(tool)
+
+    for query in ["c++ tutorial", "c# tutorial", "c tutorial"]:
+        asyncio.run(cached.search(Input(query=query, categories=["general"])))
+
+    assert tool.calls == 3